@@ -0,0 +1,275 @@
+"""Benchmarks the whole pipeline on synthetic corpora of known contents.
+
+For every corpus size and format, a corpus is rendered (see
+`synthetic_sheets`) unless it already exists. It is then processed just like
+the CLI would, in a fresh process so its peak memory use can be measured. The
+run reports:
+    * throughput and peak RSS;
+    * p50/p95/max time per page of every stage, from `metrics`;
+    * time spent scoring and writing the CSV and PDF output;
+    * accuracy: the share of fields and answers read exactly as rendered.
+
+Reading fewer pages, fields or answers correctly than `--min-accuracy` fails
+the run, so a speedup can't silently lower read quality.
+
+Every format also gets a corpus rendered below `grid_info.MIN_RELIABLE_DPI`,
+at `synthetic_sheets.BELOW_FLOOR_DPI`. It is reported but not held to
+`--min-accuracy`, and shows whether the floor is still where pages start to be
+rejected.
+
+Usage: python benchmarks/run_benchmarks.py [--pages 10 100 1000] [--formats tif pdf]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+
+import synthetic_sheets
+
+import data_exporting  # noqa: E402 (made importable by synthetic_sheets)
+import grid_info as grid_i  # noqa: E402
+from process_input import process_input  # noqa: E402
+
+DEFAULT_PAGE_COUNTS = [10, 100, 1000]
+DEFAULT_FORMATS = ["tif", "pdf"]
+DEFAULT_CORPUS_DIR = pathlib.Path(
+    tempfile.gettempdir()) / "kei-open-mcr-benchmarks"
+
+"""Stages shown in the summary table, in pipeline order."""
+REPORTED_STAGES = [
+    "decode", "remove_hf_noise", "threshold", "find_corner_marks", "dilate",
+    "grid", "fill_percents", "fill_threshold"
+]
+REPORTED_BATCH_STAGES = ["scoring", "csv", "pdf"]
+
+
+def get_peak_rss_mb() -> tp.Optional[float]:
+    """Peak resident memory of this process and its finished children, or
+    `None` where it can't be measured."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def check_accuracy(output_folder: pathlib.Path,
+                   truth: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+    """Compare the results and keys saved to the output folder with the
+    contents every page was rendered with."""
+    rows: tp.Dict[str, tp.Dict[str, str]] = {}
+    for filebasename in ("results", "keys"):
+        path = output_folder / f"{filebasename}.csv"
+        if path.is_file():
+            with open(str(path), newline="") as file:
+                for row in csv.DictReader(file):
+                    rows[row[data_exporting.COLUMN_NAMES[
+                        grid_i.Field.IMAGE_FILE]]] = row
+
+    unread_pages = 0
+    fields_checked = field_errors = 0
+    answers_checked = answer_errors = 0
+    for page, expected in truth.items():
+        row = rows.get(page)
+        if row is None:
+            unread_pages += 1
+            continue
+        for field_name, value in expected["fields"].items():
+            column = data_exporting.COLUMN_NAMES[grid_i.Field[field_name]]
+            # Keys only keep the test form code.
+            if column in row:
+                fields_checked += 1
+                field_errors += row[column] != value
+        for i, answer in enumerate(expected["answers"]):
+            answers_checked += 1
+            answer_errors += (row.get(f"Q{i + 1}") or "") != answer
+    return {
+        "unread_pages": unread_pages,
+        "page_accuracy": 1 - unread_pages / max(len(truth), 1),
+        "field_accuracy": 1 - field_errors / max(fields_checked, 1),
+        "answer_accuracy": 1 - answer_errors / max(answers_checked, 1)
+    }
+
+
+def run_one(corpus: pathlib.Path, workers: int) -> tp.Dict[str, tp.Any]:
+    """Process a corpus the way the CLI does and measure it."""
+    with open(str(corpus.with_suffix(".json"))) as file:
+        truth = json.load(file)
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_folder = pathlib.Path(output_dir)
+        metrics_path = output_folder / "metrics.jsonl"
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            process_input("Benchmark", [corpus],
+                          output_folder,
+                          False,
+                          False,
+                          grid_i.form_75q,
+                          None,
+                          None,
+                          workers=workers,
+                          metrics_path=metrics_path)
+        wall_time = time.perf_counter() - start_time
+        with open(str(metrics_path)) as file:
+            batch = json.loads(file.readlines()[-1])
+        accuracy = check_accuracy(output_folder, truth)
+    return {
+        "corpus": corpus.name,
+        "pages": len(truth),
+        "workers": workers,
+        "wall_s": round(wall_time, 3),
+        "pages_per_s": round(len(truth) / wall_time, 2),
+        "peak_rss_mb": get_peak_rss_mb(),
+        "page_stages": batch["page_summary"]["stages"],
+        "batch_stages": batch["stages"],
+        **accuracy
+    }
+
+
+def get_corpus(corpus_dir: pathlib.Path, num_pages: int, file_format: str,
+               seed: int, dpi: tp.Optional[int] = None) -> pathlib.Path:
+    """Get the path of a corpus, rendering it first if it doesn't exist. All
+    its pages are rendered at `dpi` if given."""
+    resolution = f"{dpi}dpi_" if dpi is not None else ""
+    corpus = corpus_dir / (f"synthetic_v{synthetic_sheets.CORPUS_VERSION}_"
+                           f"{resolution}{num_pages}_{seed}.{file_format}")
+    if not corpus.is_file() or not corpus.with_suffix(".json").is_file():
+        print(f"Rendering {corpus}...", file=sys.stderr)
+        corpus_dir.mkdir(parents=True, exist_ok=True)
+        synthetic_sheets.write_corpus(corpus, num_pages, seed, dpi=dpi)
+    return corpus
+
+
+def benchmark_corpus(corpus: pathlib.Path, workers: int) -> tp.Dict[str, tp.Any]:
+    """Benchmark a corpus in a fresh process, which keeps peak memory use
+    separate from other runs."""
+    print(f"Benchmarking {corpus}...", file=sys.stderr)
+    completed = subprocess.run([
+        sys.executable, __file__, "--run-one",
+        str(corpus), "--workers",
+        str(workers)
+    ],
+                               stdout=subprocess.PIPE,
+                               check=True,
+                               universal_newlines=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def print_report(results: tp.List[tp.Dict[str, tp.Any]]):
+    print(f"{'corpus':<30}{'pages':>7}{'wall s':>9}{'pages/s':>9}"
+          f"{'peak MB':>9}{'unread':>8}{'fields':>9}{'answers':>9}")
+    for result in results:
+        peak = result["peak_rss_mb"]
+        print(f"{result['corpus']:<30}{result['pages']:>7}"
+              f"{result['wall_s']:>9.2f}{result['pages_per_s']:>9.2f}"
+              f"{peak if peak is None else round(peak):>9}"
+              f"{result['unread_pages']:>8}"
+              f"{result['field_accuracy']:>9.2%}{result['answer_accuracy']:>9.2%}")
+    print()
+    print(f"{'ms per page (p50/p95/max)':<26}" +
+          "".join(f"{result['corpus']:>30}" for result in results))
+    for stage in REPORTED_STAGES:
+        cells = []
+        for result in results:
+            summary = result["page_stages"].get(stage)
+            cells.append("-" if summary is None else
+                         "{p50:.1f}/{p95:.1f}/{max:.1f}".format(
+                             **summary["wall_ms"]))
+        print(f"{stage:<26}" + "".join(f"{cell:>30}" for cell in cells))
+    for stage in REPORTED_BATCH_STAGES:
+        cells = []
+        for result in results:
+            summary = result["batch_stages"].get(stage)
+            cells.append("-" if summary is None else
+                         f"{summary['wall_ms']:.1f} total")
+        print(f"{stage:<26}" + "".join(f"{cell:>30}" for cell in cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark OpenMCR on synthetic bubble sheets.")
+    parser.add_argument("--pages",
+                        type=int,
+                        nargs="+",
+                        default=DEFAULT_PAGE_COUNTS,
+                        help="Corpus sizes to benchmark, in pages.")
+    parser.add_argument("--formats",
+                        nargs="+",
+                        choices=DEFAULT_FORMATS,
+                        default=DEFAULT_FORMATS,
+                        help="Corpus file formats to benchmark.")
+    parser.add_argument("--below-floor-pages",
+                        type=int,
+                        default=100,
+                        help="Size of the corpus rendered below the minimum reliable resolution in every format, "
+                             "or 0 to skip it.")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0,
+                        help="Seed the corpora are rendered with.")
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=1,
+                        help="Number of worker processes to recognize pages with.")
+    parser.add_argument("--corpus-dir",
+                        type=pathlib.Path,
+                        default=DEFAULT_CORPUS_DIR,
+                        help="Folder rendered corpora are kept in and reused from.")
+    parser.add_argument("--output",
+                        type=pathlib.Path,
+                        help="Also save all measurements to this JSON file.")
+    parser.add_argument("--min-accuracy",
+                        type=float,
+                        default=1.0,
+                        help="Fail if fewer than this share of pages, fields or answers are read correctly, "
+                             "below-floor corpora aside.")
+    parser.add_argument("--run-one", type=pathlib.Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(args.run_one, args.workers)))
+        sys.exit(0)
+
+    results = []
+    below_floor_results = []
+    for file_format in args.formats:
+        for num_pages in args.pages:
+            results.append(benchmark_corpus(
+                get_corpus(args.corpus_dir, num_pages, file_format, args.seed),
+                args.workers))
+        if args.below_floor_pages > 0:
+            below_floor_results.append(benchmark_corpus(
+                get_corpus(args.corpus_dir, args.below_floor_pages,
+                           file_format, args.seed,
+                           synthetic_sheets.BELOW_FLOOR_DPI), args.workers))
+
+    print_report(results + below_floor_results)
+    if args.output is not None:
+        with open(str(args.output), "w") as file:
+            json.dump(results + below_floor_results, file, indent=2)
+
+    if below_floor_results and all(result["unread_pages"] == 0
+                                   for result in below_floor_results):
+        print(f"Every page was read at {synthetic_sheets.BELOW_FLOOR_DPI} DPI "
+              f"in every format, so the minimum reliable resolution of "
+              f"{grid_i.MIN_RELIABLE_DPI} DPI may be higher than needed.")
+    failed = [
+        result["corpus"] for result in results
+        if min(result["page_accuracy"], result["field_accuracy"],
+               result["answer_accuracy"]) < args.min_accuracy
+    ]
+    if failed:
+        print(f"Accuracy below {args.min_accuracy:.2%} on: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,129 @@
+"""Benchmarks how long the CLI takes to start, and checks that the core
+modules stay light to import.
+
+Every measurement runs in a fresh interpreter, since imports are only slow the
+first time. The run reports:
+    * the time to import the core modules (recognition, scoring and export)
+      and the modules, at any depth, that take longest to import by
+      themselves, from `python -X importtime`;
+    * the time until `main.py --help` exits.
+
+Importing any of `LAZY_MODULES` with the core fails the run: tkinter isn't
+available in headless containers, and the PDF libraries must only be loaded
+when a run needs them. A startup slower than `--max-ms` fails the run too.
+
+Usage: python benchmarks/startup_time.py [--runs 5] [--max-ms 2000]
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+import typing as tp
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent.parent / "src"
+
+"""Modules a headless run processes pages with."""
+CORE_MODULES = [
+    "process_input", "sheet_recognition", "scoring", "data_exporting",
+    "image_utils", "main"
+]
+
+"""Modules the core must not import when it is imported itself."""
+LAZY_MODULES = ["tkinter", "reportlab", "pdf2image"]
+
+# Imports the core modules (main.py only parses arguments when run as a
+# script) and prints the lazy modules that were imported with them.
+_IMPORT_CORE = ("import json, sys\n"
+                "for name in {core}: __import__(name)\n"
+                "print(json.dumps([name for name in {lazy} if name in sys.modules]))")
+
+
+def run_python(args: tp.List[str]) -> tp.Tuple[float, subprocess.CompletedProcess]:
+    """Run a fresh interpreter in the source folder and time it."""
+    start_time = time.perf_counter()
+    completed = subprocess.run([sys.executable] + args,
+                               cwd=str(SRC_DIR),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               universal_newlines=True,
+                               check=True)
+    return time.perf_counter() - start_time, completed
+
+
+def parse_import_times(importtime_output: str
+                       ) -> tp.List[tp.Tuple[int, int, str]]:
+    """Self and cumulative import time in microseconds of every module, from
+    the output of `python -X importtime`. The self time leaves out the modules
+    it imported."""
+    times = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times.append((int(self_time), int(cumulative), name.strip()))
+    return times
+
+
+def check_core_imports() -> tp.Tuple[tp.List[str], tp.List[tp.Tuple[int, int, str]]]:
+    """Import the core modules once. Returns the lazy modules that got
+    imported anyway and the import time of every module."""
+    _, completed = run_python([
+        "-X", "importtime", "-c",
+        _IMPORT_CORE.format(core=CORE_MODULES, lazy=LAZY_MODULES)
+    ])
+    imported_lazy_modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    return imported_lazy_modules, parse_import_times(completed.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the startup time of the OpenMCR CLI.")
+    parser.add_argument("--runs",
+                        type=int,
+                        default=5,
+                        help="Number of fresh interpreters to time.")
+    parser.add_argument("--max-ms",
+                        type=float,
+                        default=None,
+                        help="Fail if the median time of main.py --help is slower than this.")
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="Number of slowest modules to list.")
+    args = parser.parse_args()
+
+    imported_lazy_modules, import_times = check_core_imports()
+    print("Slowest modules imported with the core (ms):")
+    print(f"  {'self':>8}  {'total':>8}  module")
+    for self_time, cumulative, name in sorted(import_times,
+                                              reverse=True)[:args.top]:
+        print(f"  {self_time / 1000:>8.1f}  {cumulative / 1000:>8.1f}  {name}")
+
+    core_times = [
+        run_python(["-c", _IMPORT_CORE.format(core=CORE_MODULES,
+                                              lazy=LAZY_MODULES)])[0]
+        for _ in range(args.runs)
+    ]
+    help_times = [
+        run_python(["main.py", "--help"])[0] for _ in range(args.runs)
+    ]
+    core_ms = statistics.median(core_times) * 1000
+    help_ms = statistics.median(help_times) * 1000
+    print(f"Import core modules: {core_ms:.0f} ms (median of {args.runs})")
+    print(f"main.py --help:      {help_ms:.0f} ms (median of {args.runs})")
+
+    failed = False
+    if imported_lazy_modules:
+        print(f"The core modules import {', '.join(imported_lazy_modules)}, "
+              "which must only be imported when needed.")
+        failed = True
+    if args.max_ms is not None and help_ms > args.max_ms:
+        print(f"Startup is slower than {args.max_ms:.0f} ms.")
+        failed = True
+    if failed:
+        sys.exit(1)
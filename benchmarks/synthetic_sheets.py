@@ -0,0 +1,312 @@
+"""Renders synthetic bubble sheets with known contents.
+
+Sheets are drawn from the compiled layout of `grid_info.form_75q`, so every
+bubble lands in the grid cell the reader looks in. Each page gets random
+answers and names plus the distortions of a real scan: a resolution, a slight
+rotation and skew, uneven paper brightness and noise. Everything is derived
+from a seed, so a corpus can be rebuilt exactly.
+
+Corpora are written page by page, so even large ones never have to fit in
+memory:
+    * TIFF corpora are bilevel and CCITT Group 4 compressed, as produced by
+      most document scanners.
+    * PDF corpora hold one grayscale JPEG per page, as produced by most
+      scan-to-PDF workflows.
+"""
+
+import json
+import pathlib
+import random
+import sys
+import typing as tp
+
+import cv2
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "src"))
+
+import alphabet  # noqa: E402
+import grid_info as grid_i  # noqa: E402
+import grid_reading as grid_r  # noqa: E402
+
+"""Resolutions pages are rendered at, picked at random for every page. Every
+page must be read correctly, so none is below `grid_info.MIN_RELIABLE_DPI`."""
+DPI_CHOICES = [grid_i.MIN_RELIABLE_DPI, 300]
+
+"""Resolution of the corpora that check `grid_info.MIN_RELIABLE_DPI` is needed:
+some of their pages are expected to be rejected."""
+BELOW_FLOOR_DPI = grid_i.MIN_RELIABLE_DPI // 2
+MAX_ROTATION_DEGREES = 2.0
+MAX_SHEAR = 0.01
+NOISE_SIGMA = 4.0
+JPEG_QUALITY = 75
+
+"""Changed whenever pages are rendered differently, so that corpora rendered by
+an earlier version aren't reused."""
+CORPUS_VERSION = 3
+
+"""Position of the grid on the page and the size of the corner marks, in
+inches. The grid has the size of the printed sheet's."""
+GRID_ORIGIN_INCHES = 0.5
+GRID_WIDTH_INCHES = grid_i.GRID_HORIZONTAL_CELLS * grid_i.GRID_CELL_SIZE_INCHES
+GRID_HEIGHT_INCHES = grid_i.GRID_VERTICAL_CELLS * grid_i.GRID_CELL_SIZE_INCHES
+MARK_SIZE_INCHES = 0.15
+
+PAGE_WIDTH_INCHES = 8.5
+PAGE_HEIGHT_INCHES = 11.0
+
+"""Share of questions left blank or marked twice on student sheets."""
+BLANK_ANSWER_RATE = 0.03
+DOUBLE_ANSWER_RATE = 0.02
+NUM_ANSWER_CHOICES = 5
+
+
+class SyntheticSheet():
+    """A sheet to render, along with the values it should be read as.
+
+    Members:
+        marks: The symbols filled in for every character position of the
+            compiled form (see `grid_info.CompiledFormVariant`).
+        fields: The value every field should be read as.
+        answers: The value every question should be read as.
+    """
+    marks: tp.List[tp.List[str]]
+    fields: tp.Dict[grid_i.Field, str]
+    answers: tp.List[str]
+
+    def __init__(self, marks: tp.List[tp.List[str]],
+                 form_variant: grid_i.FormVariant):
+        compiled = form_variant.compile()
+        self.marks = marks
+        offsets = compiled.group_position_offsets
+        strings = [
+            grid_r.field_group_to_string(marks[offsets[i]:offsets[i + 1]])
+            for i in range(len(offsets) - 1)
+        ]
+        num_fields = len(compiled.fields)
+        self.fields = dict(zip(compiled.fields, strings[:num_fields]))
+        self.answers = strings[num_fields:]
+
+    def to_json(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "fields": {field.name: value for field, value in self.fields.items()},
+            "answers": self.answers
+        }
+
+
+def _get_group_positions(form_variant: grid_i.FormVariant
+                         ) -> tp.List[tp.Tuple[int, int]]:
+    """Get the first and last character position of every field and then every
+    question."""
+    offsets = form_variant.compile().group_position_offsets
+    return [(offsets[i], offsets[i + 1]) for i in range(len(offsets) - 1)]
+
+
+def make_random_sheet(rng: random.Random,
+                      form_variant: grid_i.FormVariant,
+                      student_id: tp.Optional[str] = None,
+                      form_code: str = "A") -> SyntheticSheet:
+    """Fill in a sheet at random. Names are random letters, and most questions
+    get a single answer, with a few left blank or marked twice. Answer keys are
+    made by passing `grid_info.KEY_STUDENT_ID` as the student ID."""
+    compiled = form_variant.compile()
+    groups = _get_group_positions(form_variant)
+    marks: tp.List[tp.List[str]] = [[] for _ in range(groups[-1][1])]
+    is_key = student_id == grid_i.KEY_STUDENT_ID
+    for field, (start, end) in zip(compiled.fields, groups):
+        if field is grid_i.Field.STUDENT_ID:
+            value = student_id or "".join(
+                str(rng.randrange(10)) for _ in range(end - start))
+        elif field is grid_i.Field.COURSE_ID:
+            value = "".join(str(rng.randrange(10)) for _ in range(end - start))
+        elif field is grid_i.Field.TEST_FORM_CODE:
+            value = form_code
+        elif is_key:
+            value = ""
+        else:
+            value = "".join(
+                rng.choice(alphabet.letters)
+                for _ in range(rng.randrange(1, end - start + 1)))
+        for i, symbol in enumerate(value):
+            marks[start + i] = [symbol]
+    for start, end in groups[len(compiled.fields):]:
+        choices = alphabet.letters[:NUM_ANSWER_CHOICES]
+        roll = rng.random()
+        if not is_key and roll < BLANK_ANSWER_RATE:
+            continue
+        if not is_key and roll < BLANK_ANSWER_RATE + DOUBLE_ANSWER_RATE:
+            marks[start] = sorted(rng.sample(choices, 2))
+        else:
+            marks[start] = [rng.choice(choices)]
+    return SyntheticSheet(marks, form_variant)
+
+
+def render_sheet(sheet: SyntheticSheet,
+                 form_variant: grid_i.FormVariant,
+                 rng: random.Random,
+                 dpi: tp.Optional[int] = None) -> np.ndarray:
+    """Render a sheet as a grayscale scan, distorted at random."""
+    compiled = form_variant.compile()
+    dpi = dpi or rng.choice(DPI_CHOICES)
+    width = round(PAGE_WIDTH_INCHES * dpi)
+    height = round(PAGE_HEIGHT_INCHES * dpi)
+    image = np.full((height, width), 255, np.uint8)
+
+    origin = GRID_ORIGIN_INCHES * dpi
+    grid_width = GRID_WIDTH_INCHES * dpi
+    grid_height = GRID_HEIGHT_INCHES * dpi
+    mark = MARK_SIZE_INCHES * dpi
+
+    l_mark = np.array([[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]])
+    cv2.fillPoly(image, [np.round(l_mark * mark + origin).astype(np.int32)], 0)
+    for x, y in [(grid_width - mark, 0), (0, grid_height - mark),
+                 (grid_width - mark, grid_height - mark)]:
+        cv2.rectangle(image, (round(origin + x), round(origin + y)),
+                      (round(origin + x + mark), round(origin + y + mark)), 0,
+                      -1)
+
+    cell_width = grid_width / grid_i.GRID_HORIZONTAL_CELLS
+    cell_height = grid_height / grid_i.GRID_VERTICAL_CELLS
+    radius = round(cell_width * 0.33)
+    outline = max(1, dpi // 150)
+    for (across, down), position, symbol in zip(compiled.cells,
+                                                compiled.bubble_positions,
+                                                compiled.bubble_symbols):
+        center = (round(origin + (across + 0.5) * cell_width),
+                  round(origin + (down + 0.5) * cell_height))
+        filled = symbol in sheet.marks[position]
+        cv2.circle(image, center, radius, 0, -1 if filled else outline)
+
+    # Rotate and skew around the center of the page
+    angle = rng.uniform(-MAX_ROTATION_DEGREES, MAX_ROTATION_DEGREES)
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    shear = rng.uniform(-MAX_SHEAR, MAX_SHEAR)
+    skew = np.array([[1, shear, -shear * height / 2], [0, 1, 0], [0, 0, 1]])
+    transform = (skew @ np.vstack([rotation, [0, 0, 1]]))[:2]
+    image = cv2.warpAffine(image, transform, (width, height),
+                           flags=cv2.INTER_LINEAR,
+                           borderValue=255)
+
+    # Uneven paper and noise
+    paper = rng.randint(225, 255)
+    noise_rng = np.random.default_rng(rng.randrange(2**32))
+    shading = np.linspace(0, rng.uniform(-20, 0), width, dtype=np.float32)
+    noisy = (image.astype(np.float32) * (paper / 255) + shading +
+             noise_rng.normal(0, NOISE_SIGMA, image.shape).astype(np.float32))
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def iter_corpus(num_pages: int, seed: int,
+                form_variant: grid_i.FormVariant = grid_i.form_75q,
+                dpi: tp.Optional[int] = None
+                ) -> tp.Iterator[tp.Tuple[np.ndarray, SyntheticSheet]]:
+    """Yield the pages of a corpus along with their contents. The first page
+    is an answer key, so the corpus can be scored. Pages are rendered at `dpi`
+    if given, and at one of `DPI_CHOICES` otherwise."""
+    for i in range(num_pages):
+        rng = random.Random(f"{seed}-{i}")
+        student_id = grid_i.KEY_STUDENT_ID if i == 0 else None
+        sheet = make_random_sheet(rng, form_variant, student_id)
+        yield render_sheet(sheet, form_variant, rng, dpi), sheet
+
+
+def _write_tiff(path: pathlib.Path, pages: tp.Iterable[np.ndarray]):
+    with TiffImagePlugin.AppendingTiffWriter(str(path), new=True) as file:
+        for page in pages:
+            _, bilevel = cv2.threshold(page, 0, 255,
+                                       cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            Image.fromarray(bilevel).convert("1").save(file,
+                                                       format="TIFF",
+                                                       compression="group4")
+            file.newFrame()
+
+
+def _write_pdf(path: pathlib.Path, pages: tp.Iterable[np.ndarray]):
+    """Write a PDF with one full-page JPEG per page, without holding more than
+    one page in memory."""
+    offsets: tp.List[int] = []
+    page_ids: tp.List[int] = []
+    with open(str(path), "wb") as file:
+
+        def write_object(number: int, body: bytes, stream: bytes = b""):
+            while len(offsets) < number:
+                offsets.append(0)
+            offsets[number - 1] = file.tell()
+            file.write(b"%d 0 obj\n" % number + body)
+            if stream:
+                file.write(b"\nstream\n" + stream + b"\nendstream")
+            file.write(b"\nendobj\n")
+
+        file.write(b"%PDF-1.4\n")
+        # Objects 1 and 2 are the catalog and page tree, written last.
+        next_id = 3
+        for page in pages:
+            success, jpeg = cv2.imencode(".jpg", page,
+                                         [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not success:
+                raise ValueError("Could not encode page.")
+            height, width = page.shape[:2]
+            # Pages are rendered at different resolutions, but all are letter
+            # size.
+            page_width = PAGE_WIDTH_INCHES * 72
+            page_height = PAGE_HEIGHT_INCHES * 72
+            image_id, contents_id, page_id = next_id, next_id + 1, next_id + 2
+            next_id += 3
+            write_object(
+                image_id, b"<< /Type /XObject /Subtype /Image /Width %d "
+                b"/Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 "
+                b"/Filter /DCTDecode /Length %d >>" % (width, height, len(jpeg)),
+                jpeg.tobytes())
+            contents = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (page_width,
+                                                            page_height)
+            write_object(contents_id, b"<< /Length %d >>" % len(contents),
+                         contents)
+            write_object(
+                page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                % (page_width, page_height, image_id, contents_id))
+            page_ids.append(page_id)
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        write_object(
+            2, b"<< /Type /Pages /Kids [%s] /Count %d >>" %
+            (b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids)))
+        xref_offset = file.tell()
+        file.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        for offset in offsets:
+            file.write(b"%010d 00000 n \n" % offset)
+        file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                   % (len(offsets) + 1, xref_offset))
+
+
+def write_corpus(path: pathlib.Path, num_pages: int, seed: int,
+                 form_variant: grid_i.FormVariant = grid_i.form_75q,
+                 dpi: tp.Optional[int] = None) -> pathlib.Path:
+    """Write a corpus as a multi-page TIFF or PDF, depending on the extension
+    of `path`, rendered as described in `iter_corpus`. The contents of every
+    page are saved next to it as JSON, keyed by the name the page will be
+    given when it is read. Returns the path of the JSON file."""
+    truth: tp.Dict[str, tp.Any] = {}
+
+    def pages() -> tp.Iterator[np.ndarray]:
+        for i, (image, sheet) in enumerate(
+                iter_corpus(num_pages, seed, form_variant, dpi)):
+            truth[f"{path.stem}_{i + 1}"] = sheet.to_json()
+            yield image
+
+    if path.suffix.lower() == ".pdf":
+        _write_pdf(path, pages())
+    else:
+        _write_tiff(path, pages())
+    truth_path = path.with_suffix(".json")
+    with open(str(truth_path), "w") as file:
+        json.dump(truth, file)
+    return truth_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: synthetic_sheets.py OUTPUT.tif|OUTPUT.pdf PAGES [SEED]")
+        sys.exit(1)
+    write_corpus(pathlib.Path(sys.argv[1]), int(sys.argv[2]),
+                 int(sys.argv[3]) if len(sys.argv) > 3 else 0)
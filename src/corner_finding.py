@@ -1,11 +1,14 @@
 import typing
 
+import cv2
 import numpy as np
 
+import data_exporting
 import geometry_utils
 import image_utils
 import list_utils
 import math_utils
+import metrics
 import pathlib
 
 
@@ -102,13 +105,165 @@ class SquareMark:
         self.unit_length = math_utils.mean(side_lengths)
 
 
+"""Corner marks are searched for among contours whose size falls within these
+fractions of the smallest image dimension (measured along the side of the
+contour's bounding box). Anything else, like specks of noise or the page border,
+is discarded before it is approximated as a polygon."""
+MIN_MARK_SIZE_FRACTION = 0.005
+MAX_MARK_SIZE_FRACTION = 0.1
+
+"""The most L-shaped hexagons that will be tried as the top-left mark. They are
+tried from largest to smallest, which bounds the time spent on very noisy
+pages."""
+MAX_L_MARK_CANDIDATES = 50
+
+
+"""Corner marks are large, so they are first searched for on a copy of the image
+downscaled by this factor. The copy is never made smaller than
+`COARSE_SEARCH_MIN_DIMENSION` pixels on its short side, since below that the
+marks are too small to be recognized reliably."""
+COARSE_SEARCH_SCALE = 0.25
+COARSE_SEARCH_MIN_DIMENSION = 600
+
+"""Subfolder of the debug folder that the images of the downscaled search are
+saved to, so the full resolution search doesn't overwrite them."""
+COARSE_DEBUG_FOLDER_NAME = "coarse"
+
+
+def _find_mark_polygons(image: np.ndarray,
+                        save_path: typing.Optional[pathlib.PurePath] = None,
+                        external_only: bool = False
+                        ) -> typing.List[geometry_utils.Polygon]:
+    """Find the quadrilaterals and hexagons in the image that are about the
+    size of a corner mark."""
+    edges = image_utils.detect_edges(image, save_path=save_path)
+    min_dimension = min(image_utils.get_dimensions(image))
+    min_size = MIN_MARK_SIZE_FRACTION * min_dimension
+    max_size = MAX_MARK_SIZE_FRACTION * min_dimension
+    polygons = []
+    for contour in image_utils.find_contours(edges, external_only):
+        _, _, width, height = cv2.boundingRect(contour)
+        if (min_size <= width <= max_size and min_size <= height <= max_size
+                and width <= 2 * height and height <= 2 * width):
+            simple = geometry_utils.approx_contour(contour)
+            # Only build polygons for shapes that could be marks.
+            if len(simple) == 4 or len(simple) == 6:
+                polygons.append(geometry_utils.polygon_to_clockwise(
+                    geometry_utils.contour_to_polygon(simple)))
+    return polygons
+
+
+class _SquareIndex():
+    """Square mark candidates bucketed by position for fast spatial lookups.
+
+    The shape checks that do not depend on the size of the L mark are done
+    once, for all quadrilaterals at the same time."""
+    def __init__(self, quadrilaterals: typing.List[geometry_utils.Polygon],
+                 bucket_size: float):
+        self.quadrilaterals = quadrilaterals
+        points = geometry_utils.polygons_to_array(quadrilaterals)
+        self.side_lengths = geometry_utils.calc_side_lengths_array(points)
+        self.centroids = geometry_utils.guess_centroids_array(points)
+        self.bucket_size = bucket_size
+        self.buckets: typing.Dict[typing.Tuple[int, int],
+                                  typing.List[int]] = {}
+        for i in np.flatnonzero(geometry_utils.all_approx_square_array(points)):
+            key = self._get_bucket(*self.centroids[i])
+            self.buckets.setdefault(key, []).append(int(i))
+
+    def _get_bucket(self, x: float, y: float) -> typing.Tuple[int, int]:
+        return int(x // self.bucket_size), int(y // self.bucket_size)
+
+    def find_near(self, center: np.ndarray, radius: float) -> np.ndarray:
+        """Get the indexes of the square-cornered candidates whose centroid may
+        be within `radius` of `center`, in their original order."""
+        min_x, min_y = self._get_bucket(*(center - radius))
+        max_x, max_y = self._get_bucket(*(center + radius))
+        found: typing.List[int] = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                found += self.buckets.get((x, y), [])
+        return np.array(sorted(found), dtype=int)
+
+
+def _find_l_marks(hexagons: typing.List[geometry_utils.Polygon]
+                  ) -> typing.List[typing.Tuple[int, LMark]]:
+    """Get the hexagons that are valid L marks, along with their index, largest
+    first."""
+    if len(hexagons) == 0:
+        return []
+    points = geometry_utils.polygons_to_array(hexagons)
+    l_marks = []
+    for i in np.flatnonzero(geometry_utils.all_approx_square_array(points)):
+        try:
+            l_marks.append((int(i), LMark(hexagons[i])))
+        except WrongShapeError:
+            continue
+    l_marks.sort(key=lambda l_mark: -l_mark[1].unit_length)
+    return l_marks[:MAX_L_MARK_CANDIDATES]
+
+
 def find_corner_marks(image: np.ndarray,
                       save_path: typing.Optional[pathlib.PurePath] = None
                       ) -> geometry_utils.Polygon:
-
-    all_polygons: typing.List[
-        geometry_utils.Polygon] = image_utils.find_polygons(
-            image, save_path=save_path)
+    """Find the corners of the grid, clockwise from the top left.
+
+    The marks are first searched for on a downscaled copy of the image, using
+    only external contours, and the corners found there are refined at full
+    resolution. If that fails, the whole full resolution image is searched.
+    Debug images of the downscaled search are saved to the
+    `COARSE_DEBUG_FOLDER_NAME` subfolder of `save_path`.
+
+    Raises CornerFindingError if the corners can't be found."""
+    scale = max(COARSE_SEARCH_SCALE,
+                COARSE_SEARCH_MIN_DIMENSION / min(image_utils.get_dimensions(image)))
+    if scale < 1:
+        coarse_save_path = None
+        if save_path:
+            coarse_save_path = save_path / COARSE_DEBUG_FOLDER_NAME
+            data_exporting.make_dir_if_not_exists(coarse_save_path)
+        try:
+            coarse_corners = _search_corner_marks(
+                image_utils.downscale(image, scale), coarse_save_path, external_only=True)
+        except CornerFindingError:
+            metrics.count("coarse_search_failures")
+        else:
+            grid_corners = _refine_corners(image, coarse_corners, scale)
+            if save_path:
+                image_utils.draw_polygons(image, [grid_corners], save_path / "grid_limits.jpg")
+            return grid_corners
+    return _search_corner_marks(image, save_path)
+
+
+def _refine_corners(image: np.ndarray, corners: geometry_utils.Polygon,
+                    scale: float) -> geometry_utils.Polygon:
+    """Scale corners found on an image downscaled by `scale` back up, and refine
+    them with sub-pixel accuracy on the full resolution image."""
+    # Pixel centers don't scale around the origin, so compensate by half a pixel
+    scaled = np.array([[(p.x + 0.5) / scale - 0.5, (p.y + 0.5) / scale - 0.5]
+                       for p in corners], np.float32)
+    # The window has to cover the error from the downscaled search while staying
+    # smaller than the marks themselves.
+    half_window = int(np.ceil(3 / scale))
+    refined = cv2.cornerSubPix(
+        image, scaled.reshape(-1, 1, 2).copy(), (half_window, half_window), (-1, -1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)).reshape(-1, 2)
+    # If refinement wandered off (for example onto a different edge), keep the
+    # scaled estimate.
+    drifted = np.linalg.norm(refined - scaled, axis=1) > half_window
+    refined[drifted] = scaled[drifted]
+    return [geometry_utils.Point(float(x), float(y)) for x, y in refined]
+
+
+def _search_corner_marks(image: np.ndarray,
+                         save_path: typing.Optional[pathlib.PurePath] = None,
+                         external_only: bool = False
+                         ) -> geometry_utils.Polygon:
+
+    metrics.count("corner_searches")
+    with metrics.stage("find_polygons"):
+        all_polygons = _find_mark_polygons(image, save_path, external_only)
+    metrics.count("mark_polygons", len(all_polygons))
 
     # Even though the LMark and SquareMark classes check length, it's faster to
     # filter out the shapes of incorrect length despite the increased time
@@ -125,13 +280,15 @@ def find_corner_marks(image: np.ndarray,
         image_utils.draw_polygons(image, hexagons, save_path / "all_hexagons.jpg")
         image_utils.draw_polygons(image, quadrilaterals, save_path / "all_quadrilaterals.jpg")
 
-    for i in range(len(hexagons)):
-        hexagon = hexagons[i]
+    if len(quadrilaterals) == 0:
+        raise CornerFindingError("Couldn't find document corners.")
+    square_index = _SquareIndex(
+        quadrilaterals,
+        MAX_MARK_SIZE_FRACTION * min(image_utils.get_dimensions(image)))
 
-        try:
-            l_mark = LMark(hexagon)
-        except WrongShapeError:
-            continue
+    for i, l_mark in _find_l_marks(hexagons):
+        metrics.count("l_mark_candidates")
+        hexagon = hexagons[i]
 
         # To construct the basis, we use points 0, 4, 5 of the L. The points are in CW order from
         # the top-left corner, so these are the top-left, bottom-left, and bottom-right-of-bottom-side
@@ -148,11 +305,6 @@ def find_corner_marks(image: np.ndarray,
         x_tolerance = 0.2 * nominal_to_right_side
         y_tolerance = 0.2 * nominal_to_bottom
 
-
-        top_right_squares = []
-        bottom_left_squares = []
-        bottom_right_squares = []
-
         if save_path:
             # Purely for diagnostic output - save the grid tolerance boxes to a file. This is
             # complicated, but useful for debugging and only is enabled when requested.
@@ -186,44 +338,54 @@ def find_corner_marks(image: np.ndarray,
                 thickness=2
             )
 
-        for quadrilateral in quadrilaterals:
-            try:
-                square = SquareMark(quadrilateral, l_mark.unit_length)
-            except WrongShapeError:
-                continue
-            centroid = geometry_utils.guess_centroid(square.polygon)
-            centroid_new_basis = basis_transformer.to_basis(centroid)
-
-            if math_utils.is_within_tolerance(
-                    centroid_new_basis.x, nominal_to_right_side,
-                    x_tolerance) and math_utils.is_within_tolerance(
-                        centroid_new_basis.y, 0.5, y_tolerance):
-                top_right_squares.append(square)
-            elif math_utils.is_within_tolerance(
-                    centroid_new_basis.x, 0.5,
-                    x_tolerance) and math_utils.is_within_tolerance(
-                        centroid_new_basis.y, nominal_to_bottom, y_tolerance):
-                bottom_left_squares.append(square)
-            elif math_utils.is_within_tolerance(
-                    centroid_new_basis.x, nominal_to_right_side,
-                    x_tolerance) and math_utils.is_within_tolerance(
-                        centroid_new_basis.y, nominal_to_bottom, y_tolerance):
-                bottom_right_squares.append(square)
-
-        if len(top_right_squares) == 0 or len(bottom_left_squares) == 0 or len(
-                bottom_right_squares) == 0:
+        # Only look up squares near each corner, then check those against the tolerance box in the
+        # basis of the L. The radius covers the whole tolerance box in image coordinates.
+        tolerance_box_offsets = basis_transformer.from_basis_array(
+            np.array([[x_tolerance, y_tolerance], [x_tolerance, -y_tolerance]])
+        ) - basis_transformer.from_basis_array(np.array([[0.0, 0.0]]))
+        search_radius = np.abs(tolerance_box_offsets).max()
+
+        corner_squares: typing.List[SquareMark] = []
+        for nominal_x, nominal_y in [(nominal_to_right_side, 0.5),
+                                     (0.5, nominal_to_bottom),
+                                     (nominal_to_right_side, nominal_to_bottom)]:
+            nominal_center = basis_transformer.from_basis_array(
+                np.array([[nominal_x, nominal_y]]))[0]
+            candidates = square_index.find_near(nominal_center, search_radius)
+            if len(candidates) == 0:
+                break
+            sizes_match = np.all(
+                np.abs(square_index.side_lengths[candidates] - l_mark.unit_length)
+                <= 0.15 * l_mark.unit_length,
+                axis=1)
+            centroids_new_basis = basis_transformer.to_basis_array(
+                square_index.centroids[candidates])
+            within_tolerance = (
+                (np.abs(centroids_new_basis[:, 0] - nominal_x) < x_tolerance) &
+                (np.abs(centroids_new_basis[:, 1] - nominal_y) < y_tolerance))
+            matches = candidates[sizes_match & within_tolerance]
+            # TODO: When multiple, either progressively decrease tolerance or
+            # choose closest to centroid
+            square = next(
+                (square for square in (_try_square_mark(
+                    square_index.quadrilaterals[j], l_mark.unit_length)
+                                       for j in matches) if square is not None),
+                None)
+            if square is None:
+                break
+            corner_squares.append(square)
+
+        if len(corner_squares) != 3:
             continue
-
-        # TODO: When multiple, either progressively decrease tolerance or
-        # choose closest to centroid
+        top_right_square, bottom_left_square, bottom_right_square = corner_squares
 
         top_left_corner = l_mark.polygon[0]
         top_right_corner = geometry_utils.get_corner_wrt_basis(
-            top_right_squares[0].polygon, geometry_utils.Corner.TR, basis_transformer)
+            top_right_square.polygon, geometry_utils.Corner.TR, basis_transformer)
         bottom_right_corner = geometry_utils.get_corner_wrt_basis(
-            bottom_right_squares[0].polygon, geometry_utils.Corner.BR, basis_transformer)
+            bottom_right_square.polygon, geometry_utils.Corner.BR, basis_transformer)
         bottom_left_corner = geometry_utils.get_corner_wrt_basis(
-            bottom_left_squares[0].polygon, geometry_utils.Corner.BL, basis_transformer)
+            bottom_left_square.polygon, geometry_utils.Corner.BL, basis_transformer)
 
         grid_corners = [
             top_left_corner,     top_right_corner,
@@ -235,3 +397,11 @@ def find_corner_marks(image: np.ndarray,
 
         return grid_corners
     raise CornerFindingError("Couldn't find document corners.")
+
+
+def _try_square_mark(polygon: geometry_utils.Polygon,
+                     target_size: float) -> typing.Optional[SquareMark]:
+    try:
+        return SquareMark(polygon, target_size)
+    except WrongShapeError:
+        return None
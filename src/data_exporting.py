@@ -24,16 +24,61 @@ COLUMN_NAMES: tp.Dict[RealOrVirtualField, str] = {
 
 KEY_NOT_FOUND_MESSAGE = "NO KEY FOUND"
 
+"""Base name of the manifest of every page processed into an output folder,
+which lets later runs skip pages that were already processed."""
+PAGE_MANIFEST_NAME = "page_hashes"
+PAGE_HASH_COLUMN_NAME = "Page Hash"
+
 
 def format_timestamp_for_file(timestamp: tp.Optional[datetime]) -> str:
     return timestamp.isoformat(sep="_").replace(":", "-") + "__" if timestamp else ""
 
 
+def get_debug_dir(output_folder: pathlib.Path,
+                  timestamp: tp.Optional[datetime]) -> pathlib.Path:
+    """Get the folder debug data and profiles of a run are saved to."""
+    return output_folder / (format_timestamp_for_file(timestamp) + "debug")
+
+
 def make_dir_if_not_exists(path: pathlib.Path):
     if not os.path.exists(str(path)):
         os.makedirs(str(path))
 
 
+def find_latest_output(path: pathlib.Path,
+                       filebasename: str) -> tp.Optional[pathlib.Path]:
+    """Find the most recently saved output file with the given base name, with
+    or without a timestamp. Returns `None` if there is none."""
+    candidates = [
+        file for file in path.glob(f"*{filebasename}.csv")
+        if file.name == f"{filebasename}.csv"
+        or file.name.endswith(f"__{filebasename}.csv")
+    ]
+    return max(candidates,
+               key=lambda file: file.stat().st_mtime,
+               default=None)
+
+
+def load_page_manifest(csvfile: pathlib.Path) -> tp.Dict[str, str]:
+    """Load a page manifest, mapping page hashes to their source files."""
+    with open(str(csvfile), 'r', newline='') as file:
+        reader = csv.reader(file)
+        names = next(reader)
+        hash_index = list_utils.find_index(names, PAGE_HASH_COLUMN_NAME)
+        file_index = list_utils.find_index(names,
+                                           COLUMN_NAMES[Field.IMAGE_FILE])
+        return {row[hash_index]: row[file_index] for row in reader if row}
+
+
+def save_page_manifest(manifest: tp.Dict[str, str], path: pathlib.PurePath,
+                       timestamp: tp.Optional[datetime]) -> pathlib.PurePath:
+    output_path = path / f"{format_timestamp_for_file(timestamp)}{PAGE_MANIFEST_NAME}.csv"
+    save_csv([[PAGE_HASH_COLUMN_NAME, COLUMN_NAMES[Field.IMAGE_FILE]]] +
+             [[page_hash, image_file]
+              for page_hash, image_file in manifest.items()], output_path)
+    return output_path
+
+
 def validate_order_map(order_map: tp.Dict[str, tp.List[int]],
                        num_questions: int):
     """Validate the given order map and throw ValueError if the map is invalid."""
@@ -126,6 +171,19 @@ class OutputSheet():
         self.data.append(row + list_utils.strip_all(answers))
         self.row_count = len(self.data) - 1
 
+    def remove_matching(self, column: RealOrVirtualField, value: str) -> int:
+        """Remove every row whose value in the field column matches the given
+        value. Returns the number of rows removed."""
+        column_index = self.field_columns.index(column)
+        kept = [
+            row for row in self.data[1:]
+            if len(row) <= column_index or row[column_index] != value.strip()
+        ]
+        removed = len(self.data) - 1 - len(kept)
+        self.data = [self.data[0]] + kept
+        self.row_count = len(self.data) - 1
+        return removed
+
     def add_file(self, csvfile: pathlib.Path):
         with open(str(csvfile), 'r', newline='') as file:
             reader = csv.reader(file)
@@ -146,6 +204,9 @@ class OutputSheet():
                     [:self.first_question_column_index] if key is not None
                 }
                 answers = row[self.first_question_column_index:]
+                # Saved sheets are cleaned up, so they can lack the trailing
+                # unanswered questions that sheets read from scans have.
+                answers += [""] * (self.num_questions - len(answers))
                 self.add(fields, answers)
 
     def clean_up(self, replace_empty_with: str = ""):
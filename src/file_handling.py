@@ -1,5 +1,7 @@
 """Functions and utilities related to importing and exporting files."""
 
+import glob
+import os
 import pathlib
 import typing as tp
 
@@ -43,6 +45,50 @@ def filter_images(files: tp.Sequence[pathlib.Path]) -> tp.List[pathlib.Path]:
 
 
 
+def is_image(path: pathlib.Path) -> bool:
+    """Whether the file has the extension of a supported multi-page image, in
+    any case."""
+    return path.suffix.lower() in SUPPORTED_IMAGE_EXTENSIONS
+
+
+def expand_input_paths(inputs: tp.Sequence[tp.Union[str, pathlib.Path]]
+                       ) -> tp.List[pathlib.Path]:
+    """Expand input arguments into the list of image files to process.
+
+    Every input can be an image file, a folder (whose images are used, but
+    not those in its subfolders) or a glob pattern such as `scans/*.pdf` (or
+    `scans/**/*.pdf` to include subfolders). Folder contents and glob matches
+    are sorted by name so the order is stable. Files given more than once are
+    only included once.
+
+    Raises ValueError if an input doesn't exist or doesn't match any image.
+    """
+    image_paths: tp.List[pathlib.Path] = []
+    seen: tp.Set[str] = set()
+    for raw_input in inputs:
+        path = pathlib.Path(raw_input)
+        if path.is_dir():
+            matches = sorted(file for file in list_file_paths(path)
+                             if is_image(file))
+        elif path.is_file():
+            matches = [path]
+        elif glob.has_magic(str(raw_input)):
+            matches = sorted(
+                pathlib.Path(match)
+                for match in glob.glob(str(raw_input), recursive=True)
+                if os.path.isfile(match) and is_image(pathlib.Path(match)))
+        else:
+            raise ValueError(f"Input '{raw_input}' does not exist.")
+        if not matches:
+            raise ValueError(f"No pdf or tiff files found in '{raw_input}'.")
+        for match in matches:
+            key = os.path.normcase(os.path.abspath(match))
+            if key not in seen:
+                seen.add(key)
+                image_paths.append(match)
+    return image_paths
+
+
 def parse_path_arg(path_arg: str) -> pathlib.Path:
     """Parse a path argument into a Path object, stripping quotes if present.
     """
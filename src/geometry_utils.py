@@ -49,12 +49,16 @@ def polygon_to_contour(polygon: Polygon) -> np.ndarray:
     return np.array([[[point.x, point.y]] for point in polygon])
 
 
+def approx_contour(contour: np.ndarray) -> np.ndarray:
+    """Approximate the simple polygon for the contour, as an OpenCV contour."""
+    perimeter = cv2.arcLength(contour, True)
+    return cv2.approxPolyDP(contour, 0.05 * perimeter, True)
+
+
 def approx_poly(contour: np.ndarray) -> Polygon:
     """Approximate the simple polygon for the contour. Returns a polygon in
     clockwise order."""
-    perimeter = cv2.arcLength(contour, True)
-    simple = cv2.approxPolyDP(contour, 0.05 * perimeter, True)
-    polygon = contour_to_polygon(simple)
+    polygon = contour_to_polygon(approx_contour(contour))
     return polygon_to_clockwise(polygon)
 
 
@@ -111,6 +115,47 @@ def all_approx_square(contour: Polygon) -> bool:
     return math_utils.all_approx_equal(angles, math.pi / 2)
 
 
+def polygons_to_array(polygons: tp.Sequence[Polygon]) -> np.ndarray:
+    """Convert polygons that all have the same number of points `k` to an
+    `(n, k, 2)` array of `x, y` coordinates."""
+    return np.array([[[point.x, point.y] for point in polygon]
+                     for polygon in polygons], float).reshape(
+                         len(polygons), -1, 2)
+
+
+def calc_side_lengths_array(polygons: np.ndarray) -> np.ndarray:
+    """Vectorized `calc_side_lengths` for an `(n, k, 2)` array of polygons.
+    Returns an `(n, k)` array."""
+    return np.linalg.norm(np.roll(polygons, -1, axis=1) - polygons, axis=2)
+
+
+def calc_corner_angles_array(polygons: np.ndarray) -> np.ndarray:
+    """Vectorized `calc_corner_angles` for an `(n, k, 2)` array of polygons.
+    Returns an `(n, k)` array."""
+    previous_points = np.roll(polygons, 1, axis=1)
+    next_points = np.roll(polygons, -1, axis=1)
+    mag_a = np.linalg.norm(previous_points - polygons, axis=2)
+    mag_b = np.linalg.norm(next_points - polygons, axis=2)
+    dist_ab = np.linalg.norm(next_points - previous_points, axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosine = (mag_a**2 + mag_b**2 - dist_ab**2) / (2 * mag_a * mag_b)
+    return np.abs(np.arccos(np.clip(np.round(cosine, 4), -1, 1)))
+
+
+def all_approx_square_array(polygons: np.ndarray) -> np.ndarray:
+    """Vectorized `all_approx_square` for an `(n, k, 2)` array of polygons.
+    Returns an array of `n` booleans. Degenerate polygons are never square."""
+    angles = calc_corner_angles_array(polygons)
+    right_angle = math.pi / 2
+    return np.all(np.abs(angles - right_angle) <= 0.15 * right_angle, axis=1)
+
+
+def guess_centroids_array(polygons: np.ndarray) -> np.ndarray:
+    """Vectorized `guess_centroid` for an `(n, k, 2)` array of polygons.
+    Returns an `(n, 2)` array."""
+    return (polygons.max(axis=1) + polygons.min(axis=1)) / 2
+
+
 def line_from_points(point_a: Point, point_b: Point) -> Line:
     """Given two points, generate the point-slope of a line that passes through
     them."""
@@ -230,6 +275,18 @@ class ChangeOfBasisTransformer():
                            (point_vector - self._rotation_matrix))
         return Point(result[0][0], result[1][0])
 
+    def to_basis_array(self, points: np.ndarray) -> np.ndarray:
+        """Transform an `(n, 2)` array of `x, y` points into the new basis with
+        a single matrix operation."""
+        return (points @ self._transformation_matrix.T +
+                self._rotation_matrix.T)
+
+    def from_basis_array(self, points: np.ndarray) -> np.ndarray:
+        """Transform an `(n, 2)` array of `x, y` points out of the new basis
+        with a single matrix operation."""
+        return ((points - self._rotation_matrix.T) @
+                self._transformation_matrix_inv.T)
+
     def poly_to_basis(self, polygon: Polygon) -> Polygon:
         return [self.to_basis(point) for point in polygon]
 
@@ -1,6 +1,10 @@
 import enum
+import hashlib
+import math
 import typing as tp
 
+import numpy as np
+
 import alphabet
 from geometry_utils import Orientation
 
@@ -8,6 +12,21 @@ KEY_STUDENT_ID = "9999999999"
 GRID_HORIZONTAL_CELLS = 36
 GRID_VERTICAL_CELLS = 48
 
+"""Size of one grid cell on the printed sheet, in inches. The grid is 7.5 by 10
+inches, between the outer corners of the corner marks."""
+GRID_CELL_SIZE_INCHES = 7.5 / GRID_HORIZONTAL_CELLS
+
+"""Pages are read reliably from scans with at least this many pixels per grid
+cell. Below it, corner marks are so few pixels across that their outlines
+become too jagged to recognize, and some pages are rejected."""
+MIN_RELIABLE_PIXELS_PER_CELL = 40
+
+"""The lowest scan or rasterization resolution recommended for reliable reads,
+derived from the cell size. Lower resolutions are faster to process. The
+benchmark corpora are rendered at resolutions from here up, and every page of
+them must be read correctly."""
+MIN_RELIABLE_DPI = math.ceil(MIN_RELIABLE_PIXELS_PER_CELL / GRID_CELL_SIZE_INCHES)
+
 
 class Field(enum.Enum):
     """Fields that exist on the bubble sheet."""
@@ -63,6 +82,105 @@ class GridGroupInfo():
         self.fields_type = fields_type
         self.field_orientation = field_orientation
 
+    def get_cell_indexes(self) -> tp.List[tp.List[tp.Tuple[int, int]]]:
+        """Get the `(across, down)` index of every cell in the group. The result
+        has one list per field, each holding the cells in that field in order."""
+        fields_vertical = self.field_orientation is Orientation.VERTICAL
+        result = []
+        for i in range(self.num_fields):
+            horizontal_start = self.horizontal_start + i if fields_vertical else self.horizontal_start
+            vertical_start = self.vertical_start + i if not fields_vertical else self.vertical_start
+            result.append([
+                (horizontal_start if fields_vertical else horizontal_start + j,
+                 vertical_start if not fields_vertical else vertical_start + j)
+                for j in range(self.field_length)
+            ])
+        return result
+
+
+class CompiledFormVariant():
+    """A form variant flattened into lookup tables, so that a sheet can be read
+    from a vector of fill percents without building any objects per page.
+
+    Build it with `FormVariant.compile`, which caches the result. It only holds
+    plain lists and arrays, so it can be pickled and sent to worker processes.
+
+    Members:
+        cells: `(n, 2)` array holding the `(across, down)` index of every
+            bubble. Bubbles are ordered by field (in the order of `fields`) and
+            then by question. Fill percent vectors use the same order.
+        fields: The fields present on the form, in the order they are stored.
+        num_questions: The number of questions on the form.
+        group_offsets: Index of the first bubble of every field and then every
+            question, followed by the total number of bubbles. Group `i` is
+            `cells[group_offsets[i]:group_offsets[i + 1]]`.
+        bubble_positions: For every bubble, the index of the character position
+            (one single letter or digit of a field or question) it belongs to.
+        bubble_symbols: For every bubble, the character it represents.
+        group_position_offsets: Like `group_offsets`, but indexing character
+            positions instead of bubbles.
+        fingerprint: Hash of the layout. Two compiled forms with the same
+            fingerprint read sheets identically.
+    """
+    cells: np.ndarray
+    fields: tp.List[Field]
+    num_questions: int
+    group_offsets: tp.List[int]
+    bubble_positions: tp.List[int]
+    bubble_symbols: tp.List[str]
+    group_position_offsets: tp.List[int]
+    fingerprint: str
+
+    def __init__(self, form_variant: "FormVariant"):
+        self.fields = [
+            field for field, info in form_variant.fields.items()
+            if info is not None
+        ]
+        self.num_questions = form_variant.num_questions
+        groups = [tp.cast(GridGroupInfo, form_variant.fields[field])
+                  for field in self.fields] + form_variant.questions
+
+        cells: tp.List[tp.Tuple[int, int]] = []
+        self.group_offsets = [0]
+        self.bubble_positions = []
+        self.bubble_symbols = []
+        self.group_position_offsets = [0]
+        position = 0
+        for group in groups:
+            for field_cells in group.get_cell_indexes():
+                cells += field_cells
+                for i in range(len(field_cells)):
+                    self.bubble_positions.append(position)
+                    self.bubble_symbols.append(
+                        alphabet.letters[i] if group.fields_type is
+                        FieldType.LETTER else str(i))
+                position += 1
+            self.group_offsets.append(len(cells))
+            self.group_position_offsets.append(position)
+        self.cells = np.array(cells, dtype=np.intp)
+
+        layout = hashlib.sha256(self.cells.astype(np.int64).tobytes())
+        layout.update(repr((
+            [field.name for field in self.fields], self.num_questions,
+            self.group_offsets, self.bubble_positions, self.bubble_symbols,
+            self.group_position_offsets)).encode())
+        self.fingerprint = layout.hexdigest()
+
+    @property
+    def num_bubbles(self) -> int:
+        return len(self.cells)
+
+    def get_field_slice(self, field: Field) -> slice:
+        """Get the slice of a fill percent vector that holds the given field."""
+        i = self.fields.index(field)
+        return slice(self.group_offsets[i], self.group_offsets[i + 1])
+
+    def get_question_slice(self, question: int) -> slice:
+        """Get the slice of a fill percent vector that holds the given question
+        (0-based)."""
+        i = len(self.fields) + question
+        return slice(self.group_offsets[i], self.group_offsets[i + 1])
+
 
 class FormVariant():
     fields: tp.Dict[Field, tp.Optional[GridGroupInfo]]
@@ -74,6 +192,14 @@ class FormVariant():
         self.fields = fields
         self.questions = questions
         self.num_questions = len(questions)
+        self._compiled: tp.Optional[CompiledFormVariant] = None
+
+    def compile(self) -> CompiledFormVariant:
+        """Get the compiled layout of this form variant. It is only built the
+        first time this is called."""
+        if self._compiled is None:
+            self._compiled = CompiledFormVariant(self)
+        return self._compiled
 
 
 form_75q = FormVariant(
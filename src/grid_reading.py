@@ -1,20 +1,15 @@
 """Functions for establishing and reading the grid."""
 
-# pyright: reportIncompatibleMethodOverride=false
-
-import abc
+import functools
 import pathlib
 import typing as tp
 
 import cv2
 import numpy as np
-from numpy import ma
 
-import alphabet
 import geometry_utils
 import grid_info
 import image_utils
-import list_utils
 
 """ This is what determines the circle size of the grid cell mask. If it is 0,
 the circle touches all edges of the grid cell. If it is 0.5, the circle is 50%
@@ -31,6 +26,10 @@ Notes:
 """
 GRID_CELL_CROP_FRACTION = 0.25
 
+"""The default resolution of the canonical raster used by `RectifiedGrid`, in
+pixels per grid cell along each axis."""
+DEFAULT_PIXELS_PER_CELL = 20
+
 # TODO: Import from geometry_utils when pyright#284 is fixed.
 Polygon = tp.List[geometry_utils.Point]
 
@@ -98,17 +97,6 @@ class Grid:
         in CW direction starting with the top left cell."""
         return self.basis_transformer.poly_from_basis(self._get_cell_shape_in_basis(across, down))
 
-    def get_unmasked_cell_matrix(self, across: int, down: int) -> np.ndarray:
-        """Get the matrix of pixels in the grid cell area. Note if the grid is rotated, this will
-        include pixels outside the cell since the cell will be a diamond and this will be a
-        rectangle."""
-        ((min_x, max_x), (min_y, max_y)) = self.get_cell_range(across, down)
-        # Add 1 for inclusive indexing. Numpy will not accept even rounded floats as indexes.
-        return self.image[
-            int(round(min_y)):int(round(max_y + 1)),
-            int(round(min_x)):int(round(max_x + 1))
-]
-
     def get_cell_center(self, across: int, down: int) -> geometry_utils.Point:
         """Get the center point of the cell."""
         ((min_x, max_x), (min_y, max_y)) = self.get_cell_range(across, down)
@@ -124,17 +112,66 @@ class Grid:
         center = self.get_cell_center(across, down)
         return (center, diameter / 2)
 
-    def get_masked_cell_matrix(self, across: int, down: int) -> ma.MaskedArray:
-        """Get the matrix of pixels in the cell area, masked down to just the cell circle."""
-        unmasked = self.get_unmasked_cell_matrix(across, down)
-        mask = np.ones(unmasked.shape)
-        unit_dimension = sum(mask.shape) / 2
-        center = (round(mask.shape[0] / 2), round(mask.shape[1] / 2))
-        circle_radius = (unit_dimension / 2) * (1 -
-                                                (GRID_CELL_CROP_FRACTION / 2))
-        cv2.circle(mask, center, int(circle_radius), (0, 0, 0), -1)
-        masked = ma.masked_array(unmasked, mask)
-        return masked
+    def get_cell_centers(self, cells: np.ndarray) -> np.ndarray:
+        """Get the center points of many cells at once.
+
+        `cells` is an `(n, 2)` array of `(across, down)` indexes. Returns an
+        `(n, 2)` array of `x, y` points in image coordinates."""
+        centers_in_basis = (cells + 0.5) * (self.horizontal_cell_size,
+                                            self.vertical_cell_size)
+        return self.basis_transformer.from_basis_array(centers_in_basis)
+
+    def get_cell_stencil(self) -> np.ndarray:
+        """Get the circle used to read a cell as a list of horizontal pixel runs.
+
+        The grid is an affine transform of the sheet, so every cell has the
+        same shape and one stencil can be used for all of them. Each row of the
+        result is `(row_offset, half_width)`: relative to a cell's center pixel,
+        the circle covers columns `-half_width` to `half_width` of that row. The
+        circle is the same size as the one drawn by `draw_grid`."""
+        ((min_x, max_x), (min_y, max_y)) = self.get_cell_range(0, 0)
+        unit_dimension = ((max_x - min_x + 1) + (max_y - min_y + 1)) / 2
+        radius = (unit_dimension / 2) * (1 - (GRID_CELL_CROP_FRACTION / 2))
+        row_offsets = np.arange(-int(radius), int(radius) + 1)
+        half_widths = np.floor(np.sqrt(radius**2 - row_offsets**2)).astype(int)
+        return np.stack([row_offsets, half_widths], axis=1)
+
+    def get_fill_percents(self, cells: np.ndarray) -> np.ndarray:
+        """Get the fill percent of many cells at once.
+
+        `cells` is an `(n, 2)` array of `(across, down)` indexes. Every cell
+        center is transformed in one operation, and the circle around it is
+        summed one pixel run at a time from an integral image of the area
+        covered by the cells, rather than building a masked array for every
+        cell. Returns an array of `n` fill percents."""
+        centers = np.rint(self.get_cell_centers(cells)).astype(np.intp)
+        stencil = self.get_cell_stencil()
+        height, width = self.image.shape[:2]
+
+        # (n, runs) arrays describing every pixel run of every cell. Columns are
+        # half-open: a run covers `first_columns` up to `last_columns - 1`.
+        rows = np.clip(centers[:, 1, np.newaxis] + stencil[:, 0], 0,
+                       height - 1)
+        first_columns = np.clip(
+            centers[:, 0, np.newaxis] - stencil[:, 1], 0, width - 1)
+        last_columns = np.clip(
+            centers[:, 0, np.newaxis] + stencil[:, 1], 0, width - 1) + 1
+
+        # Only integrate the area that is actually read.
+        top, bottom = rows.min(), rows.max() + 1
+        left, right = first_columns.min(), last_columns.max()
+        area = self.image[top:bottom, left:right]
+        # 32 bit sums are faster but overflow on very large areas.
+        depth = cv2.CV_32S if area.size * 255 < 2**31 else cv2.CV_64F
+        integral = cv2.integral(area, sdepth=depth)
+        rows = rows - top
+        first_columns = first_columns - left
+        last_columns = last_columns - left
+
+        run_sums = (integral[rows + 1, last_columns] - integral[rows, last_columns] -
+                    integral[rows + 1, first_columns] + integral[rows, first_columns])
+        pixel_counts = (last_columns - first_columns).sum(axis=1)
+        return 1 - (run_sums.sum(axis=1) / pixel_counts / 255)
 
     def draw_grid(self):
         """Draws the grid on the image, returning a copy with red dots at grid
@@ -153,176 +190,76 @@ class Grid:
         return image
 
 
-class _GridField(abc.ABC):
-    """A grid field is one set of grid cells that represents a value, ie a single
-    letter or number."""
-
-    horizontal_start_index: float
-    vertical_start_index: float
-    orientation: geometry_utils.Orientation
-    num_cells: int
-    grid: Grid
-
-    def __init__(self, grid: Grid, horizontal_start: int, vertical_start: int,
-                 orientation: geometry_utils.Orientation, num_cells: int):
-        self.vertical_start = vertical_start
-        self.horizontal_start = horizontal_start
-        self.orientation = orientation
-        self.num_cells = num_cells
-        self.grid = grid
-
-    @abc.abstractclassmethod
-    def read_value(self, threshold: float, fill_percents: tp.List[float]
-                   ) -> tp.Union[tp.List[str], tp.List[int]]:
-        ...
-
-    def _read_value_indexes(self, threshold: float,
-                            fill_percents: tp.List[float]) -> tp.List[int]:
-        filled = [
-            i for i in range(self.num_cells) if fill_percents[i] > threshold
-        ]
-        return filled
-
-    def get_cell_matrixes(self) -> tp.List[ma.MaskedArray]:
-        results: tp.List[ma.MaskedArray] = []
-        is_vertical = self.orientation is geometry_utils.Orientation.VERTICAL
-        for i in range(self.num_cells):
-            x = self.horizontal_start if is_vertical else self.horizontal_start + i
-            y = self.vertical_start if not is_vertical else self.vertical_start + i
-
-            # Have to crop the edges to avoid getting the borders of the write-in
-            # squares in the cells
-            matrix = self.grid.get_masked_cell_matrix(x, y)
-
-            results.append(matrix)
-        return results
-
-    def get_all_fill_percents(self) -> tp.List[float]:
-        results = [
-            image_utils.get_fill_percent(square)
-            for square in self.get_cell_matrixes()
-        ]
-        return results
+@functools.lru_cache(maxsize=None)
+def _get_rectified_cell_mask(pixels_per_cell: int) -> np.ndarray:
+    """Get the circular mask used to read every cell of a `RectifiedGrid`, as a
+    square array of ones (inside) and zeros (outside). Computed once per cell
+    size rather than once per sheet."""
+    radius = (pixels_per_cell / 2) * (1 - (GRID_CELL_CROP_FRACTION / 2))
+    pixel_centers = np.arange(pixels_per_cell) + 0.5 - (pixels_per_cell / 2)
+    inside = (pixel_centers[:, np.newaxis]**2 +
+              pixel_centers[np.newaxis, :]**2) <= radius**2
+    return inside.astype(float)
 
 
-class NumberGridField(_GridField):
-    """A number grid field is one set of grid cells that represents a digit."""
-    def read_value(self, threshold: float,
-                   fill_percents: tp.List[float]) -> tp.List[int]:
-        return super()._read_value_indexes(threshold, fill_percents)
+class RectifiedGrid(Grid):
+    """A grid read from a canonical raster instead of the skewed scan.
 
+    All four corners are used to compute a perspective transform that warps
+    the sheet into an image of exactly `pixels_per_cell` pixels per cell.
+    Unlike `Grid`, which can only represent affine distortion, this also
+    corrects the trapezoidal distortion of photographed sheets. Every cell is
+    then a fixed slice of the raster, so cells can be read without any
+    per-sheet geometry."""
+    pixels_per_cell: int
+    perspective_transform: np.ndarray
 
-class LetterGridField(_GridField):
-    """A number grid field is one set of grid cells that represents a letter."""
-    def read_value(self, threshold: float,
-                   fill_percents: tp.List[float]) -> tp.List[str]:
-        return [
-            alphabet.letters[i]
-            for i in super()._read_value_indexes(threshold, fill_percents)
-        ]
-
-
-class _GridFieldGroup(abc.ABC):
-    """A grid field group is a group of grid fields, ie a word. Do not use
-    directly."""
-
-    fields: tp.Sequence[_GridField]
-
-    @abc.abstractclassmethod
-    def __init__(self, grid: Grid, horizontal_start: int, vertical_start: int,
-                 num_fields: int, field_length: int,
-                 field_orientation: geometry_utils.Orientation):
-        ...
-
-    def read_value(self, threshold: float,
-                   fill_percents: tp.List[tp.List[float]]
-                   ) -> tp.List[tp.Union[tp.List[str], tp.List[int]]]:
-        """Calculate the field value using precalculated fill percents."""
-        return [
-            field.read_value(threshold, fill_percents[i])
-            for i, field in enumerate(self.fields)
-        ]
-
-    def get_all_fill_percents(self) -> tp.List[tp.List[float]]:
-        return [field.get_all_fill_percents() for field in self.fields]
-
-
-class NumberGridFieldGroup(_GridFieldGroup):
-    """A number grid field group is one group of fields that represents an
-    entire number."""
-    def __init__(self, grid: Grid, horizontal_start: int, vertical_start: int,
-                 num_fields: int, field_length: int,
-                 field_orientation: geometry_utils.Orientation):
-        fields_vertical = field_orientation is geometry_utils.Orientation.VERTICAL
-        self.fields = [
-            NumberGridField(
-                grid,
-                horizontal_start + i if fields_vertical else horizontal_start,
-                vertical_start + i if not fields_vertical else vertical_start,
-                field_orientation, field_length) for i in range(num_fields)
+    def __init__(self,
+                 corners: geometry_utils.Polygon,
+                 horizontal_cells: int,
+                 vertical_cells: int,
+                 image: np.ndarray,
+                 pixels_per_cell: int = DEFAULT_PIXELS_PER_CELL,
+                 save_path: tp.Optional[pathlib.PurePath] = None):
+        """Initiate a new RectifiedGrid. Corners should be clockwise starting
+        from the top left - if not, the grid will have unexpected behavior.
+
+        If `save_path` is provided, will save the rectified image to this
+        location as "rectified.jpg" and the grid as "grid.jpg". Used for
+        debugging purposes."""
+        width = horizontal_cells * pixels_per_cell
+        height = vertical_cells * pixels_per_cell
+        canonical_corners = [
+            geometry_utils.Point(0, 0),
+            geometry_utils.Point(width, 0),
+            geometry_utils.Point(width, height),
+            geometry_utils.Point(0, height)
         ]
+        self.pixels_per_cell = pixels_per_cell
+        self.perspective_transform = cv2.getPerspectiveTransform(
+            np.array([[p.x, p.y] for p in corners], np.float32),
+            np.array([[p.x, p.y] for p in canonical_corners], np.float32))
+        rectified = cv2.warpPerspective(image,
+                                        self.perspective_transform,
+                                        (width, height),
+                                        flags=cv2.INTER_LINEAR,
+                                        borderValue=255)
+        if save_path:
+            image_utils.save_image(save_path / "rectified.jpg", rectified)
+        super().__init__(canonical_corners, horizontal_cells, vertical_cells,
+                         rectified, save_path)
 
-    def read_value(self, threshold: float,
-                   fill_percents: tp.List[tp.List[float]]
-                   ) -> tp.List[tp.List[int]]:
-        return tp.cast(tp.List[tp.List[int]],
-                       super().read_value(threshold, fill_percents))
-
-
-class LetterGridFieldGroup(_GridFieldGroup):
-    """A letter grid field group is one group of fields that represents an
-    entire string."""
-    def __init__(self, grid: Grid, horizontal_start: int, vertical_start: int,
-                 num_fields: int, field_length: int,
-                 field_orientation: geometry_utils.Orientation):
-        fields_vertical = field_orientation is geometry_utils.Orientation.VERTICAL
-        self.fields = [
-            LetterGridField(
-                grid,
-                horizontal_start + i if fields_vertical else horizontal_start,
-                vertical_start + i if not fields_vertical else vertical_start,
-                field_orientation, field_length) for i in range(num_fields)
-        ]
+    def get_fill_percent_matrix(self) -> np.ndarray:
+        """Get the fill percent of every cell in the grid as a
+        `(vertical_cells, horizontal_cells)` array."""
+        mask = _get_rectified_cell_mask(self.pixels_per_cell)
+        cells = self.image.reshape(self.vertical_cells, self.pixels_per_cell,
+                                   self.horizontal_cells, self.pixels_per_cell)
+        sums = np.tensordot(cells, mask, axes=([1, 3], [0, 1]))
+        return 1 - (sums / mask.sum() / 255)
 
-    def read_value(self, threshold: float,
-                   fill_percents: tp.List[tp.List[float]]
-                   ) -> tp.List[tp.List[str]]:
-        return tp.cast(tp.List[tp.List[str]],
-                       super().read_value(threshold, fill_percents))
-
-
-def get_group_from_info(info: grid_info.GridGroupInfo,
-                        grid: Grid) -> _GridFieldGroup:
-    if info.fields_type is grid_info.FieldType.LETTER:
-        return LetterGridFieldGroup(grid, info.horizontal_start,
-                                    info.vertical_start, info.num_fields,
-                                    info.field_length, info.field_orientation)
-    else:
-        return NumberGridFieldGroup(grid, info.horizontal_start,
-                                    info.vertical_start, info.num_fields,
-                                    info.field_length, info.field_orientation)
-
-
-def read_field(field: grid_info.Field, grid: Grid, threshold: float,
-               form_variant: grid_info.FormVariant,
-               fill_percents: tp.List[tp.List[float]]
-               ) -> tp.Optional[tp.List[tp.Union[tp.List[str], tp.List[int]]]]:
-    """Shortcut to read a field given just the key for it and the grid object."""
-    grid_group_info = form_variant.fields[field]
-    if grid_group_info is not None:
-        return get_group_from_info(grid_group_info,
-                                   grid).read_value(threshold, fill_percents)
-    else:
-        return None
-
-
-def read_answer(question: int, grid: Grid, threshold: float,
-                form_variant: grid_info.FormVariant,
-                fill_percents: tp.List[tp.List[float]]
-                ) -> tp.List[tp.Union[tp.List[str], tp.List[int]]]:
-    """Shortcut to read a field given just the key for it and the grid object."""
-    return get_group_from_info(form_variant.questions[question],
-                               grid).read_value(threshold, fill_percents)
+    def get_fill_percents(self, cells: np.ndarray) -> np.ndarray:
+        return self.get_fill_percent_matrix()[cells[:, 1], cells[:, 0]]
 
 
 def field_group_to_string(
@@ -339,59 +276,48 @@ def field_group_to_string(
     return "".join(result_strings).strip()
 
 
-def read_field_as_string(field: grid_info.Field, grid: Grid, threshold: float,
-                         form_variant: grid_info.FormVariant,
-                         fill_percents: tp.List[tp.List[float]]
-                         ) -> tp.Optional[str]:
-    """Shortcut to read a field and format it as a string, given just the key and
-    the grid object. """
-    field_group = read_field(field, grid, threshold, form_variant,
-                             fill_percents)
-    if field_group is not None:
-        return field_group_to_string(field_group)
-    else:
-        return None
-
-
-def read_answer_as_string(question: int, grid: Grid,
-                          threshold: float,
-                          form_variant: grid_info.FormVariant,
-                          fill_percents: tp.List[tp.List[float]]) -> str:
-    """Shortcut to read a question's answer and format it as a string, given
-    just the question number and the grid object. """
-    answer = field_group_to_string(
-        read_answer(question, grid, threshold, form_variant, fill_percents))
-    return answer
-
-
-def calculate_bubble_fill_threshold(
-        field_fill_percents: tp.Dict[grid_info.Field, tp.List[tp.List[float]]],
-        answer_fill_percents: tp.List[tp.List[tp.List[float]]],
-        form_variant: grid_info.FormVariant,
-        save_path: tp.Optional[pathlib.PurePath] = None) -> float:
+def read_fill_percents(
+        compiled_form: grid_info.CompiledFormVariant, fill_percents: np.ndarray,
+        threshold: float) -> tp.Tuple[tp.Dict[grid_info.Field, str], tp.List[str]]:
+    """Read every field and answer on a sheet, given the fill percent of every
+    bubble in the order of `compiled_form.cells`.
+
+    Returns the field values and the answers, each formatted with
+    `field_group_to_string`."""
+    values: tp.List[tp.List[str]] = [
+        [] for _ in range(compiled_form.group_position_offsets[-1])
+    ]
+    for bubble in np.flatnonzero(fill_percents > threshold):
+        values[compiled_form.bubble_positions[bubble]].append(
+            compiled_form.bubble_symbols[bubble])
+    offsets = compiled_form.group_position_offsets
+    strings = [
+        field_group_to_string(values[offsets[i]:offsets[i + 1]])
+        for i in range(len(offsets) - 1)
+    ]
+    num_fields = len(compiled_form.fields)
+    return dict(zip(compiled_form.fields,
+                    strings[:num_fields])), strings[num_fields:]
+
+
+def calculate_fill_threshold(fill_percents: np.ndarray,
+                             save_path: tp.Optional[pathlib.PurePath] = None
+                             ) -> float:
     """Dynamically calculate the threshold to use for determining if a bubble is
-    filled or unfilled.
+    filled or unfilled, given the fill percents of every bubble on the page as
+    a single flat array.
 
-    This is a time consuming function so it should only be called once per page.
-    It works by getting the fill percentages of all the values in all the
-    fields, sorting them, and finding the largest increase in fill percent
-    between all the values in the highest 1/4 (assumes all the filled bubbles
-    are less than 1/4 of all the bubbles). It then returns the average of the
-    two values that were subtracted to make the largest increase.
+    It works by sorting the fill percents and finding the largest increase in
+    fill percent between the values in the highest 1/5 (assumes all the
+    filled bubbles are less than 1/5 of all the bubbles). It then returns the
+    average of the two values that make up the largest increase.
 
     If `save_path` is provided, saves debugging data to this location as
     "threshold_values.txt".
     """
-    fill_percents_lists = list(
-        field_fill_percents.values()) + answer_fill_percents
-    fill_percents = [np.array(l).flatten() for l in fill_percents_lists]
-    sorted_and_flattened = np.sort(np.concatenate(fill_percents))
+    sorted_and_flattened = np.sort(fill_percents)
     last_chunk = sorted_and_flattened[-round(sorted_and_flattened.size / 5):]
-    differences = [
-        last_chunk[i + 1] - last_chunk[i] for i in range(last_chunk.size - 1)
-    ]
-    biggest_diff_index = list_utils.find_greatest_value_indexes(
-        differences, 1)[0]
+    biggest_diff_index = int(np.argmax(np.diff(last_chunk)))
     result = (last_chunk[biggest_diff_index] +
               last_chunk[biggest_diff_index + 1]) / 2
     if save_path:
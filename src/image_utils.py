@@ -1,34 +1,83 @@
 """Image filtering and processing utilities."""
 
+import functools
+import os
 import pathlib
 import typing as tp
 
 import cv2
 import numpy as np
 from numpy import ma
-from pdf2image import convert_from_path
 
 import geometry_utils
+import metrics
+import pdf_parsing
 
 SUPPORTED_IMAGE_EXTENSIONS = [".tiff", ".tif", ".pdf"]
 
+"""A rectangular region of an image as `(x, y, width, height)`."""
+Region = tp.Tuple[int, int, int, int]
+
+
+class BufferPool():
+    """Preallocated image arrays that are reused from one page to the next.
+
+    Pages in a scan are almost always the same size, so instead of allocating
+    new full-page arrays at every processing step of every page, the steps
+    write into named buffers from the pool. A buffer is only reallocated when
+    a different shape or type is requested. Arrays returned from functions
+    given a pool are overwritten when the next page is processed.
+    """
+    _buffers: tp.Dict[str, np.ndarray]
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name: str, shape: tp.Tuple[int, ...],
+            dtype: tp.Any = np.uint8) -> np.ndarray:
+        """Get the buffer with the given name, with uninitialized contents."""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+
+def _get_buffer(buffers: tp.Optional[BufferPool], name: str,
+                like: np.ndarray,
+                shape: tp.Optional[tp.Tuple[int, ...]] = None
+                ) -> tp.Optional[np.ndarray]:
+    """Get a buffer for the result of a step, or `None` to let OpenCV allocate
+    one if no pool is in use."""
+    if buffers is None:
+        return None
+    return buffers.get(name, like.shape if shape is None else shape, like.dtype)
+
 
 def convert_to_grayscale(image: np.ndarray,
-                         save_path: tp.Optional[pathlib.PurePath] = None
+                         save_path: tp.Optional[pathlib.PurePath] = None,
+                         buffers: tp.Optional[BufferPool] = None
                          ) -> np.ndarray:
-    """Convert an image to grayscale.
+    """Convert an image to grayscale. Images that are already single-channel
+    are returned as is.
 
     If `save_path` is provided, will save the resulting image to this location
     as "grayscale.jpg". Used for debugging purposes.
     """
-    result = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if image.ndim == 2:
+        result = image
+    else:
+        result = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY,
+                              dst=_get_buffer(buffers, "grayscale", image,
+                                              image.shape[:2]))
     if save_path:
         save_image(save_path / "grayscale.jpg", result)
     return result
 
 
 def remove_hf_noise(image: np.ndarray,
-                    save_path: tp.Optional[pathlib.PurePath] = None
+                    save_path: tp.Optional[pathlib.PurePath] = None,
+                    buffers: tp.Optional[BufferPool] = None
                     ) -> np.ndarray:
     """Blur image slightly to remove high-frequency noise.
 
@@ -40,7 +89,8 @@ def remove_hf_noise(image: np.ndarray,
     # NOTE: This assumes the image is roughly A4 paper shaped. If this fails,
     # consider switching to using the mean of the image dimensions.
     sigma = min(get_dimensions(image)) * (5.6569e-4)
-    result = cv2.GaussianBlur(image, (0, 0), sigmaX=sigma)
+    result = cv2.GaussianBlur(image, (0, 0), sigmaX=sigma,
+                              dst=_get_buffer(buffers, "noise_filtered", image))
     if save_path:
         save_image(save_path / "noise_filtered.jpg", result)
     return result
@@ -60,43 +110,390 @@ def detect_edges(image: np.ndarray,
                        low_threshold * 3,
                        L2gradient=True,
                        edges=3)
+    # Canny leaves one pixel gaps in the outlines of shapes with jagged edges,
+    # like corner marks in low resolution bilevel scans. A contour traced
+    # through a gap runs along both sides of the outline and can't be
+    # approximated as the shape anymore, so the gaps are closed.
+    cv2.morphologyEx(result, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8),
+                     dst=result)
     if save_path:
         save_image(save_path / "edges.jpg", result)
     return result
 
 
-def find_contours(edges: np.ndarray) -> np.ndarray:
-    """Find the contours in an edge-detected image."""
-    contours, _ = cv2.findContours(edges, cv2.RETR_TREE,
-                                   cv2.CHAIN_APPROX_SIMPLE)
+def find_contours(edges: np.ndarray, external_only: bool = False) -> np.ndarray:
+    """Find the contours in an edge-detected image. If `external_only` is set,
+    contours nested inside other contours are skipped, which is faster."""
+    contours, _ = cv2.findContours(
+        edges, cv2.RETR_EXTERNAL if external_only else cv2.RETR_TREE,
+        cv2.CHAIN_APPROX_SIMPLE)
     return contours
 
 
-def get_images(image_paths: tp.List[pathlib.PurePath], 
-               save_path: tp.Optional[pathlib.PurePath] = None
-               ) -> tuple[tp.List[np.ndarray], tp.List[str], tp.List[str]]:
-    """parses multi-page images into a name and image tuple. If `save_path` 
-    is provided, will save the resulting image to this location as 
-    "original.jpg". Used for debugging purposes.
+"""Number of PDF pages rasterized per call to pdf2image. Larger batches amortize
+the poppler start-up cost, smaller ones keep peak memory down."""
+PDF_PAGE_BATCH_SIZE = 4
+
+"""A decoded page in `(name, type, image)` form."""
+Page = tp.Tuple[str, str, np.ndarray]
+
+
+def _is_pdf(image_path: pathlib.PurePath) -> bool:
+    return image_path.suffix.lower() == ".pdf"
+
+
+def _get_page_name(image_path: pathlib.PurePath, index: int,
+                   source_name: tp.Optional[str] = None) -> str:
+    return (source_name or str(image_path.stem)) + "_" + str(index + 1)
+
+
+def get_source_names(image_paths: tp.Sequence[pathlib.PurePath]
+                     ) -> tp.Dict[pathlib.PurePath, str]:
+    """Name every input file for the names of its pages.
+
+    Files are named by their stem, like `scan` for `tray1/scan.pdf`, unless
+    another input has the same stem. Those are qualified with their folders
+    below the folder they have in common, like `tray1_scan` and `tray2_scan`,
+    and with their extension if that's still ambiguous, like `scan_pdf`. The
+    names only depend on the paths, so they are the same every run.
+    """
+    by_stem: tp.Dict[str, tp.List[pathlib.PurePath]] = {}
+    for image_path in image_paths:
+        by_stem.setdefault(image_path.stem.lower(), []).append(image_path)
+
+    names = {}
+    for same_stem in by_stem.values():
+        if len(same_stem) == 1:
+            names[same_stem[0]] = same_stem[0].stem
+            continue
+        absolute_paths = [os.path.abspath(image_path) for image_path in same_stem]
+        common_folder = os.path.commonpath(
+            [os.path.dirname(path) for path in absolute_paths])
+        qualified = [
+            "_".join(pathlib.PurePath(os.path.relpath(path, common_folder)).with_suffix("").parts)
+            for path in absolute_paths
+        ]
+        for image_path, name in zip(same_stem, qualified):
+            if [other.lower() for other in qualified].count(name.lower()) > 1:
+                name += "_" + _get_page_type(image_path).lower()
+            names[image_path] = name
+    return names
+
+
+def _get_page_type(image_path: pathlib.PurePath) -> str:
+    return str(image_path.suffix)[1:]
+
+
+@functools.lru_cache(maxsize=1)
+def _open_pdf_document(path: str, modified_ns: int
+                       ) -> tp.Optional[pdf_parsing.PdfDocument]:
+    try:
+        document = pdf_parsing.PdfDocument.from_file(pathlib.Path(path))
+    except (pdf_parsing.PdfParseError, OSError):
+        return None
+    document.close()
+    return document
+
+
+def _get_pdf_document(image_path: pathlib.PurePath
+                      ) -> tp.Optional[pdf_parsing.PdfDocument]:
+    """Parse a PDF with the built-in reader, or return `None` if it can't be
+    parsed. The structure of the last document is kept, since its pages are
+    usually loaded one after the other. Its file isn't kept open: it is mapped
+    again whenever it's read, and should be closed after that."""
+    return _open_pdf_document(str(image_path),
+                              os.stat(image_path).st_mtime_ns)
+
+
+def _extract_pdf_page_image(image_path: pathlib.PurePath, index: int,
+                            grayscale: bool) -> tp.Optional[np.ndarray]:
+    """Decode the image a PDF page consists of, or return `None` if the page
+    has to be rasterized."""
+    document = _get_pdf_document(image_path)
+    if document is None:
+        return None
+    with document:
+        return document.extract_page_image(index, grayscale)
+
+
+def count_file_pages(image_path: pathlib.PurePath) -> int:
+    """Returns the number of pages in a multi-page image without decoding
+    them."""
+    if _is_pdf(image_path):
+        document = _get_pdf_document(image_path)
+        if document is not None:
+            return len(document.pages)
+        # Imported when first needed, since most PDFs never need poppler.
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(str(image_path))["Pages"])
+    return cv2.imcount(str(image_path))
+
+
+def count_pages(image_paths: tp.List[pathlib.PurePath]) -> int:
+    """Returns the total number of pages in all the given multi-page images."""
+    return sum(count_file_pages(image_path) for image_path in image_paths)
+
+
+"""Default resolution PDF pages are rasterized at. See also
+`grid_info.MIN_RELIABLE_DPI`."""
+DEFAULT_PDF_DPI = 200
+
+
+class DecodeOptions():
+    """Settings that control how pages are decoded from input files.
+
+    Members:
+        grayscale: If `True`, pages are decoded straight to single-channel
+            8-bit images. Bubble sheets are effectively monochrome, and this
+            takes a third of the memory and of the work in later steps.
+            Otherwise, pages are decoded as 3-channel BGR images.
+        pdf_dpi: Resolution PDF pages are rasterized at. Lower is faster, but
+            some pages may be rejected below `grid_info.MIN_RELIABLE_DPI`.
+        pdf_threads: Number of poppler processes used to rasterize each batch
+            of PDF pages.
+        use_pdftocairo: Rasterize with pdftocairo instead of pdftoppm. It is
+            faster on some documents, but writes pages to a temporary folder
+            instead of piping them straight into memory.
+        extract_pdf_images: If `True`, PDF pages that consist of a single
+            embedded image, as scanners produce, are read by decoding that
+            image at its native resolution instead of rasterizing the page.
+            `pdf_dpi` then only applies to the other pages.
+    """
+    grayscale: bool
+    pdf_dpi: int
+    pdf_threads: int
+    use_pdftocairo: bool
+    extract_pdf_images: bool
+
+    def __init__(self,
+                 grayscale: bool = True,
+                 pdf_dpi: int = DEFAULT_PDF_DPI,
+                 pdf_threads: int = 1,
+                 use_pdftocairo: bool = False,
+                 extract_pdf_images: bool = True):
+        self.grayscale = grayscale
+        self.pdf_dpi = pdf_dpi
+        self.pdf_threads = pdf_threads
+        self.use_pdftocairo = use_pdftocairo
+        self.extract_pdf_images = extract_pdf_images
+
+
+def _pil_to_array(PIL_formatted_page: tp.Any) -> np.ndarray:
+    """Convert a page from pdf2image to an OpenCV image. Color pages are RGB
+    and have to be reordered to OpenCV's BGR."""
+    page = np.array(PIL_formatted_page)
+    if page.ndim == 3:
+        return cv2.cvtColor(page, cv2.COLOR_RGB2BGR)
+    return page
+
+
+def _get_imread_flags(options: DecodeOptions) -> int:
+    return cv2.IMREAD_GRAYSCALE if options.grayscale else cv2.IMREAD_COLOR
+
+
+def _rasterize_pdf_pages(image_path: pathlib.PurePath, first_page: int,
+                         last_page: int,
+                         options: DecodeOptions) -> tp.List[np.ndarray]:
+    """Rasterize a range of pages of a PDF (1-based, inclusive)."""
+    from pdf2image import convert_from_path
+    # Without an output folder, pdftoppm pipes uncompressed PPM/PGM data
+    # straight into memory, which is the cheapest format to parse.
+    PIL_formatted_pages = convert_from_path(
+        str(image_path),
+        dpi=options.pdf_dpi,
+        first_page=first_page,
+        last_page=last_page,
+        fmt="ppm",
+        output_folder=None,
+        thread_count=options.pdf_threads,
+        use_pdftocairo=options.use_pdftocairo,
+        grayscale=options.grayscale)
+    return [_pil_to_array(page) for page in PIL_formatted_pages]
+
+
+def get_pdf_batch_size(options: DecodeOptions) -> int:
+    """Number of PDF pages to rasterize per call with these options."""
+    # Each thread rasterizes a share of the batch, so give every one a page.
+    return max(PDF_PAGE_BATCH_SIZE, options.pdf_threads)
+
+
+def _load_pdf_page(image_path: pathlib.PurePath, index: int,
+                   options: DecodeOptions) -> np.ndarray:
+    """Load one PDF page, from its embedded image if possible."""
+    if options.extract_pdf_images:
+        image = _extract_pdf_page_image(image_path, index, options.grayscale)
+        if image is not None:
+            return image
+    return _rasterize_pdf_pages(image_path, index + 1, index + 1, options)[0]
+
+
+def _iter_pdf_pages(image_path: pathlib.PurePath,
+                    options: DecodeOptions) -> tp.Iterator[np.ndarray]:
+    if options.extract_pdf_images and _get_pdf_document(image_path) is not None:
+        # Pages that have to be rasterized are rare in scanner output, so they
+        # are rasterized one at a time as they come up.
+        for i in range(count_file_pages(image_path)):
+            with metrics.stage("decode"):
+                page = _load_pdf_page(image_path, i, options)
+            yield page
+        return
+
+    page_count = count_file_pages(image_path)
+    batch_size = get_pdf_batch_size(options)
+    for first_page in range(1, page_count + 1, batch_size):
+        last_page = min(first_page + batch_size - 1, page_count)
+        # The time to rasterize the batch is counted towards its first page.
+        with metrics.stage("decode"):
+            pages = _rasterize_pdf_pages(image_path, first_page, last_page,
+                                         options)
+        yield from pages
+
+
+def _count_readable_pages(image_path: pathlib.PurePath) -> int:
+    """Like `count_file_pages`, but raises ValueError if the file has no pages
+    that can be read, such as a corrupt or truncated file."""
+    num_pages = count_file_pages(image_path)
+    if num_pages <= 0:
+        raise ValueError(f"No pages could be read from '{image_path}'.")
+    return num_pages
+
+
+def _iter_tiff_pages(image_path: pathlib.PurePath,
+                     options: DecodeOptions) -> tp.Iterator[np.ndarray]:
+    for i in range(_count_readable_pages(image_path)):
+        yield PageRef(image_path, i, options).load()
+
+
+class PageRef():
+    """A reference to a single page of a multi-page image.
+
+    Page references are cheap to create and to pickle, so they can be handed to
+    worker processes that decode the page themselves instead of receiving the
+    full decoded image.
+    """
+    path: pathlib.PurePath
+    index: int
+    name: str
+    type: str
+    options: DecodeOptions
+
+    def __init__(self, path: pathlib.PurePath, index: int,
+                 options: tp.Optional[DecodeOptions] = None,
+                 source_name: tp.Optional[str] = None):
+        self.path = path
+        self.index = index
+        self.name = _get_page_name(path, index, source_name)
+        self.type = _get_page_type(path)
+        self.options = options or DecodeOptions()
+
+    def load(self) -> np.ndarray:
+        """Decode the referenced page."""
+        with metrics.stage("decode"):
+            if _is_pdf(self.path):
+                return _load_pdf_page(self.path, self.index, self.options)
+            success, pages = cv2.imreadmulti(str(self.path), self.index, 1,
+                                             flags=_get_imread_flags(self.options))
+        if not success or len(pages) == 0:
+            raise ValueError(f"Could not read page {self.index + 1} of {self.path}.")
+        return pages[0]
+
+
+def load_page_refs(page_refs: tp.Sequence[PageRef]) -> tp.List[np.ndarray]:
+    """Decode the referenced pages, in order.
+
+    PDF pages that have to be rasterized are rasterized together, one call per
+    run of consecutive pages of a PDF, instead of one call per page."""
+    images: tp.List[tp.Optional[np.ndarray]] = [None] * len(page_refs)
+    to_rasterize: tp.List[int] = []
+    with metrics.stage("decode"):
+        for i, page_ref in enumerate(page_refs):
+            if not _is_pdf(page_ref.path):
+                continue
+            if page_ref.options.extract_pdf_images:
+                images[i] = _extract_pdf_page_image(
+                    page_ref.path, page_ref.index, page_ref.options.grayscale)
+            if images[i] is None:
+                to_rasterize.append(i)
+
+        runs: tp.List[tp.List[int]] = []
+        for i in to_rasterize:
+            if runs:
+                previous = page_refs[runs[-1][-1]]
+                if (page_refs[i].path == previous.path
+                        and page_refs[i].index == previous.index + 1
+                        and len(runs[-1]) < get_pdf_batch_size(previous.options)):
+                    runs[-1].append(i)
+                    continue
+            runs.append([i])
+        for run in runs:
+            first, last = page_refs[run[0]], page_refs[run[-1]]
+            pages = _rasterize_pdf_pages(first.path, first.index + 1,
+                                         last.index + 1, first.options)
+            for i, page in zip(run, pages):
+                images[i] = page
+
+    for i, page_ref in enumerate(page_refs):
+        if images[i] is None:
+            if _is_pdf(page_ref.path):
+                raise ValueError(f"Could not read page {page_ref.index + 1} of {page_ref.path}.")
+            images[i] = page_ref.load()
+    return tp.cast(tp.List[np.ndarray], images)
+
+
+def iter_page_refs(image_paths: tp.List[pathlib.PurePath],
+                   options: tp.Optional[DecodeOptions] = None
+                   ) -> tp.Iterator[PageRef]:
+    """Yields a reference to every page of the given multi-page images, without
+    decoding any of them. Pages are named as described in `get_source_names`.
+
+    Raises ValueError when a file with no readable pages is reached."""
+    source_names = get_source_names(image_paths)
+    for image_path in image_paths:
+        for i in range(_count_readable_pages(image_path)):
+            yield PageRef(image_path, i, options, source_names[image_path])
+
+
+def iter_images(image_paths: tp.List[pathlib.PurePath],
+                save_path: tp.Optional[pathlib.PurePath] = None,
+                options: tp.Optional[DecodeOptions] = None
+                ) -> tp.Iterator[Page]:
+    """Lazily decodes multi-page images, yielding one `(name, type, image)`
+    tuple per page. Only a small batch of pages is held in memory at any time.
+    Pages are named as described in `get_source_names`.
+
+    Raises ValueError at a page that can't be decoded. Skipping it instead
+    would give every later page of the file the name of the page before it.
+
+    If `save_path` is provided, will save each page to this location as
+    "<name>.jpg". Used for debugging purposes.
+    """
+    options = options or DecodeOptions()
+    source_names = get_source_names(image_paths)
+    for image_path in image_paths:
+        pages = _iter_pdf_pages(image_path, options) if _is_pdf(
+            image_path) else _iter_tiff_pages(image_path, options)
+        for i, page in enumerate(pages):
+            name = _get_page_name(image_path, i, source_names[image_path])
+            if save_path:
+                save_image(save_path / f"{name}.jpg", page)
+            yield (name, _get_page_type(image_path), page)
+
+
+def get_images(image_paths: tp.List[pathlib.PurePath],
+               save_path: tp.Optional[pathlib.PurePath] = None,
+               options: tp.Optional[DecodeOptions] = None
+               ) -> tp.Tuple[tp.List[np.ndarray], tp.List[str], tp.List[str]]:
+    """Decodes every page of the multi-page images up front. Prefer
+    `iter_images`, which keeps memory usage flat for large batches.
     """
     images = []
     images_name = []
     images_type = []
-    for image_path in image_paths:
-        pages = []
-        if image_path.suffix.lower() == ".pdf":
-            PIL_formatted_pages = convert_from_path(str(image_path))
-            for PIL_formatted_page in PIL_formatted_pages:
-                pages.append(np.array(PIL_formatted_page))
-        else:
-            pages = cv2.imreadmulti(str(image_path), flags=cv2.IMREAD_COLOR)[1]
-        if len(pages) > 0: 
-            for i in range(len(pages)):
-                images.append(pages[i])
-                images_name.append(str(image_path.stem) + "_" + str(i+1))
-                images_type.append(str(image_path.suffix)[1:])
-                if save_path:
-                    save_image(save_path / "original.jpg", result)
+    for name, image_type, image in iter_images(image_paths, save_path,
+                                                 options):
+        images.append(image)
+        images_name.append(name)
+        images_type.append(image_type)
     return (images, images_name, images_type)
 
 
@@ -118,36 +515,50 @@ def find_polygons(image: np.ndarray,
     return polygons
 
 
+def downscale(image: np.ndarray, scale: float) -> np.ndarray:
+    """Shrink the image by the given factor (between 0 and 1)."""
+    return cv2.resize(image, None, fx=scale, fy=scale,
+                      interpolation=cv2.INTER_AREA)
+
+
 def get_dimensions(image: np.ndarray) -> tp.Tuple[int, int]:
     """Returns the dimensions of the image in `(width, height)` form."""
     return image.shape[0], image.shape[1]
 
 
 def threshold(image: np.ndarray,
-              save_path: tp.Optional[pathlib.PurePath] = None) -> np.ndarray:
+              save_path: tp.Optional[pathlib.PurePath] = None,
+              buffers: tp.Optional[BufferPool] = None) -> np.ndarray:
     """Convert an image to pure black and white pixels by thresholding.
 
     If `save_path` is provided, will save the resulting image to this location
     as "thresholded.jpg". Used for debugging purposes.
     """
-    gray_image = convert_to_grayscale(image)
+    gray_image = convert_to_grayscale(image, buffers=buffers)
     _, result = cv2.threshold(gray_image, 0, 255,
-                              cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+                              cv2.THRESH_BINARY | cv2.THRESH_OTSU,
+                              dst=_get_buffer(buffers, "thresholded",
+                                              gray_image))
     if save_path:
         save_image(save_path / "thresholded.jpg", result)
     return result
 
 
 def prepare_scan_for_processing(image: np.ndarray,
-                                save_path: tp.Optional[pathlib.PurePath] = None
+                                save_path: tp.Optional[pathlib.PurePath] = None,
+                                buffers: tp.Optional[BufferPool] = None
                                 ) -> np.ndarray:
     """Shortcut to prepare an image for processing.
 
     If `save_path` is provided, will save the resulting image to this location
-    as "prepared.jpg". Used for debugging purposes.
+    as "prepared.jpg". Used for debugging purposes. If `buffers` is provided,
+    every step writes into a buffer from the pool instead of a new array.
     """
-    without_noise = remove_hf_noise(image, save_path=save_path)
-    result = threshold(without_noise, save_path=save_path)
+    with metrics.stage("remove_hf_noise"):
+        without_noise = remove_hf_noise(image, save_path=save_path,
+                                        buffers=buffers)
+    with metrics.stage("threshold"):
+        result = threshold(without_noise, save_path=save_path, buffers=buffers)
     return result
 
 
@@ -159,10 +570,30 @@ def get_fill_percent(matrix: tp.Union[np.ndarray, ma.MaskedArray]) -> float:
         return 0
 
 
+def get_region_around(polygon: geometry_utils.Polygon, margin: int,
+                      image: np.ndarray) -> Region:
+    """Get the bounding box of the polygon grown by `margin` pixels on every
+    side, clipped to the image."""
+    height, width = image.shape[:2]
+    left = max(int(np.floor(min(p.x for p in polygon))) - margin, 0)
+    top = max(int(np.floor(min(p.y for p in polygon))) - margin, 0)
+    right = min(int(np.ceil(max(p.x for p in polygon))) + margin + 1, width)
+    bottom = min(int(np.ceil(max(p.y for p in polygon))) + margin + 1, height)
+    return left, top, max(right - left, 0), max(bottom - top, 0)
+
+
 def dilate(image: np.ndarray,
-           save_path: tp.Optional[pathlib.PurePath] = None) -> np.ndarray:
+           save_path: tp.Optional[pathlib.PurePath] = None,
+           region: tp.Optional[Region] = None,
+           in_place: bool = False) -> np.ndarray:
     """Dilate the image.
 
+    If `region` is provided, only that part of the image is dilated and the
+    rest is left as is. Pixels within a pixel of the region's edge are only
+    partially dilated, so the region should have a small margin around the
+    area that will be read. If `in_place` is set, the image itself is
+    modified instead of a copy.
+
     If `save_path` is provided, will save the resulting image to this location
     as "dilated.jpg". Used for debugging purposes.
     """
@@ -170,7 +601,15 @@ def dilate(image: np.ndarray,
     # has a far more significant effect on smaller images, which helps to
     # counter the detail loss when Gaussian filtering small images that already
     # have too little detail.
-    result = cv2.dilate(image, np.ones((3, 3), np.uint8), iterations=1)
+    kernel = np.ones((3, 3), np.uint8)
+    if region is None:
+        result = cv2.dilate(image, kernel, iterations=1,
+                            dst=image if in_place else None)
+    else:
+        result = image if in_place else image.copy()
+        x, y, width, height = region
+        area = result[y:y + height, x:x + width]
+        cv2.dilate(area, kernel, iterations=1, dst=area)
     if save_path:
         save_image(save_path / "dilated.jpg", result)
     return result
@@ -1,13 +1,23 @@
 import argparse
+import concurrent.futures
+import contextlib
+import functools
 import sys
+import typing as tp
 from datetime import datetime
 from pathlib import Path
 
-import file_handling
-import image_utils
-from file_handling import parse_path_arg
+from data_exporting import get_debug_dir
+from file_handling import expand_input_paths, parse_path_arg
 import grid_info as grid_i
+import grid_reading as grid_r
+from image_utils import DEFAULT_PDF_DPI, DecodeOptions
 from process_input import process_input
+from profiling import PROFILE_MODES, PageProfiler, profile_batch
+from result_cache import DEFAULT_CACHE_SIZE_MB, ResultCache, get_default_cache_dir
+from sheet_recognition import RecognitionOptions, create_worker_pool
+from str_utils import strip_double_quotes
+from watching import ARCHIVE_FOLDER_NAME, DEFAULT_POLL_INTERVAL, FAILED_FOLDER_NAME, watch_folder
 
 
 if __name__ == '__main__':
@@ -16,20 +26,130 @@ if __name__ == '__main__':
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('--test_identifier',
                         help='Name of Test and Other Descriptive Information',
-                        type=parse_path_arg)
+                        default="")
     parser.add_argument('--input_file',
-                        help='Path to a folder containing scanned input sheets.\n'
-                             'Sheets with student ID of "9999999999" treated as keys. Ignores subfolders.',
-                        type=parse_path_arg)
+                        nargs='+',
+                        metavar='INPUT',
+                        help='Scanned input sheets: one or more pdf or tiff files, folders containing them (subfolders are\n'
+                             'ignored) or glob patterns such as "scans/*.pdf". All pages are processed as one batch, with\n'
+                             'page names qualified by folder when files in different folders have the same name.\n'
+                             'Sheets with student ID of "9999999999" treated as keys.',
+                        type=strip_double_quotes)
     parser.add_argument('--output_folder',
                         help='Path to a folder to save result to.',
                         type=parse_path_arg)
+    parser.add_argument('--watch',
+                        type=parse_path_arg,
+                        default=None,
+                        metavar='FOLDER',
+                        help='Instead of processing --input_file, keep running and process every pdf or tiff file in\n'
+                             'FOLDER (not its subfolders) as soon as it is completely written. Each file is processed\n'
+                             'on its own into a folder of the output folder named after it, then moved to the archive\n'
+                             'folder, or to the failed folder if it could not be processed. The worker processes stay\n'
+                             'running between files. Stop with Ctrl+C.')
+    parser.add_argument('--archive-folder',
+                        type=parse_path_arg,
+                        default=None,
+                        help=f'Folder --watch moves processed files to. Defaults to an "{ARCHIVE_FOLDER_NAME}" folder in\n'
+                             'the watched folder.')
+    parser.add_argument('--failed-folder',
+                        type=parse_path_arg,
+                        default=None,
+                        help='Folder --watch moves files that could not be processed to. Defaults to a\n'
+                             f'"{FAILED_FOLDER_NAME}" folder in the watched folder.')
+    parser.add_argument('--poll-interval',
+                        type=float,
+                        default=DEFAULT_POLL_INTERVAL,
+                        metavar='SECONDS',
+                        help='Seconds between checks of the --watch folder for new files. A file is processed once it\n'
+                             f'is unchanged between two checks. Defaults to {DEFAULT_POLL_INTERVAL:g}.')
     parser.add_argument('-s', '--sort',
                         action='store_true',
                         help="Sort output by students' name.")
     parser.add_argument('-d', '--debug',
                         action='store_true',
                         help='Turn debug mode on. Additional directory with debug data will be created.')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes used to recognize pages in parallel. Defaults to 1.')
+    parser.add_argument('--perspective',
+                        action='store_true',
+                        help='Use all four corner marks to warp each sheet into a canonical raster before reading it.\n'
+                             'More robust on trapezoidal scans, such as photos taken with a phone.')
+    parser.add_argument('--pixels-per-cell',
+                        type=int,
+                        default=grid_r.DEFAULT_PIXELS_PER_CELL,
+                        help='Resolution of the canonical raster used with --perspective, in pixels per grid cell.\n'
+                             f'Defaults to {grid_r.DEFAULT_PIXELS_PER_CELL}.')
+    parser.add_argument('--color',
+                        action='store_true',
+                        help='Decode pages in color instead of straight to grayscale. Slower and uses more memory.')
+    parser.add_argument('--dpi',
+                        type=int,
+                        default=DEFAULT_PDF_DPI,
+                        help='Resolution PDF pages are rasterized at. Lower is faster, but some pages may be rejected below\n'
+                             f'{grid_i.MIN_RELIABLE_DPI} DPI. Defaults to {DEFAULT_PDF_DPI}.')
+    parser.add_argument('--pdf-threads',
+                        type=int,
+                        default=1,
+                        help='Number of poppler processes used to rasterize PDF pages. Defaults to 1.')
+    parser.add_argument('--use-pdftocairo',
+                        action='store_true',
+                        help='Rasterize PDF pages with pdftocairo instead of pdftoppm.')
+    parser.add_argument('--rasterize-pdfs',
+                        action='store_true',
+                        help='Always rasterize PDF pages, even pages that are a single scanned image which could be\n'
+                             'read directly at its native resolution.')
+    parser.add_argument('--append',
+                        action='store_true',
+                        help='Add the input to the results already saved in the output folder instead of starting over.\n'
+                             'Pages processed before are skipped, and a new sheet replaces earlier sheets with the same\n'
+                             'student ID. Scores and handouts are regenerated from the combined results.\n'
+                             'Pages are recognized by their decoded pixels, so a page decoded differently before (with\n'
+                             'or without --color, at another --dpi, or with --rasterize-pdfs) is processed again, and so\n'
+                             'are pages from earlier runs that used neither the cache nor --append.')
+    parser.add_argument('--handouts-per-student',
+                        action='store_true',
+                        help='Save every student\'s scored handout to its own PDF file, named by student ID, in a\n'
+                             'Handouts folder instead of all of them to Scores.pdf. Each file can be used as soon\n'
+                             'as it is written.')
+    parser.add_argument('--metrics',
+                        type=parse_path_arg,
+                        default=None,
+                        metavar='FILE',
+                        help='Write the time spent in every processing stage to FILE as JSON Lines: a record for\n'
+                             'every page, followed by percentiles of every stage over the batch.')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const=PROFILE_MODES[0],
+                        choices=PROFILE_MODES,
+                        help='Profile the run and save the profile to the debug directory: a .pstats file from cProfile\n'
+                             'and a .collapsed file of sampled stacks for flamegraphs. With "sampling", only the\n'
+                             'low-overhead sampling profiler runs. All pages are processed in this process.')
+    parser.add_argument('--profile-slower-than',
+                        type=float,
+                        default=None,
+                        metavar='MS',
+                        help='Profile every page on its own, and only save the profiles of pages that take longer than\n'
+                             'MS milliseconds. Implies --profile.')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Cache page measurements, so re-running the same scans is fast. Measurements are only\n'
+                             'reused by the version of the recognition that made them.')
+    parser.add_argument('--cache-dir',
+                        type=parse_path_arg,
+                        default=None,
+                        help='Folder to cache page measurements in. Implies --cache.\n'
+                             f'Defaults to {get_default_cache_dir()}.')
+    parser.add_argument('--cache-size-mb',
+                        type=int,
+                        default=DEFAULT_CACHE_SIZE_MB,
+                        help='Size the cache is trimmed to after every run, in megabytes. '
+                             f'Defaults to {DEFAULT_CACHE_SIZE_MB}.')
+    parser.add_argument('--clear-cache',
+                        action='store_true',
+                        help='Remove all cached page measurements before processing. Exits if no input is given.')
     parser.add_argument('--disable-timestamps',
                         action='store_true',
                         help='Disable timestamps in file names. Useful when consistent file names are required. Existing files will be overwritten without warning!')
@@ -41,23 +161,119 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    test_identifier = args.test_identifier,
-    multi_page_image_file = Path(args.input_file)
+    cache = ResultCache(Path(args.cache_dir) if args.cache_dir is not None else get_default_cache_dir(),
+                        args.cache_size_mb * 1024 * 1024)
+    if args.clear_cache:
+        cache.clear()
+        if args.input_file is None and args.watch is None:
+            sys.exit(0)
+
+    test_identifier = args.test_identifier
+    if args.watch is not None:
+        if args.input_file:
+            print("Error: Give either --input_file or --watch, not both.")
+            sys.exit(1)
+        if args.append or args.metrics is not None or args.profile is not None or \
+                args.profile_slower_than is not None:
+            print("Error: --watch can't be combined with --append, --metrics or --profile.")
+            sys.exit(1)
+        if not args.watch.is_dir():
+            print(f"Error: Watched folder '{args.watch}' does not exist.")
+            sys.exit(1)
+        input_files = []
+    else:
+        try:
+            input_files = expand_input_paths(args.input_file or [])
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if not input_files:
+            print("Error: No input files given.")
+            sys.exit(1)
+    if args.output_folder is None:
+        print("Error: No output folder given.")
+        sys.exit(1)
     output_folder = Path(args.output_folder)
     sort_results = args.sort
     debug_mode_on = args.debug
     form_variant = grid_i.form_75q
     files_timestamp = datetime.now().replace(microsecond=0) if not args.disable_timestamps else None
 
-    images, images_name, images_type = image_utils.get_images([multi_page_image_file])
-
-process_input(test_identifier,
-              images,
-              images_name,
-              images_type,
-              output_folder,
-              sort_results,
-              debug_mode_on,
-              form_variant,
-              None,
-              files_timestamp)
+    if (args.watch is not None or any(path.suffix.lower() == ".pdf" for path in input_files)) and \
+            args.dpi < grid_i.MIN_RELIABLE_DPI:
+        print(f"Warning: PDF pages will be rasterized at {args.dpi} DPI. Some pages may be rejected below "
+              f"{grid_i.MIN_RELIABLE_DPI} DPI.")
+
+    profile_mode = args.profile
+    if profile_mode is None and args.profile_slower_than is not None:
+        profile_mode = PROFILE_MODES[0]
+    workers = args.workers
+    if profile_mode is not None and workers > 1:
+        print("Profiling processes all pages in this process, so --workers is ignored.")
+        workers = 1
+    debug_dir = get_debug_dir(output_folder, files_timestamp)
+    page_profiler = None
+    if args.profile_slower_than is not None:
+        page_profiler = PageProfiler(debug_dir, args.profile_slower_than, profile_mode)
+        batch_profiling: tp.ContextManager = contextlib.nullcontext()
+    elif profile_mode is not None:
+        batch_profiling = profile_batch(debug_dir, profile_mode)
+    else:
+        batch_profiling = contextlib.nullcontext()
+
+    recognition_options = RecognitionOptions(perspective=args.perspective,
+                                             pixels_per_cell=args.pixels_per_cell)
+    decode_options = DecodeOptions(grayscale=not args.color,
+                                   pdf_dpi=args.dpi,
+                                   pdf_threads=args.pdf_threads,
+                                   use_pdftocairo=args.use_pdftocairo,
+                                   extract_pdf_images=not args.rasterize_pdfs)
+    measurement_cache = cache if args.cache or args.cache_dir is not None else None
+
+    if args.watch is not None:
+        # Debug data is saved to every file's own output folder, which the
+        # workers of a shared pool can't be told, so debug runs start a pool
+        # for every file.
+        create_pool = None
+        if workers > 1 and not debug_mode_on:
+            create_pool = functools.partial(create_worker_pool, workers, form_variant,
+                                            options=recognition_options, cache=measurement_cache)
+
+        def process_file(input_file: Path, file_output_folder: Path,
+                         executor: tp.Optional[concurrent.futures.Executor]) -> bool:
+            return process_input(test_identifier, [input_file], file_output_folder, sort_results,
+                                 debug_mode_on, form_variant, None,
+                                 datetime.now().replace(microsecond=0) if not args.disable_timestamps else None,
+                                 workers=workers,
+                                 recognition_options=recognition_options,
+                                 decode_options=decode_options,
+                                 cache=measurement_cache,
+                                 handouts_per_student=args.handouts_per_student,
+                                 executor=executor)
+
+        try:
+            watch_folder(args.watch, output_folder,
+                         args.archive_folder or args.watch / ARCHIVE_FOLDER_NAME,
+                         args.failed_folder or args.watch / FAILED_FOLDER_NAME,
+                         process_file, create_pool, args.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        sys.exit(0)
+
+    with batch_profiling:
+        process_input(test_identifier,
+                      input_files,
+                      output_folder,
+                      sort_results,
+                      debug_mode_on,
+                      form_variant,
+                      None,
+                      files_timestamp,
+                      workers=workers,
+                      recognition_options=recognition_options,
+                      decode_options=decode_options,
+                      cache=measurement_cache,
+                      append=args.append,
+                      metrics_path=args.metrics,
+                      page_profiler=page_profiler,
+                      handouts_per_student=args.handouts_per_student)
@@ -1,33 +1,53 @@
-import file_handling
+import multiprocessing
 import grid_info as grid_i
 import image_utils
+import result_cache
 import user_interface
 import sys
 from process_input import process_input
 from datetime import datetime
 
-user_input = user_interface.MainWindow()
-if (user_input.cancelled):
-    sys.exit(0)
+if __name__ == '__main__':
+    # Worker processes re-import this module on Windows and macOS, and the
+    # frozen executable needs this to start them at all.
+    multiprocessing.freeze_support()
 
-test_identifier = user_input.test_identifier
-multi_page_image_file = user_input.multi_page_image_file
-output_folder = user_input.output_folder
-sort_results = user_input.sort_results
-debug_mode_on = user_input.debug_mode
-form_variant = grid_i.form_75q
-files_timestamp = datetime.now().replace(microsecond=0)
+    user_input = user_interface.MainWindow()
+    if (user_input.cancelled):
+        sys.exit(0)
 
-images, images_name, images_type = image_utils.get_images([multi_page_image_file])
-progress_tracker = user_input.create_and_pack_progress(maximum=len(images))
+    test_identifier = user_input.test_identifier
+    input_files = user_input.input_files
+    output_folder = user_input.output_folder
+    sort_results = user_input.sort_results
+    debug_mode_on = user_input.debug_mode
+    form_variant = grid_i.form_75q
+    files_timestamp = datetime.now().replace(microsecond=0)
 
-process_input(test_identifier,
-              images,
-              images_name,
-              images_type,
-              output_folder,
-              sort_results,
-              debug_mode_on,
-              form_variant,
-              progress_tracker,
-              files_timestamp)
+    # Counting the pages of a large PDF takes a while, so the window is shown
+    # first and the count is filled in by the background thread.
+    progress_tracker = user_input.create_and_pack_progress(maximum=0)
+
+    def process_in_background():
+        progress_tracker.set_maximum(
+            image_utils.count_pages(input_files))
+        process_input(test_identifier,
+                      input_files,
+                      output_folder,
+                      sort_results,
+                      debug_mode_on,
+                      form_variant,
+                      progress_tracker,
+                      files_timestamp,
+                      workers=user_input.workers,
+                      decode_options=image_utils.DecodeOptions(
+                          pdf_dpi=user_input.pdf_dpi,
+                          pdf_threads=user_input.pdf_threads,
+                          use_pdftocairo=user_input.use_pdftocairo),
+                      cache=result_cache.ResultCache(
+                          result_cache.get_default_cache_dir())
+                      if user_input.use_cache else None,
+                      cancel_event=progress_tracker.cancel_event)
+
+    progress_tracker.run_in_background(process_in_background)
+    progress_tracker.show_exit_button_and_wait()
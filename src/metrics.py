@@ -0,0 +1,224 @@
+"""Lightweight instrumentation of where processing time goes.
+
+Code marks its stages with `stage` and counts events with `count`. Both do
+nothing until `enable` is called, so the instrumentation can stay in place at
+negligible cost. Once enabled, stages and counters are collected into a
+`Record`, which is taken for every page with `take_record` and finally
+written out as JSON Lines with `write_metrics`.
+
+Stages can be nested, in which case the time of the inner stage is also
+counted in the outer one. CPU time is the time of the whole process, so it
+includes any threads the libraries run on.
+
+Every thread collects into a record of its own, so a thread working ahead on
+other pages (like the decoder thread of `process_input`) doesn't mix its
+stages into the current page. Such a thread takes its record along with its
+work and the consuming thread adds it to its own with `merge`.
+"""
+
+import json
+import pathlib
+import threading
+import time
+import typing as tp
+
+"""Percentiles reported for every stage and counter in the batch summary."""
+SUMMARY_PERCENTILES = [50, 95]
+
+
+class Record():
+    """The stage timings and counters collected for one page or batch.
+
+    Members:
+        stages: Maps each stage name to its total wall and CPU time in seconds.
+        counters: Maps each counter name to its total.
+    """
+    stages: tp.Dict[str, tp.List[float]]
+    counters: tp.Dict[str, int]
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def add_time(self, name: str, wall: float, cpu: float):
+        times = self.stages.setdefault(name, [0.0, 0.0])
+        times[0] += wall
+        times[1] += cpu
+
+    def add(self, other: "Record"):
+        """Add the stage timings and counters of another record to this one."""
+        for name, (wall, cpu) in other.stages.items():
+            self.add_time(name, wall, cpu)
+        for name, amount in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        return {
+            "stages": {
+                name: {
+                    "wall_ms": _to_ms(wall),
+                    "cpu_ms": _to_ms(cpu)
+                }
+                for name, (wall, cpu) in self.stages.items()
+            },
+            "counters": dict(self.counters)
+        }
+
+
+_enabled = False
+# Holds the record every thread is currently collecting into.
+_local = threading.local()
+
+
+def _get_record() -> Record:
+    record = getattr(_local, "record", None)
+    if record is None:
+        record = _local.record = Record()
+    return record
+
+
+class _Stage():
+    name: str
+    wall_start: float
+    cpu_start: float
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def __exit__(self, *exc_info):
+        if _enabled:
+            _get_record().add_time(self.name,
+                                   time.perf_counter() - self.wall_start,
+                                   time.process_time() - self.cpu_start)
+
+
+class _DisabledStage():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+def enable():
+    """Start collecting metrics in this process."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop collecting metrics and discard anything not taken yet."""
+    global _enabled, _local
+    _enabled = False
+    _local = threading.local()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def stage(name: str) -> tp.ContextManager[None]:
+    """Time the code run in this context as the named stage."""
+    if not _enabled:
+        return _DISABLED_STAGE
+    return _Stage(name)
+
+
+def count(name: str, amount: int = 1):
+    """Add to the named counter."""
+    if _enabled:
+        record = _get_record()
+        record.counters[name] = record.counters.get(name, 0) + amount
+
+
+def take_record() -> tp.Optional[Record]:
+    """Get everything this thread collected since the last call and start a
+    new record. Returns `None` if metrics are disabled."""
+    if not _enabled:
+        return None
+    record = _get_record()
+    _local.record = Record()
+    return record
+
+
+def merge(record: tp.Optional[Record]):
+    """Add a record taken in another thread to this thread's record."""
+    if _enabled and record is not None:
+        _get_record().add(record)
+
+
+def _to_ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def _percentile(sorted_values: tp.List[float], percentile: float) -> float:
+    """Nearest-rank percentile of a sorted, non-empty list."""
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _summarize_values(values: tp.List[float]) -> tp.Dict[str, float]:
+    values = sorted(values)
+    summary = {
+        f"p{percentile}": _percentile(values, percentile)
+        for percentile in SUMMARY_PERCENTILES
+    }
+    summary["max"] = values[-1]
+    summary["total"] = round(sum(values), 3)
+    return summary
+
+
+def summarize(records: tp.List[Record]) -> tp.Dict[str, tp.Any]:
+    """Aggregate per-page records into percentiles, maximum and total of every
+    stage and counter. Pages that skipped a stage don't count towards its
+    percentiles."""
+    stage_names = sorted({name for record in records for name in record.stages})
+    counter_names = sorted(
+        {name for record in records for name in record.counters})
+    return {
+        "stages": {
+            name: {
+                "pages": sum(1 for record in records if name in record.stages),
+                "wall_ms": _summarize_values([
+                    _to_ms(record.stages[name][0]) for record in records
+                    if name in record.stages
+                ]),
+                "cpu_ms": _summarize_values([
+                    _to_ms(record.stages[name][1]) for record in records
+                    if name in record.stages
+                ])
+            }
+            for name in stage_names
+        },
+        "counters": {
+            name: _summarize_values(
+                [record.counters.get(name, 0) for record in records])
+            for name in counter_names
+        }
+    }
+
+
+def write_metrics(path: pathlib.PurePath,
+                  pages: tp.List[tp.Tuple[str, Record]],
+                  batch: Record, wall_time: float):
+    """Write a JSON Lines file with a record for every page, followed by a
+    summary of the batch: aggregates of the page records, the batch-level
+    stages (such as saving the output) and the total wall time."""
+    with open(str(path), "w") as file:
+        for name, record in pages:
+            file.write(json.dumps({"type": "page", "page": name,
+                                   **record.to_dict()}) + "\n")
+        file.write(json.dumps({
+            "type": "batch",
+            "pages": len(pages),
+            "wall_ms": _to_ms(wall_time),
+            "page_summary": summarize([record for _, record in pages]),
+            **batch.to_dict()
+        }) + "\n")
@@ -0,0 +1,181 @@
+"""Merging the pages of several PDFs into one, using the reader in
+`pdf_parsing`.
+
+Pages are copied together with everything they reference (content streams,
+fonts, images), renumbered so the objects of different files can't collide.
+Every object is written out as soon as it is reached, and streams aren't kept
+after that, so even large files are merged without holding them in memory.
+"""
+
+import pathlib
+import re
+import typing as tp
+
+from pdf_parsing import Keyword, Name, PdfDocument, Ref, Stream
+
+_CATALOG_NUM = 1
+_PAGES_NUM = 2
+_FIRST_FREE_NUM = 3
+
+# Characters that can't appear in a name unescaped.
+_NAME_ESCAPE_RE = re.compile(rb"[^!-~]|[#()<>\[\]{}/%]")
+
+
+def _serialize_number(value: float) -> bytes:
+    if value == int(value):
+        return str(int(value)).encode()
+    return f"{value:.6f}".rstrip("0").rstrip(".").encode()
+
+
+def _serialize(value: tp.Any, map_ref: tp.Callable[[Ref], Ref]) -> bytes:
+    """Write a parsed object back out as PDF syntax, replacing every reference
+    with the one `map_ref` gives for it."""
+    if value is None:
+        return b"null"
+    if isinstance(value, bool):
+        return b"true" if value else b"false"
+    if isinstance(value, int):
+        return str(value).encode()
+    if isinstance(value, float):
+        return _serialize_number(value)
+    if isinstance(value, Name):
+        return b"/" + _NAME_ESCAPE_RE.sub(
+            lambda m: b"#%02X" % m.group()[0], value.encode("latin-1"))
+    if isinstance(value, Keyword):
+        return value.encode("latin-1")
+    if isinstance(value, bytes):
+        return b"<" + value.hex().encode() + b">"
+    if isinstance(value, Ref):
+        ref = map_ref(value)
+        return b"%d %d R" % (ref.num, ref.gen)
+    if isinstance(value, list):
+        return b"[" + b" ".join(_serialize(item, map_ref)
+                                for item in value) + b"]"
+    if isinstance(value, dict):
+        return b"<<" + b"".join(
+            _serialize(Name(key), map_ref) + b" " + _serialize(item, map_ref)
+            for key, item in value.items()) + b">>"
+    raise ValueError(f"Can't write {type(value).__name__} to a PDF.")
+
+
+class PdfMerger():
+    """Writes the pages of PDF documents, in the order they are added, to a
+    new PDF file. `close` must be called to finish the file.
+
+    Used as a context manager, the file is finished if the block succeeds, and
+    deleted if it raises, so no partial file is left behind.
+    """
+    path: pathlib.PurePath
+    _file: tp.BinaryIO
+    _offsets: tp.Dict[int, int]
+    _page_nums: tp.List[int]
+    _next_num: int
+
+    def __init__(self, path: pathlib.PurePath):
+        self.path = path
+        self._file = open(str(path), "wb")
+        self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._offsets = {}
+        self._page_nums = []
+        self._next_num = _FIRST_FREE_NUM
+
+    def __enter__(self) -> "PdfMerger":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _allocate(self) -> int:
+        num = self._next_num
+        self._next_num += 1
+        return num
+
+    def _write_object(self, num: int, value: tp.Any,
+                      map_ref: tp.Callable[[Ref], Ref]):
+        self._offsets[num] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % num)
+        if isinstance(value, Stream):
+            stream_dict = dict(value.dict)
+            stream_dict["Length"] = len(value.raw)
+            self._file.write(_serialize(stream_dict, map_ref))
+            self._file.write(b"\nstream\n" + value.raw + b"\nendstream")
+        else:
+            self._file.write(_serialize(value, map_ref))
+        self._file.write(b"\nendobj\n")
+
+    def add_document(self, document: PdfDocument):
+        """Append all pages of the document."""
+        # Maps the object numbers of the document to those in the new file.
+        new_nums: tp.Dict[int, int] = {}
+        pending: tp.List[tp.Tuple[int, tp.Any]] = []
+
+        def map_ref(ref: Ref) -> Ref:
+            if ref.num not in new_nums:
+                value = document.get_object(ref.num)
+                if isinstance(value, dict) and value.get("Type") == "Pages":
+                    # The old page tree is replaced by the new one.
+                    new_nums[ref.num] = _PAGES_NUM
+                else:
+                    new_nums[ref.num] = self._allocate()
+                    pending.append((new_nums[ref.num], value))
+            return Ref(new_nums[ref.num], 0)
+
+        for page in document.pages:
+            # Inherited attributes were already copied into every page.
+            page = {key: value for key, value in page.items() if key != "Parent"}
+            page["Parent"] = Ref(_PAGES_NUM, 0)
+            page_num = self._allocate()
+            self._page_nums.append(page_num)
+            self._write_object(page_num, page, map_ref)
+            while pending:
+                self._write_object(*pending.pop(), map_ref)
+
+    def add_file(self, path: pathlib.PurePath):
+        with PdfDocument.from_file(path) as document:
+            self.add_document(document)
+
+    def close(self):
+        """Write the page tree and cross-reference table and close the file."""
+        if self._file.closed:
+            return
+        no_refs: tp.Callable[[Ref], Ref] = lambda ref: ref
+        self._write_object(
+            _PAGES_NUM, {
+                "Type": Name("Pages"),
+                "Kids": [Ref(num, 0) for num in self._page_nums],
+                "Count": len(self._page_nums)
+            }, no_refs)
+        self._write_object(_CATALOG_NUM, {
+            "Type": Name("Catalog"),
+            "Pages": Ref(_PAGES_NUM, 0)
+        }, no_refs)
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n" % self._next_num)
+        self._file.write(b"0000000000 65535 f \n")
+        for num in range(1, self._next_num):
+            self._file.write(b"%010d 00000 n \n" % self._offsets[num])
+        self._file.write(b"trailer\n" + _serialize(
+            {
+                "Size": self._next_num,
+                "Root": Ref(_CATALOG_NUM, 0)
+            }, no_refs))
+        self._file.write(b"\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
+        self._file.close()
+
+    def abort(self):
+        """Close the file without finishing it, and delete it."""
+        if self._file.closed:
+            return
+        self._file.close()
+        pathlib.Path(self.path).unlink(missing_ok=True)
+
+
+def merge_pdfs(paths: tp.Iterable[pathlib.PurePath],
+               output_path: pathlib.PurePath):
+    """Merge the pages of the PDF files, in order, into one file."""
+    with PdfMerger(output_path) as merger:
+        for path in paths:
+            merger.add_file(path)
@@ -0,0 +1,893 @@
+"""A minimal PDF reader, used to take scanned images straight out of PDFs.
+
+Scanners usually produce PDFs where every page is nothing but one embedded
+image. Decoding that image directly is much faster than rasterizing the page,
+and it gives the scan at its native resolution instead of a resampled copy.
+Only the small part of the PDF format needed for this is implemented. Pages
+that are anything other than a single image, or that use features that aren't
+supported here, are reported as such so the caller can rasterize them instead.
+"""
+
+import base64
+import mmap
+import pathlib
+import re
+import struct
+import typing as tp
+import zlib
+
+import cv2
+import numpy as np
+
+
+class PdfParseError(ValueError):
+    pass
+
+
+class Name(str):
+    """A PDF name object, such as `/Type`, stored without the slash."""
+
+
+class Keyword(str):
+    """A bare keyword, such as `obj`, or an operator in a content stream."""
+
+
+class Ref():
+    """A reference to an indirect object (`12 0 R`)."""
+    num: int
+    gen: int
+
+    def __init__(self, num: int, gen: int):
+        self.num = num
+        self.gen = gen
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Ref) and (self.num, self.gen) == (other.num,
+                                                                   other.gen)
+
+    def __hash__(self) -> int:
+        return hash((self.num, self.gen))
+
+    def __repr__(self) -> str:
+        return f"Ref({self.num}, {self.gen})"
+
+
+class Stream():
+    """A stream object: a dictionary and the raw (still encoded) data."""
+    dict: tp.Dict[str, tp.Any]
+    raw: bytes
+
+    def __init__(self, stream_dict: tp.Dict[str, tp.Any], raw: bytes):
+        self.dict = stream_dict
+        self.raw = raw
+
+
+"""The contents of a PDF: either bytes, or a file mapped into memory. Mapped
+files have no `startswith`, so prefixes are compared as slices instead."""
+_Buffer = tp.Union[bytes, mmap.mmap]
+
+_WHITESPACE = b"\x00\t\n\x0c\r "
+_REGULAR_RE = re.compile(rb"[^\x00\t\n\x0c\r ()<>\[\]{}/%]+")
+_NUMBER_RE = re.compile(rb"[+-]?(\d+\.?\d*|\.\d+)$")
+_INTEGER_RE = re.compile(rb"[+-]?\d+$")
+_OBJECT_HEADER_RE = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_STRING_ESCAPES = {
+    ord("n"): b"\n",
+    ord("r"): b"\r",
+    ord("t"): b"\t",
+    ord("b"): b"\b",
+    ord("f"): b"\f"
+}
+
+
+class _Lexer():
+    """Reads PDF objects out of a buffer, starting at any position."""
+    data: _Buffer
+    pos: int
+
+    def __init__(self, data: _Buffer, pos: int = 0):
+        self.data = data
+        self.pos = pos
+
+    def skip_whitespace(self):
+        data = self.data
+        while self.pos < len(data):
+            char = data[self.pos]
+            if char in _WHITESPACE:
+                self.pos += 1
+            elif char == ord("%"):
+                while self.pos < len(data) and data[self.pos] not in b"\r\n":
+                    self.pos += 1
+            else:
+                break
+
+    def at_end(self) -> bool:
+        self.skip_whitespace()
+        return self.pos >= len(self.data)
+
+    def read_object(self) -> tp.Any:
+        """Read the next object. Integers followed by a generation number and
+        `R` are read as a single `Ref`."""
+        value = self._read_simple()
+        if isinstance(value, int) and not isinstance(value, bool):
+            saved = self.pos
+            generation = self._try_read_token()
+            if generation is not None and _INTEGER_RE.match(generation):
+                if self._try_read_token() == b"R":
+                    return Ref(value, int(generation))
+            self.pos = saved
+        return value
+
+    def _try_read_token(self) -> tp.Optional[bytes]:
+        self.skip_whitespace()
+        match = _REGULAR_RE.match(self.data, self.pos)
+        if match is None:
+            return None
+        self.pos = match.end()
+        return match.group()
+
+    def _read_simple(self) -> tp.Any:
+        self.skip_whitespace()
+        data = self.data
+        if self.pos >= len(data):
+            raise PdfParseError("Unexpected end of data.")
+        char = data[self.pos]
+        if data[self.pos:self.pos + 2] == b"<<":
+            self.pos += 2
+            return self._read_dict()
+        if char == ord("["):
+            self.pos += 1
+            return self._read_array()
+        if char == ord("/"):
+            return self._read_name()
+        if char == ord("("):
+            return self._read_literal_string()
+        if char == ord("<"):
+            return self._read_hex_string()
+        if char in b">]":
+            # Returned so that dictionary and array readers can see it
+            self.pos += 2 if data[self.pos:self.pos + 2] == b">>" else 1
+            return Keyword(">>" if char == ord(">") else "]")
+        match = _REGULAR_RE.match(data, self.pos)
+        if match is None:
+            raise PdfParseError(f"Unexpected character at {self.pos}.")
+        self.pos = match.end()
+        token = match.group()
+        if _INTEGER_RE.match(token):
+            return int(token)
+        if _NUMBER_RE.match(token):
+            return float(token)
+        if token == b"true":
+            return True
+        if token == b"false":
+            return False
+        if token == b"null":
+            return None
+        return Keyword(token.decode("latin-1"))
+
+    def _read_dict(self) -> tp.Dict[str, tp.Any]:
+        result: tp.Dict[str, tp.Any] = {}
+        while True:
+            key = self.read_object()
+            if key == Keyword(">>"):
+                return result
+            if not isinstance(key, Name):
+                raise PdfParseError("Dictionary key is not a name.")
+            value = self.read_object()
+            if isinstance(value, Keyword) and value in (">>", "]"):
+                raise PdfParseError("Dictionary is missing a value.")
+            result[key] = value
+
+    def _read_array(self) -> tp.List[tp.Any]:
+        result = []
+        while True:
+            value = self.read_object()
+            if value == Keyword("]"):
+                return result
+            result.append(value)
+
+    def _read_name(self) -> Name:
+        match = _REGULAR_RE.match(self.data, self.pos + 1)
+        self.pos = match.end() if match else self.pos + 1
+        raw = match.group() if match else b""
+        return Name(re.sub(rb"#([0-9A-Fa-f]{2})",
+                           lambda m: bytes([int(m.group(1), 16)]),
+                           raw).decode("latin-1"))
+
+    def _read_literal_string(self) -> bytes:
+        data = self.data
+        pos = self.pos + 1
+        depth = 1
+        result = bytearray()
+        while pos < len(data):
+            char = data[pos]
+            if char == ord("\\"):
+                pos += 1
+                escaped = data[pos] if pos < len(data) else 0
+                if escaped in _STRING_ESCAPES:
+                    result += _STRING_ESCAPES[escaped]
+                elif ord("0") <= escaped <= ord("7"):
+                    octal = re.match(rb"[0-7]{1,3}", data[pos:pos + 3]).group()
+                    result.append(int(octal, 8) & 0xFF)
+                    pos += len(octal) - 1
+                elif escaped == ord("\r"):
+                    if data[pos + 1:pos + 2] == b"\n":
+                        pos += 1
+                elif escaped != ord("\n"):
+                    result.append(escaped)
+            elif char == ord("("):
+                depth += 1
+                result.append(char)
+            elif char == ord(")"):
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos + 1
+                    return bytes(result)
+                result.append(char)
+            else:
+                result.append(char)
+            pos += 1
+        raise PdfParseError("Unterminated string.")
+
+    def _read_hex_string(self) -> bytes:
+        end = self.data.find(b">", self.pos)
+        if end < 0:
+            raise PdfParseError("Unterminated hex string.")
+        digits = re.sub(rb"[^0-9A-Fa-f]", b"", self.data[self.pos + 1:end])
+        self.pos = end + 1
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii"))
+
+
+def _as_list(value: tp.Any) -> tp.List[tp.Any]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _apply_png_predictor(data: bytes, columns: int, colors: int,
+                         bits_per_component: int) -> bytes:
+    """Undo the PNG row filters used by predictors 10-15. Only used on small
+    streams such as cross-reference streams."""
+    bytes_per_pixel = max(1, colors * bits_per_component // 8)
+    row_length = (columns * colors * bits_per_component + 7) // 8
+    previous = bytearray(row_length)
+    result = bytearray()
+    for start in range(0, len(data) - row_length, row_length + 1):
+        filter_type = data[start]
+        row = bytearray(data[start + 1:start + 1 + row_length])
+        for i in range(len(row)):
+            left = row[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+            up = previous[i]
+            up_left = previous[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+            if filter_type == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif filter_type == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif filter_type == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif filter_type == 4:
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up),
+                             abs(estimate - up_left))
+                if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                    row[i] = (row[i] + left) & 0xFF
+                elif distances[1] <= distances[2]:
+                    row[i] = (row[i] + up) & 0xFF
+                else:
+                    row[i] = (row[i] + up_left) & 0xFF
+            elif filter_type != 0:
+                raise PdfParseError("Unknown PNG predictor.")
+        result += row
+        previous = row
+    return bytes(result)
+
+
+def _decode_filter(data: bytes, filter_name: str,
+                   params: tp.Optional[tp.Dict[str, tp.Any]]) -> bytes:
+    """Apply one of the general purpose (non-image) stream filters."""
+    params = params or {}
+    if filter_name in ("FlateDecode", "Fl"):
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # Some writers truncate or pad the stream; take what decodes.
+            data = zlib.decompressobj().decompress(data)
+        predictor = params.get("Predictor", 1)
+        if predictor >= 10:
+            data = _apply_png_predictor(data, params.get("Columns", 1),
+                                        params.get("Colors", 1),
+                                        params.get("BitsPerComponent", 8))
+        elif predictor != 1:
+            raise PdfParseError(f"Unsupported predictor {predictor}.")
+        return data
+    if filter_name in ("ASCIIHexDecode", "AHx"):
+        digits = re.sub(rb"[^0-9A-Fa-f]", b"", data.split(b">")[0])
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii"))
+    if filter_name in ("ASCII85Decode", "A85"):
+        encoded = re.sub(rb"\s", b"", data)
+        if encoded.startswith(b"<~"):
+            encoded = encoded[2:]
+        return base64.a85decode(encoded.split(b"~>")[0])
+    raise PdfParseError(f"Unsupported filter {filter_name}.")
+
+
+"""Content stream operators that only change the graphics or text state without
+painting anything, so they may appear on a page that is only an image."""
+_STATE_OPERATORS = {
+    "BT", "ET", "Tc", "Tw", "Tz", "TL", "Tf", "Tr", "Ts", "Td", "TD", "Tm",
+    "T*", "w", "J", "j", "M", "d", "ri", "i", "gs", "g", "G", "rg", "RG", "k",
+    "K", "cs", "CS", "sc", "SC", "scn", "SCN"
+}
+
+_IMAGE_FILTERS = {
+    "DCTDecode", "DCT", "JPXDecode", "CCITTFaxDecode", "CCF", "JBIG2Decode"
+}
+
+
+def _map_file(path: pathlib.PurePath) -> _Buffer:
+    with open(str(path), "rb") as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            return b""
+
+
+class PdfDocument():
+    """A parsed PDF file. Objects are only read when they are needed.
+
+    Streams, which hold nearly all of a file's data, such as its images, are
+    not kept once read, so memory use doesn't grow with the size of the file.
+    Everything else is kept, since it is small and read over and over.
+
+    Members:
+        path: The file the document was read from, or `None` if it was parsed
+            from bytes.
+    """
+    path: tp.Optional[pathlib.PurePath]
+    trailer: tp.Dict[str, tp.Any]
+    pages: tp.List[tp.Dict[str, tp.Any]]
+    _data: tp.Optional[_Buffer]
+
+    def __init__(self, data: _Buffer,
+                 path: tp.Optional[pathlib.PurePath] = None):
+        """Parse the document structure. Raises PdfParseError if the file
+        can't be understood. If `data` is mapped from the file at `path`, it
+        can be closed and is mapped again when it's needed."""
+        self._data = data
+        self.path = path
+        # Object number to either a byte offset or `(stream number, index)`
+        # for objects stored in object streams.
+        self._locations: tp.Dict[int, tp.Union[int, tp.Tuple[int, int]]] = {}
+        self._objects: tp.Dict[int, tp.Any] = {}
+        self._object_streams: tp.Dict[int, tp.Dict[int, tp.Any]] = {}
+        try:
+            self.trailer = self._read_xref_chain()
+        except (PdfParseError, IndexError, ValueError, zlib.error):
+            self._locations = {}
+            self.trailer = self._scan_objects()
+        self.pages = self._collect_pages()
+
+    @classmethod
+    def from_file(cls, path: pathlib.PurePath) -> "PdfDocument":
+        """Open a PDF file. The file is mapped into memory instead of read, so
+        only the parts that are used are loaded, and the operating system can
+        drop them again."""
+        data = _map_file(path)
+        try:
+            return cls(data, path)
+        except BaseException:
+            if isinstance(data, mmap.mmap):
+                data.close()
+            raise
+
+    @property
+    def data(self) -> _Buffer:
+        if self._data is None:
+            if self.path is None:
+                raise PdfParseError("The document is closed.")
+            self._data = _map_file(self.path)
+        return self._data
+
+    def close(self):
+        """Unmap the file, so it can be moved or deleted even on Windows. It is
+        mapped again if the document is used after this."""
+        if isinstance(self._data, mmap.mmap) and self.path is not None:
+            self._data.close()
+            self._data = None
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def resolve(self, value: tp.Any) -> tp.Any:
+        """Follow references until a direct object is reached."""
+        seen = 0
+        while isinstance(value, Ref):
+            value = self.get_object(value.num)
+            seen += 1
+            if seen > 32:
+                raise PdfParseError("Reference loop.")
+        return value
+
+    def get_object(self, num: int) -> tp.Any:
+        if num in self._objects:
+            return self._objects[num]
+        location = self._locations.get(num)
+        if location is None:
+            value = None
+        elif isinstance(location, tuple):
+            value = self._read_compressed_object(*location, num)
+        else:
+            value = self._read_object_at(location)[1]
+        if not isinstance(value, Stream):
+            self._objects[num] = value
+        return value
+
+    def decode_stream(self, stream: Stream,
+                      keep_last_image_filter: bool = False) -> bytes:
+        """Decode a stream's data. If `keep_last_image_filter` is set and the
+        last filter is an image codec, that one is left for the caller."""
+        filters = [self.resolve(f) for f in _as_list(self.resolve(stream.dict.get("Filter")))]
+        params = [self.resolve(p) for p in _as_list(self.resolve(stream.dict.get("DecodeParms")))]
+        params += [None] * (len(filters) - len(params))
+        if keep_last_image_filter and filters and filters[-1] in _IMAGE_FILTERS:
+            filters = filters[:-1]
+        data = stream.raw
+        for filter_name, filter_params in zip(filters, params):
+            data = _decode_filter(data, filter_name, filter_params)
+        return data
+
+    def _read_object_at(self, offset: int) -> tp.Tuple[int, tp.Any]:
+        """Read the `n g obj ... endobj` object at the given byte offset."""
+        lexer = _Lexer(self.data, offset)
+        num = lexer.read_object()
+        generation = lexer.read_object()
+        if (not isinstance(num, int) or not isinstance(generation, int)
+                or lexer.read_object() != Keyword("obj")):
+            raise PdfParseError(f"No object at offset {offset}.")
+        value = lexer.read_object()
+        if isinstance(value, dict):
+            after_dict = lexer.pos
+            if lexer._try_read_token() == b"stream":
+                value = Stream(value, self._read_stream_data(value, lexer.pos))
+            else:
+                lexer.pos = after_dict
+        return num, value
+
+    def _read_stream_data(self, stream_dict: tp.Dict[str, tp.Any],
+                          pos: int) -> bytes:
+        data = self.data
+        if data[pos:pos + 2] == b"\r\n":
+            pos += 2
+        elif data[pos:pos + 1] in (b"\n", b"\r"):
+            pos += 1
+        try:
+            length = self.resolve(stream_dict.get("Length"))
+        except PdfParseError:
+            length = None
+        if isinstance(length, int) and length >= 0:
+            after = _Lexer(data, pos + length)
+            if after._try_read_token() == b"endstream":
+                return data[pos:pos + length]
+        # The length is missing or wrong, so look for the end marker instead.
+        end = data.find(b"endstream", pos)
+        if end < 0:
+            raise PdfParseError("Unterminated stream.")
+        if data[end - 2:end] == b"\r\n":
+            end -= 2
+        elif data[end - 1:end] in (b"\n", b"\r"):
+            end -= 1
+        return data[pos:end]
+
+    def _read_compressed_object(self, stream_num: int, index: int,
+                                num: int) -> tp.Any:
+        if stream_num not in self._object_streams:
+            self._object_streams[stream_num] = self._read_object_stream(stream_num)
+        return self._object_streams[stream_num].get(num)
+
+    def _read_object_stream(self, stream_num: int) -> tp.Dict[int, tp.Any]:
+        stream = self.get_object(stream_num)
+        if not isinstance(stream, Stream):
+            raise PdfParseError("Object stream is missing.")
+        data = self.decode_stream(stream)
+        count = self.resolve(stream.dict["N"])
+        first = self.resolve(stream.dict["First"])
+        header = _Lexer(data[:first])
+        entries = [(header.read_object(), header.read_object())
+                   for _ in range(count)]
+        objects = {}
+        for obj_num, offset in entries:
+            objects[obj_num] = _Lexer(data, first + offset).read_object()
+        return objects
+
+    def _read_xref_chain(self) -> tp.Dict[str, tp.Any]:
+        """Read the cross-reference sections, newest first, and return the
+        newest trailer."""
+        startxref = self.data.rfind(b"startxref")
+        if startxref < 0:
+            raise PdfParseError("No startxref.")
+        offset = _Lexer(self.data, startxref + len(b"startxref")).read_object()
+        newest_trailer: tp.Optional[tp.Dict[str, tp.Any]] = None
+        visited = set()
+        while isinstance(offset, int) and offset not in visited:
+            visited.add(offset)
+            if _Lexer(self.data, offset)._try_read_token() == b"xref":
+                trailer = self._read_xref_table(offset)
+                if isinstance(trailer.get("XRefStm"), int):
+                    self._read_xref_stream(trailer["XRefStm"])
+            else:
+                trailer = self._read_xref_stream(offset)
+            if newest_trailer is None:
+                newest_trailer = trailer
+            offset = trailer.get("Prev")
+        if newest_trailer is None or "Root" not in newest_trailer:
+            raise PdfParseError("No document root.")
+        return newest_trailer
+
+    def _add_location(self, num: int,
+                      location: tp.Union[int, tp.Tuple[int, int]]):
+        # Sections are read newest first, so older entries never override.
+        self._locations.setdefault(num, location)
+
+    def _read_xref_table(self, offset: int) -> tp.Dict[str, tp.Any]:
+        lexer = _Lexer(self.data, offset)
+        lexer._try_read_token()
+        while True:
+            token = lexer._try_read_token()
+            if token == b"trailer":
+                trailer = lexer.read_object()
+                if not isinstance(trailer, dict):
+                    raise PdfParseError("Bad trailer.")
+                return trailer
+            if token is None or not _INTEGER_RE.match(token):
+                raise PdfParseError("Bad cross-reference table.")
+            first = int(token)
+            count = int(lexer._try_read_token() or b"")
+            for num in range(first, first + count):
+                entry_offset = int(lexer._try_read_token() or b"")
+                lexer._try_read_token()
+                kind = lexer._try_read_token()
+                if kind == b"n":
+                    self._add_location(num, entry_offset)
+                elif kind == b"f":
+                    self._locations.setdefault(num, None)  # type: ignore
+                else:
+                    raise PdfParseError("Bad cross-reference entry.")
+
+    def _read_xref_stream(self, offset: int) -> tp.Dict[str, tp.Any]:
+        _, stream = self._read_object_at(offset)
+        if not isinstance(stream, Stream) or stream.dict.get("Type") != "XRef":
+            raise PdfParseError("Bad cross-reference stream.")
+        widths = stream.dict["W"]
+        index = stream.dict.get("Index", [0, stream.dict["Size"]])
+        data = self.decode_stream(stream)
+        entry_size = sum(widths)
+        pos = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for num in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], "big"))
+                    pos += width
+                kind = fields[0] if widths[0] else 1
+                if kind == 1:
+                    self._add_location(num, fields[1])
+                elif kind == 2:
+                    self._add_location(num, (fields[1], fields[2]))
+                else:
+                    self._locations.setdefault(num, None)  # type: ignore
+        if pos > len(data) + entry_size:
+            raise PdfParseError("Cross-reference stream is too short.")
+        return stream.dict
+
+    def _scan_objects(self) -> tp.Dict[str, tp.Any]:
+        """Find objects by scanning the whole file, for files with a missing or
+        broken cross-reference table. Later definitions win, as they would in
+        an incrementally updated file."""
+        trailer: tp.Dict[str, tp.Any] = {}
+        pos = 0
+        while True:
+            match = _OBJECT_HEADER_RE.search(self.data, pos)
+            if match is None:
+                break
+            try:
+                num, value = self._read_object_at(match.start())
+            except PdfParseError:
+                pos = match.end()
+                continue
+            self._locations[num] = match.start()
+            self._objects.pop(num, None)
+            if isinstance(value, Stream):
+                if value.dict.get("Type") == "XRef" and "Root" in value.dict:
+                    trailer = value.dict
+                elif value.dict.get("Type") == "ObjStm":
+                    try:
+                        for obj_num in self._read_object_stream(num):
+                            self._locations.setdefault(obj_num, (num, 0))
+                    except (PdfParseError, KeyError, zlib.error):
+                        pass
+            end = self.data.find(b"endobj", match.end())
+            pos = end if end >= 0 else match.end()
+        for match in re.finditer(rb"trailer\s*<<", self.data):
+            try:
+                candidate = _Lexer(self.data, match.end() - 2).read_object()
+            except PdfParseError:
+                continue
+            if isinstance(candidate, dict) and "Root" in candidate:
+                trailer = candidate
+        if "Root" not in trailer:
+            raise PdfParseError("No document root.")
+        return trailer
+
+    def _collect_pages(self) -> tp.List[tp.Dict[str, tp.Any]]:
+        """Walk the page tree, copying inherited attributes into every page."""
+        root = self.resolve(self.trailer.get("Root"))
+        if not isinstance(root, dict):
+            raise PdfParseError("No document catalog.")
+        pages: tp.List[tp.Dict[str, tp.Any]] = []
+        visited: tp.Set[int] = set()
+
+        def walk(node_ref: tp.Any, inherited: tp.Dict[str, tp.Any]):
+            if isinstance(node_ref, Ref):
+                if node_ref.num in visited:
+                    raise PdfParseError("Page tree loop.")
+                visited.add(node_ref.num)
+            node = self.resolve(node_ref)
+            if not isinstance(node, dict):
+                raise PdfParseError("Bad page tree node.")
+            attributes = dict(inherited)
+            for key in ("Resources", "MediaBox", "CropBox", "Rotate"):
+                if key in node:
+                    attributes[key] = node[key]
+            if node.get("Type") == "Pages" or "Kids" in node:
+                for kid in self.resolve(node.get("Kids", [])):
+                    walk(kid, attributes)
+            else:
+                pages.append({**attributes, **node})
+
+        walk(root.get("Pages"), {})
+        return pages
+
+    def get_page_contents(self, page: tp.Dict[str, tp.Any]) -> bytes:
+        """Decoded content streams of a page, joined together."""
+        parts = []
+        for part in _as_list(self.resolve(page.get("Contents"))):
+            stream = self.resolve(part)
+            if not isinstance(stream, Stream):
+                raise PdfParseError("Page contents are not a stream.")
+            parts.append(self.decode_stream(stream))
+        return b"\n".join(parts)
+
+    def extract_page_image(self, index: int,
+                           grayscale: bool = True) -> tp.Optional[np.ndarray]:
+        """If the page consists of exactly one embedded image, decode it at its
+        native resolution, oriented as the page is displayed. Returns a
+        single-channel image if `grayscale` is set, otherwise a BGR image.
+
+        Returns `None` for any other page, or if the image uses a format that
+        isn't supported, so that the page can be rasterized instead.
+        """
+        page = self.pages[index]
+        try:
+            placement = self._find_page_image(page)
+            if placement is None:
+                return None
+            image_stream, matrix = placement
+            image = _decode_image(self, image_stream, grayscale)
+            if image is None:
+                return None
+            rotate = self.resolve(page.get("Rotate", 0)) or 0
+            return _orient_image(image, matrix, int(rotate))
+        except (PdfParseError, KeyError, TypeError, ValueError, IndexError,
+                zlib.error, cv2.error):
+            return None
+
+    def _find_page_image(
+            self, page: tp.Dict[str, tp.Any]
+    ) -> tp.Optional[tp.Tuple[Stream, tp.List[float]]]:
+        """Find the single image painted on the page and the transformation
+        matrix it is painted with, if the page contains nothing else."""
+        lexer = _Lexer(self.get_page_contents(page))
+        matrix = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+        saved_matrices = []
+        operands: tp.List[tp.Any] = []
+        painted: tp.Optional[tp.Tuple[str, tp.List[float]]] = None
+        while not lexer.at_end():
+            token = lexer.read_object()
+            if not isinstance(token, Keyword):
+                operands.append(token)
+                continue
+            if token == "q":
+                saved_matrices.append(matrix)
+            elif token == "Q":
+                if saved_matrices:
+                    matrix = saved_matrices.pop()
+            elif token == "cm" and len(operands) == 6:
+                a, b, c, d, e, f = (float(x) for x in operands)
+                m = matrix
+                matrix = [a * m[0] + b * m[2], a * m[1] + b * m[3],
+                          c * m[0] + d * m[2], c * m[1] + d * m[3],
+                          e * m[0] + f * m[2] + m[4], e * m[1] + f * m[3] + m[5]]
+            elif token == "Do" and len(operands) == 1 and painted is None:
+                painted = (operands[0], matrix)
+            elif token not in _STATE_OPERATORS:
+                # Anything else (text, vector graphics, inline images or a
+                # second image) means the page must be rasterized.
+                return None
+            operands = []
+        if painted is None or operands:
+            return None
+        resources = self.resolve(page.get("Resources")) or {}
+        xobjects = self.resolve(resources.get("XObject")) or {}
+        image_stream = self.resolve(xobjects.get(painted[0]))
+        if (not isinstance(image_stream, Stream)
+                or image_stream.dict.get("Subtype") != "Image"):
+            return None
+        return image_stream, painted[1]
+
+
+def _get_component_count(document: PdfDocument,
+                         color_space: tp.Any) -> tp.Optional[int]:
+    """Number of color components of a color space, or `None` if it isn't a
+    plain gray, RGB or CMYK space."""
+    color_space = document.resolve(color_space)
+    if isinstance(color_space, list) and color_space:
+        family = document.resolve(color_space[0])
+        if family == "ICCBased":
+            profile = document.resolve(color_space[1])
+            return document.resolve(profile.dict.get("N"))
+        if family in ("CalGray", "CalRGB"):
+            color_space = Name("DeviceGray" if family == "CalGray" else "DeviceRGB")
+        else:
+            return None
+    return {
+        "DeviceGray": 1, "G": 1, "DeviceRGB": 3, "RGB": 3,
+        "DeviceCMYK": 4, "CMYK": 4
+    }.get(color_space)
+
+
+def _make_ccitt_tiff(data: bytes, width: int, height: int,
+                     params: tp.Dict[str, tp.Any]) -> bytes:
+    """Wrap CCITT fax data in a minimal single-strip TIFF so it can be decoded
+    by OpenCV's TIFF reader."""
+    k = params.get("K", 0)
+    entries = [
+        (256, 4, width),  # ImageWidth
+        (257, 4, height),  # ImageLength
+        (258, 3, 1),  # BitsPerSample
+        (259, 3, 4 if k < 0 else 3),  # Compression: T6 (G4) or T4 (G3)
+        (262, 3, 0),  # PhotometricInterpretation: WhiteIsZero, as in faxes
+
+        (273, 4, 0),  # StripOffsets, filled in below
+        (277, 3, 1),  # SamplesPerPixel
+        (278, 4, height),  # RowsPerStrip
+        (279, 4, len(data)),  # StripByteCounts
+        (292 if k >= 0 else 293, 4, 1 if k > 0 else 0),  # T4Options / T6Options
+    ]
+    entries.sort()
+    ifd_offset = 8
+    data_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack("<H", len(entries))
+    for tag, field_type, value in entries:
+        if tag == 273:
+            value = data_offset
+        if field_type == 3:
+            ifd += struct.pack("<HHIHH", tag, field_type, 1, value, 0)
+        else:
+            ifd += struct.pack("<HHII", tag, field_type, 1, value)
+    ifd += struct.pack("<I", 0)
+    return b"II*\x00" + struct.pack("<I", ifd_offset) + ifd + data
+
+
+def _decode_image(document: PdfDocument, stream: Stream,
+                  grayscale: bool) -> tp.Optional[np.ndarray]:
+    """Decode an image XObject to a gray or BGR array, or return `None` if its
+    format isn't supported."""
+    image_dict = stream.dict
+    if document.resolve(image_dict.get("ImageMask", False)):
+        return None
+    width = document.resolve(image_dict["Width"])
+    height = document.resolve(image_dict["Height"])
+    filters = [document.resolve(f) for f in _as_list(document.resolve(image_dict.get("Filter")))]
+    params = [document.resolve(p) for p in _as_list(document.resolve(image_dict.get("DecodeParms")))]
+    params += [None] * (len(filters) - len(params))
+    codec = filters[-1] if filters and filters[-1] in _IMAGE_FILTERS else None
+    codec_params = (params[-1] or {}) if codec else {}
+    if any(p and p.get("Predictor", 1) > 1 for p in params):
+        # Undoing predictors is only implemented for small streams
+        return None
+    data = document.decode_stream(stream, keep_last_image_filter=True)
+
+    decode = document.resolve(image_dict.get("Decode"))
+    inverted = isinstance(decode, list) and len(decode) >= 2 and decode[0] > decode[1]
+    flags = (cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+
+    if codec in ("DCTDecode", "DCT", "JPXDecode"):
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    elif codec in ("CCITTFaxDecode", "CCF"):
+        if codec_params.get("EncodedByteAlign", False):
+            return None
+        columns = codec_params.get("Columns", 1728)
+        rows = codec_params.get("Rows", height) or height
+        tiff = _make_ccitt_tiff(data, columns, rows, codec_params)
+        image = cv2.imdecode(np.frombuffer(tiff, np.uint8), flags)
+        # The TIFF shows black runs as black. The PDF filter outputs them as 0
+        # (black in DeviceGray) unless BlackIs1 is set.
+        if codec_params.get("BlackIs1", False):
+            inverted = not inverted
+    elif codec is None:
+        components = _get_component_count(document, image_dict.get("ColorSpace"))
+        bits = document.resolve(image_dict.get("BitsPerComponent", 8))
+        if components not in (1, 3):
+            return None
+        if bits == 8:
+            row_length = width * components
+            pixels = np.frombuffer(data[:row_length * height], np.uint8)
+            image = pixels.reshape(height, width, components)
+            if components == 3:
+                image = cv2.cvtColor(
+                    image, cv2.COLOR_RGB2GRAY if grayscale else cv2.COLOR_RGB2BGR)
+            else:
+                image = image[:, :, 0]
+        elif bits == 1 and components == 1:
+            row_length = (width + 7) // 8
+            packed = np.frombuffer(data[:row_length * height], np.uint8)
+            image = np.unpackbits(packed.reshape(height, row_length),
+                                  axis=1)[:, :width] * np.uint8(255)
+        else:
+            return None
+    else:
+        return None
+
+    if image is None or image.shape[:2] != (height, width):
+        return None
+    if inverted:
+        image = 255 - image
+    if not grayscale and image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif grayscale and image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return np.ascontiguousarray(image)
+
+
+def _orient_image(image: np.ndarray, matrix: tp.List[float],
+                  rotate: int) -> tp.Optional[np.ndarray]:
+    """Transpose and flip an image the way it is displayed, given the matrix it
+    is painted with and the page's `/Rotate` value. Only right angle
+    placements are supported, anything else returns `None`."""
+    a, b, c, d = matrix[:4]
+    scale = max(abs(a), abs(b), abs(c), abs(d))
+    if scale == 0:
+        return None
+    tolerance = scale * 1e-3
+    if abs(b) <= tolerance and abs(c) <= tolerance:
+        # Image x runs along page x, image y along page y
+        page_axes = np.array([[np.sign(a), 0], [0, np.sign(d)]])
+    elif abs(a) <= tolerance and abs(d) <= tolerance:
+        page_axes = np.array([[0, np.sign(c)], [np.sign(b), 0]])
+    else:
+        return None
+    # Array columns run along image x, but array rows run against image y
+    # (image space has its origin in the bottom left).
+    array_to_page = page_axes @ np.array([[1, 0], [0, -1]])
+    # Page y points up but display rows go down, then /Rotate turns the page
+    # clockwise in 90 degree steps.
+    array_to_display = np.array([[1, 0], [0, -1]]) @ array_to_page
+    clockwise = np.array([[0, -1], [1, 0]])
+    for _ in range((rotate // 90) % 4):
+        array_to_display = clockwise @ array_to_display
+    if array_to_display[0, 0] == 0:
+        image = cv2.transpose(image)
+        array_to_display = array_to_display @ np.array([[0, 1], [1, 0]])
+    if array_to_display[0, 0] < 0:
+        image = cv2.flip(image, 1)
+    if array_to_display[1, 1] < 0:
+        image = cv2.flip(image, 0)
+    return image
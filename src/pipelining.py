@@ -0,0 +1,101 @@
+"""Running the stages of processing concurrently, connected by bounded queues.
+
+Decoding a page and recognizing it mostly run in native code that releases
+the interpreter, so decoding the next pages in a thread while the current one
+is recognized overlaps the two. The queues between stages are bounded, so a
+fast stage can only get a few pages ahead of a slow one and memory use stays
+flat however large the batch is.
+"""
+
+import collections
+import concurrent.futures
+import queue
+import sys
+import threading
+import typing as tp
+
+"""Number of items a stage may get ahead of the stage consuming them. Decoded
+pages are large, so this is kept just deep enough to keep both stages busy."""
+DEFAULT_QUEUE_DEPTH = 2
+
+# Seconds a blocked producer waits before checking if it should stop.
+_POLL_INTERVAL = 0.1
+
+T = tp.TypeVar("T")
+U = tp.TypeVar("U")
+
+
+class _Done():
+    """Marks the end of the items in a queue, carrying the exception that
+    ended them early, if any."""
+    exc_info: tp.Optional[tp.Tuple[tp.Any, BaseException, tp.Any]]
+
+    def __init__(self,
+                 exc_info: tp.Optional[tp.Tuple[tp.Any, BaseException,
+                                                tp.Any]] = None):
+        self.exc_info = exc_info
+
+
+def prefetch(items: tp.Iterable[T],
+             depth: int = DEFAULT_QUEUE_DEPTH) -> tp.Iterator[T]:
+    """Iterate over `items` in a background thread, staying up to `depth`
+    items ahead of the consumer. Yields the same items in the same order, and
+    an exception raised while iterating is re-raised to the consumer.
+
+    If the consumer stops early, the background thread stops too.
+    """
+    buffer: "queue.Queue[tp.Any]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item: tp.Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException:
+            put(_Done(sys.exc_info()))
+            return
+        put(_Done())
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _Done):
+                if item.exc_info is not None:
+                    raise item.exc_info[1].with_traceback(item.exc_info[2])
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def map_ordered(executor: concurrent.futures.Executor,
+                function: tp.Callable[[T], U],
+                items: tp.Iterable[T],
+                max_pending: int) -> tp.Iterator[U]:
+    """Like `executor.map`, but only takes items from `items` as results are
+    consumed, keeping at most `max_pending` of them submitted at once.
+    Results are yielded in the order of the items."""
+    pending: tp.Deque[concurrent.futures.Future] = collections.deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
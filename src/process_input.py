@@ -1,33 +1,116 @@
+import concurrent.futures
 import textwrap
+import threading
+import time
 import typing as tp
 from pathlib import Path
 from datetime import datetime
 
 import data_exporting
 import image_utils
-import corner_finding
-import numpy as np
+import metrics
+import profiling
+import result_cache
 import scoring
 import grid_info as grid_i
-import grid_reading as grid_r
-from user_interface import ProgressTrackerWidget
+import sheet_recognition
 from scored_handouts import create_pdfs
 
+if tp.TYPE_CHECKING:
+    # Only imported for type checking, so headless runs never import tkinter.
+    from user_interface import ProgressTrackerWidget
+
+
+class BatchCancelled(RuntimeError):
+    """Raised when processing is cancelled through the `cancel_event`."""
+
+
+def load_previous_output(output_folder: Path,
+                         answers_results: data_exporting.OutputSheet,
+                         keys_results: data_exporting.OutputSheet,
+                         rejected_files: data_exporting.OutputSheet
+                         ) -> tp.Dict[str, str]:
+    """Add the rows saved to the output folder by the latest earlier run to the
+    given sheets. Returns the manifest of pages that run processed, mapping
+    page hashes to their source files."""
+    for sheet, filebasename in ((answers_results, "results"),
+                                (keys_results, "keys"),
+                                (rejected_files, "rejected_files")):
+        csvfile = data_exporting.find_latest_output(output_folder,
+                                                    filebasename)
+        if csvfile is not None:
+            sheet.add_file(csvfile)
+    manifest_file = data_exporting.find_latest_output(
+        output_folder, data_exporting.PAGE_MANIFEST_NAME)
+    if manifest_file is None:
+        return {}
+    return data_exporting.load_page_manifest(manifest_file)
+
+
 def process_input(
         test_identifier: str,
-        images: tp.List[np.ndarray],
-        images_name: tp.List[str],
-        images_type: tp.List[str],
+        image_paths: tp.List[Path],
         output_folder: Path,
         sort_results: bool,
         debug_mode_on: bool,
         form_variant: grid_i.FormVariant,
-        progress_tracker: tp.Optional[ProgressTrackerWidget],
-        files_timestamp: tp.Optional[datetime]):
+        progress_tracker: tp.Optional["ProgressTrackerWidget"],
+        files_timestamp: tp.Optional[datetime],
+        workers: int = 1,
+        recognition_options: tp.Optional[sheet_recognition.RecognitionOptions] = None,
+        decode_options: tp.Optional[image_utils.DecodeOptions] = None,
+        cache: tp.Optional[result_cache.ResultCache] = None,
+        append: bool = False,
+        metrics_path: tp.Optional[Path] = None,
+        page_profiler: tp.Optional[profiling.PageProfiler] = None,
+        handouts_per_student: bool = False,
+        cancel_event: tp.Optional[threading.Event] = None,
+        executor: tp.Optional[concurrent.futures.Executor] = None) -> bool:
     """Takes input as parameters and process it for either gui or cli.
-    
+
+    Pages are decoded one at a time as they are processed. If `workers` is
+    greater than 1, pages are recognized in that many worker processes and the
+    results are collected in the original page order. Handouts are then
+    rendered in as many processes too. If a `cache` is given, measurements of
+    pages seen in earlier runs are reused from it. A long-running caller can
+    pass an `executor` from `sheet_recognition.create_worker_pool`, created
+    with the same settings, to recognize pages and render handouts in instead
+    of starting a pool for this batch.
+
+    If `append` is `True`, the results already saved in the output folder are
+    kept and the new pages are added to them. Pages that were processed before
+    are skipped, and a sheet replaces earlier sheets with the same student ID.
+    Scores and handouts are regenerated from the combined results.
+
+    Pages are told apart by a hash of their decoded pixels, which is saved to
+    the output folder when a `cache` is used or `append` is `True`; other runs
+    don't hash pages, so their pages can't be skipped later. The hash depends
+    on how pages were decoded: the same scan decoded in color instead of
+    grayscale, at another PDF resolution, or rasterized instead of extracted
+    is not recognized as processed before.
+
+    If `metrics_path` is given, the time spent in every stage of processing is
+    written to it as JSON Lines: a record for every page, followed by a
+    summary of the whole batch.
+
+    If `handouts_per_student` is `True`, every student's handout is saved to its
+    own PDF file, named by student ID, instead of all of them to `Scores.pdf`.
+
+    If `page_profiler` is given, every page is profiled with it in this
+    process, and the pages it kept are listed once all pages are processed.
+
+    If `cancel_event` is set while pages are processed, processing stops after
+    the current page and no output is saved. With a `cache`, pages measured so
+    far are still cached, so processing the batch again picks up where it
+    stopped.
+
+    Returns `True` if all output was saved, and `False` if processing failed
+    or was cancelled. If the given `executor` breaks, the error is raised
+    instead, so the caller can replace it.
+
     Parameter progress_tracker determines whith interface in use.
-    If progress_tracker is given, function runs in gui mode.
+    If progress_tracker is given, function runs in gui mode. Its methods can
+    be called from any thread, so this can run in a background thread.
     If progress_tracker parameter is None, prints all progress statuses to stdout.
     """
 
@@ -38,142 +121,157 @@ def process_input(
 
     rejected_files = data_exporting.OutputSheet([grid_i.Field.IMAGE_FILE], 0)
 
-    debug_dir = output_folder / (
-            data_exporting.format_timestamp_for_file(files_timestamp) + "debug")
+    debug_dir = data_exporting.get_debug_dir(output_folder, files_timestamp)
     if debug_mode_on:
         data_exporting.make_dir_if_not_exists(debug_dir)
 
+    if metrics_path is not None:
+        metrics.enable()
+    start_time = time.perf_counter()
+    page_records: tp.List[tp.Tuple[str, metrics.Record]] = []
+
+    page_manifest: tp.Dict[str, str] = {}
+    if append:
+        page_manifest = load_previous_output(output_folder, answers_results,
+                                             keys_results, rejected_files)
+
+    succeeded = False
     try:
-        for i in range(len(images)):
-            if debug_mode_on:
-                debug_path = debug_dir / images_name[i]
-                data_exporting.make_dir_if_not_exists(debug_path)
-            else:
-                debug_path = None
-
-            if progress_tracker:
-                progress_tracker.set_status(f"Processing {images_name[i]}.{images_type[i]}")
-            else:
-                print(f"Processing {images_name[i]}.{images_type[i]}")
-
-            image = images[i]
-            prepared_image = image_utils.prepare_scan_for_processing(
-                image, save_path=debug_path)
-
-            try:
-                corners = corner_finding.find_corner_marks(prepared_image,
-                                                       save_path=debug_path)
-            except corner_finding.CornerFindingError:
-                rejected_files.add({grid_i.Field.IMAGE_FILE: images_name[i]}, [])
-                continue
-
-            # Dilates the image - removes black pixels from edges, which preserves
-            # solid shapes while destroying nonsolid ones. By doing this after noise
-            # removal and thresholding, it eliminates irregular things like W and M
-            morphed_image = image_utils.dilate(prepared_image,
-                                               save_path=debug_path)
-
-            # Establish a grid
-            grid = grid_r.Grid(corners,
-                               grid_i.GRID_HORIZONTAL_CELLS,
-                               grid_i.GRID_VERTICAL_CELLS,
-                               morphed_image,
-                               save_path=debug_path)
-
-            # Calculate fill percent for every bubble
-            field_fill_percents = {
-                key: grid_r.get_group_from_info(value,
-                                                grid).get_all_fill_percents()
-                for key, value in form_variant.fields.items() if value is not None
-            }
-            answer_fill_percents = [
-                grid_r.get_group_from_info(question, grid).get_all_fill_percents()
-                for question in form_variant.questions
-            ]
-
-            # Calculate the fill threshold
-            threshold = grid_r.calculate_bubble_fill_threshold(
-                field_fill_percents,
-                answer_fill_percents,
-                save_path=debug_path,
-                form_variant=form_variant)
-
-            # Get the answers for questions
-            answers = [
-                grid_r.read_answer_as_string(i, grid,
-                                             threshold, form_variant,
-                                             answer_fill_percents[i])
-                for i in range(form_variant.num_questions)
-            ]
-
-            field_data: tp.Dict[grid_i.RealOrVirtualField, str] = {
-                grid_i.Field.IMAGE_FILE: images_name[i],
-            }
-
-            # Read the Student ID. If it indicates this exam is a key, treat it as such
-            student_id = grid_r.read_field_as_string(
-                grid_i.Field.STUDENT_ID, grid, threshold, form_variant,
-                field_fill_percents[grid_i.Field.STUDENT_ID])
-            if student_id == grid_i.KEY_STUDENT_ID:
-                form_code_field = grid_i.Field.TEST_FORM_CODE
-                field_data[form_code_field] = grid_r.read_field_as_string(
-                    form_code_field, grid, threshold, form_variant,
-                    field_fill_percents[form_code_field]) or ""
-                keys_results.add(field_data, answers)
-
-            else:
-                for field in form_variant.fields.keys():
-                    field_value = grid_r.read_field_as_string(
-                        field, grid, threshold, form_variant,
-                        field_fill_percents[field])
-                    if field_value is not None:
-                        field_data[field] = field_value
-                answers_results.add(field_data, answers)
-            if progress_tracker:
-                progress_tracker.step_progress()
-
-        answers_results.clean_up("")
-        answers_results.save(output_folder,
-                             "results",
-                             sort_results,
-                             timestamp=files_timestamp)
+        with sheet_recognition.SheetRecognizer(
+                form_variant, recognition_options, workers,
+                debug_dir if debug_mode_on else None, cache,
+                frozenset(page_manifest) if append else None,
+                executor) as recognizer:
+            for result in recognizer.recognize_files(image_paths,
+                                                     decode_options,
+                                                     page_profiler):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise BatchCancelled()
+                if result.skipped:
+                    status = (f"Skipping {result.image_name}.{result.image_type}, already processed as "
+                              f"{page_manifest[result.page_hash]}")
+                else:
+                    status = f"Processing {result.image_name}.{result.image_type}"
+                if progress_tracker:
+                    progress_tracker.set_status(status)
+                else:
+                    print(status)
+
+                if result.skipped:
+                    pass
+                elif result.rejected:
+                    rejected_files.add(result.fields, [])
+                elif result.is_key:
+                    # Answer keys only need the form code to be matched to results
+                    key_fields = {
+                        grid_i.Field.IMAGE_FILE: result.image_name,
+                        grid_i.Field.TEST_FORM_CODE:
+                        result.fields.get(grid_i.Field.TEST_FORM_CODE, "")
+                    }
+                    keys_results.add(key_fields, result.answers)
+                else:
+                    student_id = result.fields.get(grid_i.Field.STUDENT_ID, "")
+                    if append and student_id and answers_results.remove_matching(
+                            grid_i.Field.STUDENT_ID, student_id):
+                        status = f"Replacing earlier results for student ID {student_id}"
+                        if progress_tracker:
+                            progress_tracker.set_status(status)
+                        else:
+                            print(status)
+                    answers_results.add(result.fields, result.answers)
+
+                if not result.skipped and result.page_hash is not None:
+                    page_manifest[result.page_hash] = result.image_name
+                if result.metrics_record is not None:
+                    page_records.append((result.image_name, result.metrics_record))
+
+                if progress_tracker:
+                    progress_tracker.step_progress(rejected=result.rejected)
+
+        # Anything measured from here on is part of the batch, not a page.
+        metrics.take_record()
+
+        if page_profiler is not None:
+            for page_name, elapsed_ms in page_profiler.slow_pages:
+                status = f"Profiled {page_name}, which took {elapsed_ms:.0f} ms"
+                if progress_tracker:
+                    progress_tracker.set_status(status)
+                else:
+                    print(status)
+
+        if cache is not None:
+            cache.trim()
+
+        with metrics.stage("csv"):
+            data_exporting.save_page_manifest(page_manifest, output_folder,
+                                              files_timestamp)
+            answers_results.clean_up("")
+            answers_results.save(output_folder,
+                                 "results",
+                                 sort_results,
+                                 timestamp=files_timestamp)
 
         if rejected_files.row_count == 0:
             success_string = "✔️ All exams processed and saved.\n"
         else:
             success_string = "❗ Some files could not be processed (see rejected_files output).\nAll other exams were processed and saved.\n"
-            rejected_files.save(output_folder, "rejected_files", sort=False, timestamp=files_timestamp)
+            with metrics.stage("csv"):
+                rejected_files.save(output_folder, "rejected_files", sort=False, timestamp=files_timestamp)
 
+        scores: tp.Optional[data_exporting.OutputSheet] = None
         if (keys_results.row_count == 0):
             success_string += "No exam keys were found, so no scoring was performed."
         else:
-            keys_results.save(output_folder,
-                              "keys",
-                              sort_results,
-                              timestamp=files_timestamp)
+            with metrics.stage("csv"):
+                keys_results.save(output_folder,
+                                  "keys",
+                                  sort_results,
+                                  timestamp=files_timestamp)
             success_string += "✔️ All keys processed and saved.\n"
-            scores = scoring.score_results(answers_results, keys_results,
-                                           form_variant.num_questions)
-            scores.save(output_folder,
-                        "scores",
-                        sort_results,
-                        timestamp=files_timestamp)
+            with metrics.stage("scoring"):
+                scores, item_analysis = scoring.score_and_analyze(
+                    answers_results, keys_results, form_variant.num_questions)
+            with metrics.stage("csv"):
+                scores.save(output_folder,
+                            "scores",
+                            sort_results,
+                            timestamp=files_timestamp)
+                data_exporting.save_csv(
+                    item_analysis, output_folder /
+                    f"{data_exporting.format_timestamp_for_file(files_timestamp)}{scoring.ITEM_ANALYSIS_NAME}.csv"
+                )
             success_string += "✔️ All scored results processed and saved."
 
+        with metrics.stage("pdf"):
+            create_pdfs(output_folder, files_timestamp, test_identifier,
+                        answers_results, keys_results, scores, workers,
+                        handouts_per_student, executor)
+
         if progress_tracker:
             progress_tracker.set_status(success_string, False)
         else:
             print(success_string)
+        succeeded = True
+    except BatchCancelled:
+        status = "Cancelled. No output was saved."
+        if progress_tracker:
+            progress_tracker.set_status(status, False)
+        else:
+            print(status)
     except (RuntimeError, ValueError) as e:
         wrapped_err = "\n".join(textwrap.wrap(str(e), 70))
         if progress_tracker:
             progress_tracker.set_status(f"Error: {wrapped_err}", False)
         else:
             print(f'Error: {wrapped_err}')
-        if debug_mode_on:
+        if debug_mode_on or (executor is not None and
+                             isinstance(e, concurrent.futures.BrokenExecutor)):
             raise
-    create_pdfs(output_folder, files_timestamp, test_identifier)
 
-    if progress_tracker:
-        progress_tracker.show_exit_button_and_wait()
+    if metrics_path is not None:
+        metrics.write_metrics(metrics_path, page_records,
+                              metrics.take_record() or metrics.Record(),
+                              time.perf_counter() - start_time)
+        metrics.disable()
+    return succeeded
 
@@ -0,0 +1,172 @@
+"""Profiling of a whole batch or of individual slow pages.
+
+Two profilers can be used:
+    * cProfile, which records every Python call and is saved as a `.pstats`
+      file for `pstats` or tools like snakeviz;
+    * a sampling profiler, which records the stack of the profiled thread at a
+      fixed interval from a background thread. It is cheap enough to leave
+      the timings mostly undisturbed, and it is saved as collapsed stacks (one
+      `frame;frame;frame count` line per distinct stack), the input format of
+      flamegraph tools.
+
+In the default mode, both profilers run together. In sampling mode, only the
+sampling profiler runs.
+"""
+
+import cProfile
+import contextlib
+import os
+import pathlib
+import sys
+import threading
+import time
+import typing as tp
+
+PROFILE_MODES = ["cprofile", "sampling"]
+
+"""Seconds between samples of the sampling profiler. Python code only gives up
+the interpreter every 5 ms by default, so sampling faster mostly records
+native code."""
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+"""Base name of the files a whole batch is profiled to."""
+BATCH_PROFILE_NAME = "profile"
+
+
+class SamplingProfiler():
+    """Samples the stack of one thread from a background thread.
+
+    Members:
+        interval: Seconds between samples.
+        stacks: Number of samples of every stack, keyed by its frames from the
+            outermost in, separated by `;`.
+    """
+    interval: float
+    stacks: tp.Dict[str, int]
+    _thread_id: tp.Optional[int]
+    _stop_event: threading.Event
+    _sampler: tp.Optional[threading.Thread]
+
+    def __init__(self, interval: float = DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._thread_id = None
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start sampling the calling thread."""
+        self._thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(
+                    f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if frames:
+                stack = ";".join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write_collapsed(self, path: pathlib.PurePath):
+        with open(str(path), "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+
+class _Profilers():
+    """The profilers of one mode, run together."""
+    sampler: SamplingProfiler
+    profile: tp.Optional[cProfile.Profile]
+
+    def __init__(self, mode: str):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'.")
+        self.sampler = SamplingProfiler()
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+
+    def start(self):
+        self.sampler.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        self.sampler.stop()
+
+    def save(self, save_dir: pathlib.Path, basename: str):
+        self.sampler.write_collapsed(save_dir / f"{basename}.collapsed")
+        if self.profile is not None:
+            self.profile.dump_stats(str(save_dir / f"{basename}.pstats"))
+
+
+@contextlib.contextmanager
+def profile_batch(save_dir: pathlib.Path,
+                  mode: str = PROFILE_MODES[0]) -> tp.Iterator[None]:
+    """Profile everything run in this context, saving the profiles to
+    `save_dir` when it exits."""
+    profilers = _Profilers(mode)
+    profilers.start()
+    try:
+        yield
+    finally:
+        profilers.stop()
+        save_dir.mkdir(parents=True, exist_ok=True)
+        profilers.save(save_dir, BATCH_PROFILE_NAME)
+
+
+class PageProfiler():
+    """Profiles pages one at a time, keeping only the profiles of the pages
+    that took longer than `slower_than_ms`. This captures pathological pages
+    without profiling, or saving, the rest of the batch.
+
+    Members:
+        save_dir: Folder the profiles of slow pages are saved to, named after
+            the page.
+        slower_than_ms: Pages that took at most this long aren't saved.
+        mode: One of `PROFILE_MODES`.
+        slow_pages: Names and durations in milliseconds of the pages that
+            were saved.
+    """
+    save_dir: pathlib.Path
+    slower_than_ms: float
+    mode: str
+    slow_pages: tp.List[tp.Tuple[str, float]]
+
+    def __init__(self,
+                 save_dir: pathlib.Path,
+                 slower_than_ms: float,
+                 mode: str = PROFILE_MODES[0]):
+        self.save_dir = save_dir
+        self.slower_than_ms = slower_than_ms
+        self.mode = mode
+        self.slow_pages = []
+
+    @contextlib.contextmanager
+    def profile(self, page_name: str) -> tp.Iterator[None]:
+        """Profile the processing of a page run in this context."""
+        profilers = _Profilers(self.mode)
+        start_time = time.perf_counter()
+        profilers.start()
+        try:
+            yield
+        finally:
+            profilers.stop()
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            if elapsed_ms > self.slower_than_ms:
+                self.save_dir.mkdir(parents=True, exist_ok=True)
+                profilers.save(self.save_dir, page_name)
+                self.slow_pages.append((page_name, elapsed_ms))
@@ -0,0 +1,180 @@
+"""An on-disk cache of per-page recognition measurements.
+
+Re-running the same scans (for example after fixing an answer key) would
+otherwise redo corner finding and grid reading for every page. Entries are
+content-addressed: they are stored under a hash of everything that determines
+the measurements, so an entry can never be used for a page it doesn't match.
+"""
+
+import hashlib
+import os
+import pathlib
+import platform
+import tempfile
+import typing as tp
+
+import numpy as np
+
+APP_CACHE_NAME = "kei-open-mcr"
+DEFAULT_CACHE_SIZE_MB = 200
+
+_ENTRY_SUFFIX = ".npz"
+_ALIAS_SUFFIX = ".alias"
+
+
+def get_default_cache_dir() -> pathlib.Path:
+    """Get the platform's conventional location for this app's cache."""
+    system = platform.system()
+    if system == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or str(
+            pathlib.Path.home() / "AppData" / "Local")
+    elif system == "Darwin":
+        base = str(pathlib.Path.home() / "Library" / "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(
+            pathlib.Path.home() / ".cache")
+    return pathlib.Path(base) / APP_CACHE_NAME
+
+
+def make_key(*parts: tp.Any) -> str:
+    """Combine the parts into a single cache key."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def hash_image(image: np.ndarray) -> str:
+    """Hash the pixels of an image, including its shape and type."""
+    image_hash = hashlib.sha256(repr((image.shape, image.dtype.str)).encode())
+    image_hash.update(np.ascontiguousarray(image).data)
+    return image_hash.hexdigest()
+
+
+class ResultCache():
+    """A directory of cached entries, each a small set of named arrays.
+
+    Entries are written atomically, so several processes can share a cache.
+    Reading an entry marks it as recently used, and `trim` removes the least
+    recently used entries once the cache grows past `max_size_bytes`.
+
+    Besides entries, the cache holds aliases: cheap keys (such as one derived
+    from a file's path and modification time) that point at an entry's key.
+    They make it possible to find an entry without decoding the page to hash
+    its pixels.
+    """
+    cache_dir: pathlib.Path
+    max_size_bytes: int
+
+    def __init__(self,
+                 cache_dir: pathlib.Path,
+                 max_size_bytes: int = DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+
+    def _get_path(self, key: str, suffix: str) -> pathlib.Path:
+        return self.cache_dir / key[:2] / (key + suffix)
+
+    def _write_atomically(self, path: pathlib.Path,
+                          write: tp.Callable[[tp.BinaryIO], None]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_name = tempfile.mkstemp(dir=path.parent,
+                                                      suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                write(file)
+            os.replace(temp_name, path)
+        except BaseException:
+            try:
+                os.remove(temp_name)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key: str) -> tp.Optional[tp.Dict[str, np.ndarray]]:
+        """Get the arrays stored under the key, or `None` if there are none."""
+        path = self._get_path(key, _ENTRY_SUFFIX)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                values = {name: entry[name] for name in entry.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            # Corrupted entries are treated as missing and replaced later.
+            self._remove(path)
+            return None
+        self._touch(path)
+        return values
+
+    def put(self, key: str, values: tp.Dict[str, np.ndarray]):
+        """Store the arrays under the key, replacing any existing entry."""
+        try:
+            self._write_atomically(self._get_path(key, _ENTRY_SUFFIX),
+                                   lambda file: np.savez(file, **values))
+        except OSError:
+            # The cache is only an optimization; a read-only or full disk
+            # must not stop processing.
+            pass
+
+    def get_alias(self, alias: str) -> tp.Optional[str]:
+        """Get the key the alias points to, if any."""
+        path = self._get_path(alias, _ALIAS_SUFFIX)
+        try:
+            key = path.read_text().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+        self._touch(path)
+        return key
+
+    def put_alias(self, alias: str, key: str):
+        """Point the alias at the key."""
+        try:
+            self._write_atomically(self._get_path(alias, _ALIAS_SUFFIX),
+                                   lambda file: file.write(key.encode()))
+        except OSError:
+            pass
+
+    def _iter_files(self) -> tp.Iterator[pathlib.Path]:
+        for path in self.cache_dir.glob("*/*"):
+            if path.suffix in (_ENTRY_SUFFIX, _ALIAS_SUFFIX):
+                yield path
+
+    def trim(self):
+        """Remove the least recently used files until the cache fits in
+        `max_size_bytes`."""
+        files = []
+        total_size = 0
+        for path in self._iter_files():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self.max_size_bytes:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def clear(self):
+        """Remove every entry and alias from the cache. Only files the cache
+        created are removed, in case it was pointed at a folder with other
+        files in it."""
+        for path in list(self._iter_files()):
+            self._remove(path)
+        for folder in self.cache_dir.glob("*"):
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+
+    def _touch(self, path: pathlib.Path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _remove(self, path: pathlib.Path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -3,38 +3,63 @@ Created on Feb 22, 2025
 
 @author: Kei G. Gauthier
 '''
-import csv
+import concurrent.futures
+import contextlib
+import re
+import tempfile
 import typing as tp
 from pathlib import Path
 from datetime import datetime
-from data_exporting import format_timestamp_for_file
+from data_exporting import OutputSheet, format_timestamp_for_file
+import pdf_merging
+import scoring
 
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.lib.pagesizes import letter
+if tp.TYPE_CHECKING:
+    from reportlab.pdfgen.canvas import Canvas
 
-def create_answer_key_pdfs(output_folder: Path, files_timestamp: tp.Optional[datetime], test_identifier: str):
+
+def _create_canvas(path: str) -> "Canvas":
+    """Create a letter-sized canvas. Reportlab is only imported here, so that
+    runs without handouts never load it."""
+    from reportlab.pdfgen.canvas import Canvas
+    from reportlab.lib.pagesizes import letter
+    return Canvas(path, pagesize=letter)
+
+
+"""Most handouts rendered at once by one worker process. Smaller chunks can be
+merged sooner, larger ones have less overhead per handout."""
+HANDOUT_CHUNK_SIZE = 50
+
+"""Folder handouts are saved to when every student gets their own file."""
+HANDOUTS_FOLDER_NAME = "Handouts"
+
+def _to_dictionaries(sheet: tp.Optional[OutputSheet]) -> tp.List[tp.Dict[str, str]]:
+    """Map every row of the sheet from its column names to its values, like
+    reading the sheet's CSV file with `csv.DictReader` would"""
+    if sheet is None:
+        return []
+    column_names = sheet.data[0]
+    return [dict(zip(column_names, row)) for row in sheet.data[1:]]
+
+
+def create_answer_key_pdfs(output_folder: Path, files_timestamp: tp.Optional[datetime], test_identifier: str,
+                           keys: tp.Optional[OutputSheet]):
     path = str(output_folder) + "/" + f"{format_timestamp_for_file(files_timestamp)}"
 
-    """Read open-mcr answer keys into python dictionaries"""   
-    key_dictionaries = []
-    keys_file_name = path + "keys.csv"
-    if Path(keys_file_name).is_file():
-        with open(keys_file_name, mode ='r') as file:
-            keys_reader = csv.DictReader(file)
-            for row in keys_reader:
-                key_dictionaries.append(row)
+    """Get the answer keys as python dictionaries"""
+    key_dictionaries = _to_dictionaries(keys)
     if len(key_dictionaries) == 0:
         print("❌ No answer keys found")
         return
 
     """Initialize pdf canvas"""   
-    canvas = Canvas(path + "Keys.pdf", pagesize=letter)
+    canvas = _create_canvas(path + "Keys.pdf")
 
     for key_dictionary in key_dictionaries:
 
         """Count questions in answer key"""
         questions_in_key = 0
-        for q in range(1,75+1):
+        for q in range(1,keys.num_questions+1):
             if key_dictionary["Q" + str(q)] != "":
                 questions_in_key = questions_in_key + 1
             else:
@@ -83,7 +108,7 @@ def create_answer_key_pdfs(output_folder: Path, files_timestamp: tp.Optional[dat
         """List the correct answers"""   
         canvas.drawCentredString(612/2, y_axis, "Question:  Correct Answer")
         y_axis = y_axis-24
-        for q in range(1,75+1):
+        for q in range(1,keys.num_questions+1):
             if key_dictionary["Q" + str(q)] != "":
                 canvas.setFont('Helvetica-Bold', 12)
                 canvas.drawString(x_axis, y_axis, "Q" + str(q))
@@ -103,133 +128,248 @@ def create_answer_key_pdfs(output_folder: Path, files_timestamp: tp.Optional[dat
     canvas.save()
 
 
-def create_scored_pdfs(output_folder, files_timestamp, test_identifier):
-    path = str(output_folder) + "/" + f"{format_timestamp_for_file(files_timestamp)}"
-
-    """Read open-mcr output files into python dictionaries"""   
-    key_dictionaries = []
-    result_dictionaries = []
-    score_dictionaries = []
-
-    keys_file_name = path + "keys.csv"
-    if Path(keys_file_name).is_file():
-        with open(keys_file_name, mode ='r') as file:
-            keys_reader = csv.DictReader(file)
-            for row in keys_reader:
-                key_dictionaries.append(row)
-    if len(key_dictionaries) == 0:
+class ScoredHandout():
+    """Everything printed on one student's handout, so handouts can be rendered
+    in other processes"""
+    student_id: str
+    image_file: str
+    test_description: str
+    name: str
+    score: str
+    points: str
+    questions_in_key: int
+    corrections: tp.List[tp.Tuple[int, str, str]]
+
+    def __init__(self, student_id: str, image_file: str, test_description: str, name: str,
+                 score: str, points: str, questions_in_key: int,
+                 corrections: tp.List[tp.Tuple[int, str, str]]):
+        self.student_id = student_id
+        self.image_file = image_file
+        self.test_description = test_description
+        self.name = name
+        self.score = score
+        self.points = points
+        self.questions_in_key = questions_in_key
+        self.corrections = corrections
+
+
+def get_scored_handouts(test_identifier: str, results: tp.Optional[OutputSheet],
+                        keys: tp.Optional[OutputSheet],
+                        scores: tp.Optional[OutputSheet]) -> tp.Optional[tp.List[ScoredHandout]]:
+    """Gets the handout of every result that has an answer key, or `None` if
+    there are no keys, results or scores"""
+
+    """Map every test form code to its answers, the same answers it was scored with"""
+    if keys is None or keys.row_count == 0:
         print("❌ No answer keys found")
-        return
+        return None
+    answer_keys = scoring.establish_key_dict(keys)
 
-    results_file_name = path + "results.csv"
-    if Path(results_file_name).is_file():
-        with open(results_file_name, mode ='r') as file:
-            results_reader = csv.DictReader(file)
-            for row in results_reader:
-                result_dictionaries.append(row)
+    result_dictionaries = _to_dictionaries(results)
     if len(result_dictionaries) == 0:
         print("❌ No results found")
-        return
+        return None
 
-    scores_file_name = path + "scores.csv"
-    if Path(scores_file_name).is_file():
-        with open(scores_file_name, mode ='r') as file:
-            scores_reader = csv.DictReader(file)
-            for row in scores_reader:
-                score_dictionaries.append(row)
-    if len(score_dictionaries) == 0:
+    """Match every result with its scores. Scores hold the fields of the result they
+       were scored from, so they are matched by those, whatever order both are sorted in."""
+    if scores is None or scores.row_count == 0:
         print("❌ No scores found")
-        return
-
-    """Initialize pdf canvas"""   
-    canvas = Canvas(path + "Scores.pdf", pagesize=letter)
-
-    """Loop through test results"""
-    for i in range(0, len(result_dictionaries)):
-        result_dictionary = result_dictionaries[i]
-
-        """Match result with its corresponding Answer Key"""
-        score_dictionary = score_dictionaries[i]
-        matching_key_dictionary = None;
-        for key_dictionary in key_dictionaries:
-            if (key_dictionary["Test Form Code"] == result_dictionary["Test Form Code"]):
-                matching_key_dictionary = key_dictionary
-                break
+        return None
+    num_fields = len(results.field_columns)
+    score_dictionaries_by_fields: tp.Dict[tp.Tuple[str, ...], tp.List[tp.Dict[str, str]]] = {}
+    for score_row, score_dictionary in zip(scores.data[1:], _to_dictionaries(scores)):
+        score_dictionaries_by_fields.setdefault(tuple(score_row[:num_fields]), []).append(score_dictionary)
+    for matching_scores in score_dictionaries_by_fields.values():
+        matching_scores.reverse()
+
+    handouts = []
+    for result_row, result_dictionary in zip(results.data[1:], result_dictionaries):
+
+        """Match result with its scores and corresponding Answer Key"""
+        score_dictionary = score_dictionaries_by_fields[tuple(result_row[:num_fields])].pop()
+        test_form_code = result_dictionary["Test Form Code"]
+        matching_key = answer_keys.get("*", answer_keys.get(test_form_code))
 
         """Ignore results that lack a valid Test Form Code"""
-        if matching_key_dictionary == None:
+        if matching_key is None:
             print("❌ Unable to process result" + str(result_dictionary))        
             continue;
 
-        """Print test description and version on canvas"""   
-        canvas.setFont('Helvetica-Bold', 16)
         test_description = test_identifier;
-        test_form_code = key_dictionary["Test Form Code"]
         if test_form_code != "":
             if test_description == "":
                 test_description = test_description + "Version " + test_form_code
             else:
                 test_description = test_description + " Version " + test_form_code
-        if test_description != "":
-            canvas.drawCentredString(612/2, 720, test_description)
 
-        """Print name"""
-        canvas.setFont('Helvetica-Bold', 16)
         name = result_dictionary["Last Name"]
         if result_dictionary["First Name"] != "":
             name = name  + " , " + result_dictionary["First Name"]
         if result_dictionary["Middle Name"] != "":
             name = name  + " , " + result_dictionary["Middle Name"]
-        canvas.drawString(50, 680, name)
-
 
         """Count questions in answer key"""
         questions_in_key = 0
-        for q in range(1,75+1):
-            if matching_key_dictionary["Q" + str(q)] != "":
+        for q in range(1,len(matching_key)+1):
+            if matching_key[q-1] != "":
                 questions_in_key = questions_in_key + 1
             else:
                 break
-  
-        """Print overall results"""
+
+        corrections = []
+        for q in range(1,questions_in_key+1):
+            correct_answer = matching_key[q-1]
+            result_answer = result_dictionary.get("Q" + str(q), "")
+            if result_answer != correct_answer:
+                corrections.append((q, correct_answer, result_answer))
+
+        handouts.append(ScoredHandout(result_dictionary.get("Student ID", ""),
+                                      result_dictionary.get("Source File", ""),
+                                      test_description, name,
+                                      score_dictionary["Total Score (%)"],
+                                      score_dictionary["Total Points"],
+                                      questions_in_key, corrections))
+    return handouts
+
+
+def draw_scored_handout(canvas: "Canvas", handout: ScoredHandout):
+    """Print test description and version on canvas"""   
+    canvas.setFont('Helvetica-Bold', 16)
+    if handout.test_description != "":
+        canvas.drawCentredString(612/2, 720, handout.test_description)
+
+    """Print name"""
+    canvas.setFont('Helvetica-Bold', 16)
+    canvas.drawString(50, 680, handout.name)
+
+    """Print overall results"""
+    canvas.setFont('Helvetica-Bold', 14)
+    canvas.drawString(50, 650, handout.score + "%  --  " + 
+                      str(handout.points) + 
+                      " of " + str(handout.questions_in_key) + 
+                      " questions answered correcty")
+
+    """Print corrections"""
+    if int(handout.points) != handout.questions_in_key:
         canvas.setFont('Helvetica-Bold', 14)
-        canvas.drawString(50, 650, score_dictionary["Total Score (%)"] + "%  --  " + 
-                          str(score_dictionary["Total Points"]) + 
-                          " of " + str(questions_in_key) + 
-                          " questions answered correcty")
-
-
-        """Print corrections"""
-        if int(score_dictionary["Total Points"]) != questions_in_key:
-            canvas.setFont('Helvetica-Bold', 14)
-            canvas.drawCentredString(612/2, 595, "Correct Answer:Chosen Answer")
-
-            x_axis = 50;
-            y_axis = 570
-            for q in range(1,questions_in_key+1):
-
-                correct_answer = matching_key_dictionary["Q" + str(q)]
-                result_answer = result_dictionary["Q" + str(q)]
-                if result_answer != correct_answer:
-                    canvas.setFont('Helvetica-Bold', 12)
-                    canvas.drawString(x_axis, y_axis, "Q" + str(q))
-                    x_axis = x_axis + 32
-                    canvas.setFont('Helvetica', 12)
-                    canvas.drawString(x_axis, y_axis, correct_answer + ":" + result_answer)
+        canvas.drawCentredString(612/2, 595, "Correct Answer:Chosen Answer")
+
+        x_axis = 50;
+        y_axis = 570
+        for q, correct_answer, result_answer in handout.corrections:
+            canvas.setFont('Helvetica-Bold', 12)
+            canvas.drawString(x_axis, y_axis, "Q" + str(q))
+            x_axis = x_axis + 32
+            canvas.setFont('Helvetica', 12)
+            canvas.drawString(x_axis, y_axis, correct_answer + ":" + result_answer)
+
+            if x_axis >= 440:
+                y_axis = y_axis - 14
+                x_axis = 50;
+            else:
+                x_axis = x_axis + 76
 
-                    if x_axis >= 440:
-                        y_axis = y_axis - 14
-                        x_axis = 50;
-                    else:
-                        x_axis = x_axis + 76
 
-        """Print handouts on separate pages"""
+def render_scored_handouts(path: str, handouts: tp.List[ScoredHandout]) -> str:
+    """Print the handouts on separate pages of a multi-page pdf file"""
+    canvas = _create_canvas(path)
+    for handout in handouts:
+        draw_scored_handout(canvas, handout)
         canvas.showPage()
-
-    """Save handouts in a multi-page pdf file"""
     canvas.save()
+    return path
+
+
+def _get_student_file_names(handouts: tp.List[ScoredHandout]) -> tp.List[str]:
+    """Name every handout after its student ID, or its source file if it has none.
+    Characters that aren't safe in file names are replaced and repeated names are
+    numbered, so that no handout overwrites another."""
+    file_names = []
+    used_names: tp.Set[str] = set()
+    for handout in handouts:
+        stem = re.sub(r"[^\w.-]", "_", handout.student_id or handout.image_file) or "handout"
+        file_name = stem
+        repeat = 1
+        while file_name.lower() in used_names:
+            repeat += 1
+            file_name = f"{stem}_{repeat}"
+        used_names.add(file_name.lower())
+        file_names.append(file_name + ".pdf")
+    return file_names
+
+
+def _open_executor(workers: int, executor: tp.Optional[concurrent.futures.Executor]
+                   ) -> tp.ContextManager[concurrent.futures.Executor]:
+    """The given executor, left running on exit, or else a new pool of
+    `workers` processes."""
+    if executor is not None:
+        return contextlib.nullcontext(executor)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+
+def create_scored_pdfs(output_folder: Path, files_timestamp: tp.Optional[datetime], test_identifier: str,
+                       results: tp.Optional[OutputSheet], keys: tp.Optional[OutputSheet],
+                       scores: tp.Optional[OutputSheet], workers: int = 1,
+                       per_student: bool = False,
+                       executor: tp.Optional[concurrent.futures.Executor] = None):
+    """Render the scored handouts, in `workers` processes if more than one.
+    The processes of `executor` are used if it is given, rather than starting
+    new ones.
+
+    Unless `per_student` is set, the handouts are all printed in `Scores.pdf`. In
+    parallel, they are rendered in chunks that are merged in order as soon as
+    they're done. Otherwise, every handout is saved to its own file in the
+    `Handouts` folder, named by student ID, and each file can be used as soon as
+    it's written."""
+    path = str(output_folder) + "/" + f"{format_timestamp_for_file(files_timestamp)}"
+
+    handouts = get_scored_handouts(test_identifier, results, keys, scores)
+    if handouts is None:
+        return
 
-def create_pdfs(output_folder, files_timestamp, test_identifier):
-    create_answer_key_pdfs(output_folder, files_timestamp, test_identifier)
-    create_scored_pdfs(output_folder, files_timestamp, test_identifier)
+    if per_student:
+        handouts_folder = Path(path + HANDOUTS_FOLDER_NAME)
+        handouts_folder.mkdir(parents=True, exist_ok=True)
+        jobs = [(str(handouts_folder / file_name), [handout])
+                for file_name, handout in zip(_get_student_file_names(handouts), handouts)]
+        if workers <= 1:
+            for job in jobs:
+                render_scored_handouts(*job)
+        else:
+            with _open_executor(workers, executor) as pool:
+                for future in concurrent.futures.as_completed(
+                        [pool.submit(render_scored_handouts, *job) for job in jobs]):
+                    future.result()
+        print(f"✔️ Saved {len(jobs)} handouts to {handouts_folder}")
+        return
+
+    if workers <= 1 or len(handouts) <= 1:
+        render_scored_handouts(path + "Scores.pdf", handouts)
+        return
 
+    chunk_size = max(1, min(HANDOUT_CHUNK_SIZE, -(-len(handouts) // workers)))
+    with tempfile.TemporaryDirectory() as chunks_folder:
+        with _open_executor(workers, executor) as pool:
+            chunk_futures = [
+                pool.submit(render_scored_handouts,
+                            str(Path(chunks_folder) / f"{i}.pdf"),
+                            handouts[start:start + chunk_size])
+                for i, start in enumerate(range(0, len(handouts), chunk_size))
+            ]
+            with pdf_merging.PdfMerger(Path(path + "Scores.pdf")) as merger:
+                for future in chunk_futures:
+                    chunk_path = Path(future.result())
+                    merger.add_file(chunk_path)
+                    chunk_path.unlink()
+
+
+def create_pdfs(output_folder: Path, files_timestamp: tp.Optional[datetime], test_identifier: str,
+                results: tp.Optional[OutputSheet], keys: tp.Optional[OutputSheet],
+                scores: tp.Optional[OutputSheet], workers: int = 1,
+                handouts_per_student: bool = False,
+                executor: tp.Optional[concurrent.futures.Executor] = None):
+    """Create the answer key and scored handouts from the sheets the results were
+    just saved from, rather than reading the saved CSV files back"""
+    create_answer_key_pdfs(output_folder, files_timestamp, test_identifier, keys)
+    create_scored_pdfs(output_folder, files_timestamp, test_identifier, results, keys, scores,
+                       workers, handouts_per_student, executor)
@@ -2,10 +2,12 @@ import csv
 import pathlib
 import typing as tp
 
+import numpy as np
+
+import alphabet
 import data_exporting
 import grid_info
 import list_utils
-import math_utils
 
 
 def get_key_form_code(answer_keys: data_exporting.OutputSheet,
@@ -52,9 +54,116 @@ def establish_key_dict(answer_keys: data_exporting.OutputSheet
     }
 
 
-def score_results(results: data_exporting.OutputSheet,
-                  answer_keys: data_exporting.OutputSheet,
-                  num_questions: int) -> data_exporting.OutputSheet:
+"""Bit of every symbol an answer can hold, so that a (multi-mark) answer can be
+encoded as the bitwise or of its symbols."""
+SYMBOL_BITS: tp.Dict[str, int] = {
+    symbol: 1 << i
+    for i, symbol in enumerate(alphabet.letters +
+                               [str(digit) for digit in range(10)])
+}
+
+"""Codes of answers that aren't plain symbols or multi-marks in the format the
+reader writes them (for example, text edited by hand) start here, so they
+never collide with a bitmask. Such answers still only equal themselves."""
+FIRST_TEXT_CODE = 1 << len(SYMBOL_BITS)
+
+"""Code of a position past the end of a row, which is never compared."""
+PADDING_CODE = -1
+
+"""Base name of the CSV file the item analysis is saved to."""
+ITEM_ANALYSIS_NAME = "item_analysis"
+
+ITEM_ANALYSIS_COLUMNS = [
+    data_exporting.COLUMN_NAMES[grid_info.Field.TEST_FORM_CODE], "Question",
+    "Key", "Sheets", "P-Value", "Discrimination"
+]
+
+
+class AnswerEncoder():
+    """Encodes answer strings as integers, such that two answers are encoded
+    the same if and only if the strings are equal.
+
+    Blank answers are 0, and answers written the way the reader writes them
+    (`A`, or `[A|C]` for a multi-mark) are the bitmask of their symbols.
+    """
+    _codes: tp.Dict[str, int]
+
+    def __init__(self):
+        self._codes = {"": 0}
+
+    def encode(self, answer: str) -> int:
+        try:
+            return self._codes[answer]
+        except KeyError:
+            pass
+        code = self._get_bitmask(answer)
+        if code is None:
+            code = FIRST_TEXT_CODE + len(self._codes)
+        self._codes[answer] = code
+        return code
+
+    def _get_bitmask(self, answer: str) -> tp.Optional[int]:
+        if answer in SYMBOL_BITS:
+            return SYMBOL_BITS[answer]
+        if not (answer.startswith("[") and answer.endswith("]")):
+            return None
+        symbols = answer[1:-1].split("|")
+        if len(symbols) < 2 or any(symbol not in SYMBOL_BITS
+                                   for symbol in symbols):
+            return None
+        mask = 0
+        for symbol in symbols:
+            mask |= SYMBOL_BITS[symbol]
+        # Only the canonical spelling may share the bitmask, or "[B|A]" would
+        # count as equal to "[A|B]".
+        canonical = "[" + "|".join(symbol for symbol in SYMBOL_BITS
+                                   if mask & SYMBOL_BITS[symbol]) + "]"
+        return mask if canonical == answer else None
+
+    def encode_rows(self, rows: tp.List[tp.List[str]]) -> np.ndarray:
+        """Encode rows of answers as a matrix, padding short rows with
+        `PADDING_CODE`."""
+        width = max((len(row) for row in rows), default=0)
+        matrix = np.full((len(rows), width), PADDING_CODE, dtype=np.int64)
+        for i, row in enumerate(rows):
+            matrix[i, :len(row)] = [self.encode(answer) for answer in row]
+        return matrix
+
+
+def _correlate(values: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Pearson correlation of every column of `values` with the same column of
+    `others`. Columns without variance get NaN."""
+    values = values - values.mean(axis=0)
+    others = others - others.mean(axis=0)
+    denominator = np.sqrt((values**2).sum(axis=0) * (others**2).sum(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0,
+                        (values * others).sum(axis=0) / denominator, np.nan)
+
+
+def _format_statistic(value: float) -> str:
+    return "" if np.isnan(value) else str(round(float(value), 3))
+
+
+def score_and_analyze(
+        results: data_exporting.OutputSheet,
+        answer_keys: data_exporting.OutputSheet, num_questions: int
+) -> tp.Tuple[data_exporting.OutputSheet, tp.List[tp.List[str]]]:
+    """Score every exam in `results` against the key of its form code, and
+    analyze how every question performed at the same time.
+
+    Answers are encoded as integer matrices (see `AnswerEncoder`), so every
+    form code is scored with a single comparison. An answer is correct if it
+    is exactly the key's answer. Like before, questions are compared up to the
+    shorter of the exam's answers and the key, so a question both leave blank
+    counts as correct.
+
+    Returns the scores and the item analysis. The item analysis is a table
+    (with a header row) holding, for every question a key has an answer for,
+    the number of sheets scored with the key, the p-value (the share of those
+    sheets that got it right) and the discrimination (the correlation of
+    getting it right with the score on the other questions).
+    """
     answers = results.data
     keys = establish_key_dict(answer_keys)
     form_code_column_name = data_exporting.COLUMN_NAMES[
@@ -67,36 +176,72 @@ def score_results(results: data_exporting.OutputSheet,
     ]
     columns = results.field_columns + virtual_fields
     scored_results = data_exporting.OutputSheet(columns, num_questions)
+    item_analysis = [ITEM_ANALYSIS_COLUMNS]
 
-    for exam in answers[1:]:  # Skip header row
+    exams = answers[1:]  # Skip header row
+    encoder = AnswerEncoder()
+    exam_matrix = encoder.encode_rows(
+        [exam[answers_start_index:] for exam in exams])
+    exam_lengths = (exam_matrix != PADDING_CODE).sum(axis=1)
+
+    # Group the exams by the form code of the key they're scored with
+    exam_key_codes = [
+        "*" if "*" in keys else exam[form_code_index] for exam in exams
+    ]
+    scored_answers: tp.List[tp.Optional[np.ndarray]] = [None] * len(exams)
+    for form_code in sorted(set(exam_key_codes) & set(keys)):
+        key = encoder.encode_rows([keys[form_code]])[0]
+        group = np.array([
+            i for i, code in enumerate(exam_key_codes) if code == form_code
+        ])
+        compared = min(exam_matrix.shape[1], len(key))
+        lengths = np.minimum(exam_lengths[group], len(key))
+        correct = ((exam_matrix[group, :compared] == key[:compared]) &
+                   (np.arange(compared) < lengths[:, np.newaxis]))
+        for i, exam_index in enumerate(group):
+            scored_answers[exam_index] = correct[i, :lengths[i]]
+
+        # Item analysis, over the questions the key has an answer for
+        questions = np.flatnonzero(key[:compared] != 0)
+        points = correct.sum(axis=1)
+        question_correct = correct[:, questions].astype(float)
+        p_values = question_correct.mean(axis=0)
+        discrimination = _correlate(
+            question_correct, points[:, np.newaxis] - question_correct)
+        for j, question in enumerate(questions):
+            item_analysis.append([
+                form_code, f"Q{question + 1}", keys[form_code][question],
+                str(len(group)),
+                _format_statistic(p_values[j]),
+                _format_statistic(discrimination[j])
+            ])
+
+    for exam, scored in zip(exams, scored_answers):
         fields = {
             k: v
             for k, v in zip(results.field_columns, exam[:answers_start_index])
         }
-        form_code = exam[form_code_index]
-        try:
-            if "*" in keys:
-                key = keys["*"]
-            else:
-                key = keys[form_code]
-        except KeyError:
+        if scored is None:
             fields[grid_info.VirtualField.
                    SCORE] = data_exporting.KEY_NOT_FOUND_MESSAGE
             fields[grid_info.VirtualField.
                    POINTS] = data_exporting.KEY_NOT_FOUND_MESSAGE
-            scored_answers = []
+            string_scored_answers = []
         else:
-            scored_answers = [
-                int(actual == correct)
-                for actual, correct in zip(exam[answers_start_index:], key)
-            ]
+            points = int(scored.sum())
             fields[grid_info.VirtualField.SCORE] = str(
-                round(math_utils.mean(scored_answers) * 100, 2))
-            fields[grid_info.VirtualField.POINTS] = str(sum(scored_answers))
-        string_scored_answers = [str(s) for s in scored_answers]
+                round(points / len(scored) * 100, 2))
+            fields[grid_info.VirtualField.POINTS] = str(points)
+            string_scored_answers = ["1" if s else "0" for s in scored]
         scored_results.add(fields, string_scored_answers)
 
-    return scored_results
+    return scored_results, item_analysis
+
+
+def score_results(results: data_exporting.OutputSheet,
+                  answer_keys: data_exporting.OutputSheet,
+                  num_questions: int) -> data_exporting.OutputSheet:
+    return score_and_analyze(results, answer_keys, num_questions)[0]
 
 
 def verify_answer_key_sheet(file_path: pathlib.Path) -> bool:
@@ -0,0 +1,747 @@
+"""Recognition of bubble sheets, independent of any file output.
+
+A `SheetRecognizer` recognizes batches of pages with one setup. The CLI and
+GUI recognize the pages of image files with its `recognize_files`. Pages that
+are already in memory are recognized with `recognize_pages` or, to reuse the
+setup across batches, its `recognize`; unless a debug folder or a cache is
+given, neither reads nor writes any files.
+"""
+
+import concurrent.futures
+import itertools
+import os
+import pathlib
+import time
+import typing as tp
+
+import numpy as np
+
+import corner_finding
+import data_exporting
+import geometry_utils
+import grid_info as grid_i
+import grid_reading as grid_r
+import image_utils
+import metrics
+import pipelining
+import profiling
+import result_cache
+
+
+"""Only the part of the page inside the corner marks is ever read, so only
+that part is dilated, plus this margin in pixels. The margin keeps the
+partially dilated pixels at the edge of the region away from the grid."""
+GRID_REGION_MARGIN = 4
+
+"""Version of the measuring algorithm, part of every cache key. Bump it
+whenever a change would alter the measurements of a page, so that measurements
+cached by older versions aren't reused."""
+ALGORITHM_VERSION = 2
+
+
+class RecognitionOptions():
+    """Settings that control how sheets are recognized.
+
+    Members:
+        perspective: If `True`, the sheet is warped into a canonical raster
+            using all four corner marks before it is read (see
+            `grid_reading.RectifiedGrid`). Otherwise, the grid is read directly
+            from the scan using an affine transform.
+        pixels_per_cell: Resolution of the canonical raster when `perspective`
+            is enabled.
+    """
+    perspective: bool
+    pixels_per_cell: int
+
+    def __init__(self,
+                 perspective: bool = False,
+                 pixels_per_cell: int = grid_r.DEFAULT_PIXELS_PER_CELL):
+        self.perspective = perspective
+        self.pixels_per_cell = pixels_per_cell
+
+
+class SheetResult():
+    """The data read from one page.
+
+    This is deliberately small and picklable so that it can be returned from
+    worker processes instead of the (much larger) page images.
+
+    Members:
+        image_name: Name of the page the result was read from.
+        image_type: Type (extension) of the file the page came from.
+        fields: Values of the fields read from the sheet, including the source
+            image name.
+        answers: Answers read for every question on the form.
+        threshold: Bubble fill threshold used for this page, or `None` if the
+            page was rejected.
+        fill_percents: Fill percent of every bubble, in the order of the
+            compiled form's `cells`, or `None` if the page was rejected or
+            skipped.
+        rejected: `True` if the page could not be read as a bubble sheet.
+        page_hash: Hash of the decoded page, which identifies it across runs,
+            or `None` if the page wasn't hashed because neither a cache nor
+            known page hashes were given.
+        skipped: `True` if the page was already processed in an earlier run,
+            so it wasn't recognized again and nothing was read from it.
+        elapsed_ms: Wall time it took to recognize the page, or `None` if its
+            result was found in the cache without decoding it.
+        metrics_record: Stage timings and counters collected while processing
+            the page, if metrics are enabled.
+    """
+    image_name: str
+    image_type: str
+    fields: tp.Dict[grid_i.RealOrVirtualField, str]
+    answers: tp.List[str]
+    threshold: tp.Optional[float]
+    fill_percents: tp.Optional[np.ndarray]
+    rejected: bool
+    page_hash: tp.Optional[str]
+    skipped: bool
+    elapsed_ms: tp.Optional[float]
+    metrics_record: tp.Optional[metrics.Record]
+
+    def __init__(self,
+                 image_name: str,
+                 image_type: str,
+                 fields: tp.Dict[grid_i.RealOrVirtualField, str],
+                 answers: tp.List[str],
+                 threshold: tp.Optional[float] = None,
+                 rejected: bool = False,
+                 page_hash: tp.Optional[str] = None,
+                 skipped: bool = False,
+                 fill_percents: tp.Optional[np.ndarray] = None):
+        self.image_name = image_name
+        self.image_type = image_type
+        self.fields = fields
+        self.answers = answers
+        self.threshold = threshold
+        self.fill_percents = fill_percents
+        self.rejected = rejected
+        self.page_hash = page_hash
+        self.skipped = skipped
+        self.elapsed_ms = None
+        self.metrics_record = None
+
+    @property
+    def is_key(self) -> bool:
+        """`True` if the Student ID marks this sheet as an answer key."""
+        return self.fields.get(grid_i.Field.STUDENT_ID) == grid_i.KEY_STUDENT_ID
+
+
+class SheetMeasurements():
+    """Everything measured on a page, before it is read as text.
+
+    Measurements only depend on the page image, the form layout and the
+    recognition options, so they are what `result_cache` stores.
+
+    Members:
+        corners: The corners of the grid, or `None` if they weren't found and
+            the page was rejected.
+        fill_percents: Fill percent of every bubble, in the order of the
+            compiled form's `cells`.
+        threshold: Fill percent above which a bubble counts as filled.
+    """
+    corners: tp.Optional[geometry_utils.Polygon]
+    fill_percents: tp.Optional[np.ndarray]
+    threshold: tp.Optional[float]
+
+    def __init__(self,
+                 corners: tp.Optional[geometry_utils.Polygon] = None,
+                 fill_percents: tp.Optional[np.ndarray] = None,
+                 threshold: tp.Optional[float] = None):
+        self.corners = corners
+        self.fill_percents = fill_percents
+        self.threshold = threshold
+
+    @property
+    def rejected(self) -> bool:
+        return self.corners is None
+
+    def to_arrays(self) -> tp.Dict[str, np.ndarray]:
+        if self.corners is None:
+            return {}
+        return {
+            "corners": np.array([[p.x, p.y] for p in self.corners]),
+            "fill_percents": np.asarray(self.fill_percents),
+            "threshold": np.array(self.threshold)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: tp.Dict[str, np.ndarray]
+                    ) -> "SheetMeasurements":
+        if "corners" not in arrays:
+            return cls()
+        return cls([geometry_utils.Point(float(x), float(y))
+                    for x, y in arrays["corners"]], arrays["fill_percents"],
+                   float(arrays["threshold"]))
+
+
+def measure_sheet(image: np.ndarray,
+                  form_variant: grid_i.FormVariant,
+                  save_path: tp.Optional[pathlib.PurePath] = None,
+                  options: tp.Optional[RecognitionOptions] = None,
+                  buffers: tp.Optional[image_utils.BufferPool] = None
+                  ) -> SheetMeasurements:
+    """Find the grid on a scanned page and measure the fill percent of every
+    bubble on it.
+
+    If `save_path` is provided, debugging data for every step is saved to this
+    location. If `buffers` is provided, the intermediate images are written
+    into it rather than allocated for every page.
+    """
+    options = options or RecognitionOptions()
+    prepared_image = image_utils.prepare_scan_for_processing(
+        image, save_path=save_path, buffers=buffers)
+
+    try:
+        with metrics.stage("find_corner_marks"):
+            corners = corner_finding.find_corner_marks(prepared_image,
+                                                       save_path=save_path)
+    except corner_finding.CornerFindingError:
+        return SheetMeasurements()
+
+    # Dilates the image - removes black pixels from edges, which preserves
+    # solid shapes while destroying nonsolid ones. By doing this after noise
+    # removal and thresholding, it eliminates irregular things like W and M.
+    # The prepared image isn't needed anymore, so it is dilated in place.
+    grid_region = image_utils.get_region_around(corners, GRID_REGION_MARGIN,
+                                                prepared_image)
+    with metrics.stage("dilate"):
+        morphed_image = image_utils.dilate(prepared_image,
+                                           save_path=save_path,
+                                           region=grid_region,
+                                           in_place=True)
+
+    # Establish a grid
+    with metrics.stage("grid"):
+        if options.perspective:
+            grid: grid_r.Grid = grid_r.RectifiedGrid(
+                corners,
+                grid_i.GRID_HORIZONTAL_CELLS,
+                grid_i.GRID_VERTICAL_CELLS,
+                morphed_image,
+                pixels_per_cell=options.pixels_per_cell,
+                save_path=save_path)
+        else:
+            grid = grid_r.Grid(corners,
+                               grid_i.GRID_HORIZONTAL_CELLS,
+                               grid_i.GRID_VERTICAL_CELLS,
+                               morphed_image,
+                               save_path=save_path)
+
+    # Calculate fill percent for every bubble
+    with metrics.stage("fill_percents"):
+        fill_percents = grid.get_fill_percents(form_variant.compile().cells)
+
+    # Calculate the fill threshold
+    with metrics.stage("fill_threshold"):
+        threshold = grid_r.calculate_fill_threshold(fill_percents,
+                                                    save_path=save_path)
+
+    return SheetMeasurements(corners, fill_percents, threshold)
+
+
+def read_measurements(measurements: SheetMeasurements,
+                      image_name: str,
+                      image_type: str,
+                      form_variant: grid_i.FormVariant,
+                      page_hash: tp.Optional[str] = None) -> SheetResult:
+    """Read every field and answer from the measurements of a page."""
+    if measurements.rejected:
+        return SheetResult(image_name,
+                           image_type,
+                           {grid_i.Field.IMAGE_FILE: image_name}, [],
+                           rejected=True,
+                           page_hash=page_hash)
+
+    # Get the fields and the answers for questions
+    field_values, answers = grid_r.read_fill_percents(
+        form_variant.compile(), measurements.fill_percents,
+        measurements.threshold)
+    fields: tp.Dict[grid_i.RealOrVirtualField, str] = {
+        grid_i.Field.IMAGE_FILE: image_name,
+        **field_values
+    }
+
+    return SheetResult(image_name,
+                       image_type,
+                       fields,
+                       answers,
+                       measurements.threshold,
+                       page_hash=page_hash,
+                       fill_percents=measurements.fill_percents)
+
+
+def _get_cache_key(page_hash: str, form_variant: grid_i.FormVariant,
+                   options: RecognitionOptions) -> str:
+    return result_cache.make_key(page_hash, form_variant.compile().fingerprint,
+                                 ALGORITHM_VERSION, sorted(vars(options).items()))
+
+
+def _get_cache_alias(page_ref: image_utils.PageRef,
+                     form_variant: grid_i.FormVariant,
+                     options: RecognitionOptions) -> tp.Optional[str]:
+    """A cache key for a page that can be computed without decoding it: it
+    identifies the file by its path, size and modification time."""
+    try:
+        stat = os.stat(page_ref.path)
+    except OSError:
+        return None
+    return result_cache.make_key(str(pathlib.Path(page_ref.path).resolve()),
+                                 stat.st_size, stat.st_mtime_ns, page_ref.index,
+                                 sorted(vars(page_ref.options).items()),
+                                 form_variant.compile().fingerprint,
+                                 ALGORITHM_VERSION, sorted(vars(options).items()))
+
+
+def _measure_with_cache(image: np.ndarray,
+                        page_hash: str,
+                        form_variant: grid_i.FormVariant,
+                        save_path: tp.Optional[pathlib.PurePath],
+                        options: RecognitionOptions,
+                        buffers: tp.Optional[image_utils.BufferPool],
+                        cache: result_cache.ResultCache) -> SheetMeasurements:
+    """Measure a page, reusing cached measurements if there are any."""
+    key = _get_cache_key(page_hash, form_variant, options)
+    # In debug mode, pages are always measured so the debug data is saved.
+    cached = cache.get(key) if save_path is None else None
+    if cached is not None:
+        metrics.count("cache_hits")
+        return SheetMeasurements.from_arrays(cached)
+    measurements = measure_sheet(image, form_variant, save_path, options,
+                                 buffers)
+    # The page hash is stored too, so a page found through an alias can be
+    # told apart from other pages without decoding it.
+    cache.put(key, {**measurements.to_arrays(), "page_hash": np.array(page_hash)})
+    return measurements
+
+
+def _make_skipped_result(image_name: str, image_type: str,
+                         page_hash: str) -> SheetResult:
+    return SheetResult(image_name,
+                       image_type, {grid_i.Field.IMAGE_FILE: image_name}, [],
+                       page_hash=page_hash,
+                       skipped=True)
+
+
+def recognize_sheet(image: np.ndarray,
+                    image_name: str,
+                    image_type: str,
+                    form_variant: grid_i.FormVariant,
+                    save_path: tp.Optional[pathlib.PurePath] = None,
+                    options: tp.Optional[RecognitionOptions] = None,
+                    buffers: tp.Optional[image_utils.BufferPool] = None,
+                    cache: tp.Optional[result_cache.ResultCache] = None,
+                    known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None
+                    ) -> SheetResult:
+    """Find the grid on a scanned page and read every field and answer on it.
+
+    If `save_path` is provided, debugging data for every step is saved to this
+    location. If `cache` is provided, the measurements of pages that were
+    already processed are reused. Pages whose hash is in `known_page_hashes`
+    aren't recognized at all; a skipped result is returned for them. Pages are
+    only hashed if either of them is given, even if `known_page_hashes` is
+    empty, so the hashes can be recorded for later runs.
+    """
+    start_time = time.perf_counter()
+    options = options or RecognitionOptions()
+    page_hash = None
+    if cache is not None or known_page_hashes is not None:
+        with metrics.stage("hash_page"):
+            page_hash = result_cache.hash_image(image)
+    if known_page_hashes is not None and page_hash in known_page_hashes:
+        result = _make_skipped_result(image_name, image_type, page_hash)
+    else:
+        if cache is None:
+            measurements = measure_sheet(image, form_variant, save_path,
+                                         options, buffers)
+        else:
+            measurements = _measure_with_cache(image, page_hash, form_variant,
+                                               save_path, options, buffers,
+                                               cache)
+        result = read_measurements(measurements, image_name, image_type,
+                                   form_variant, page_hash)
+    result.elapsed_ms = (time.perf_counter() - start_time) * 1000
+    return result
+
+
+def find_cached_result(page_ref: image_utils.PageRef,
+                       form_variant: grid_i.FormVariant,
+                       options: tp.Optional[RecognitionOptions] = None,
+                       cache: tp.Optional[result_cache.ResultCache] = None,
+                       known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None
+                       ) -> tp.Optional[SheetResult]:
+    """Get the result of a page from an unchanged file from the cache, without
+    decoding the page. Returns `None` if it isn't cached."""
+    if cache is None:
+        return None
+    options = options or RecognitionOptions()
+    alias = _get_cache_alias(page_ref, form_variant, options)
+    if alias is None:
+        return None
+    key = cache.get_alias(alias)
+    cached = cache.get(key) if key is not None else None
+    if cached is None or "page_hash" not in cached:
+        return None
+    metrics.count("cache_hits")
+    page_hash = str(cached["page_hash"])
+    if known_page_hashes is not None and page_hash in known_page_hashes:
+        return _make_skipped_result(page_ref.name, page_ref.type, page_hash)
+    return read_measurements(SheetMeasurements.from_arrays(cached),
+                             page_ref.name, page_ref.type, form_variant,
+                             page_hash)
+
+
+def _get_save_path(debug_dir: tp.Optional[pathlib.PurePath],
+                   image_name: str) -> tp.Optional[pathlib.PurePath]:
+    """The folder debug data of a page is saved to, created if needed."""
+    if debug_dir is None:
+        return None
+    save_path = debug_dir / image_name
+    data_exporting.make_dir_if_not_exists(save_path)
+    return save_path
+
+
+def recognize_page_ref(page_ref: image_utils.PageRef,
+                       form_variant: grid_i.FormVariant,
+                       debug_dir: tp.Optional[pathlib.PurePath] = None,
+                       options: tp.Optional[RecognitionOptions] = None,
+                       buffers: tp.Optional[image_utils.BufferPool] = None,
+                       cache: tp.Optional[result_cache.ResultCache] = None,
+                       known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None,
+                       image: tp.Optional[np.ndarray] = None
+                       ) -> SheetResult:
+    """Decode the referenced page and recognize it. Meant to be run in a worker
+    process, so only the page reference crosses the process boundary.
+
+    With a `cache`, a page from an unchanged file is found in it without even
+    decoding the page. If the page was already decoded into `image`, the
+    caller is expected to have looked it up with `find_cached_result`
+    first."""
+    options = options or RecognitionOptions()
+    save_path = _get_save_path(debug_dir, page_ref.name)
+    if cache is None:
+        return recognize_sheet(page_ref.load() if image is None else image,
+                               page_ref.name, page_ref.type, form_variant,
+                               save_path, options, buffers,
+                               known_page_hashes=known_page_hashes)
+
+    if image is None and save_path is None:
+        cached_result = find_cached_result(page_ref, form_variant, options,
+                                           cache, known_page_hashes)
+        if cached_result is not None:
+            return cached_result
+    result = recognize_sheet(page_ref.load() if image is None else image,
+                             page_ref.name, page_ref.type, form_variant,
+                             save_path, options, buffers, cache,
+                             known_page_hashes)
+    alias = _get_cache_alias(page_ref, form_variant, options)
+    if alias is not None and not result.skipped:
+        cache.put_alias(alias, _get_cache_key(result.page_hash, form_variant,
+                                              options))
+    return result
+
+
+def _decode_page_refs(
+    page_refs: tp.Iterable[image_utils.PageRef],
+    form_variant: grid_i.FormVariant,
+    options: tp.Optional[RecognitionOptions],
+    cache: tp.Optional[result_cache.ResultCache],
+    known_page_hashes: tp.Optional[tp.AbstractSet[str]]
+) -> tp.Iterator[tp.Tuple[image_utils.PageRef, tp.Optional[SheetResult],
+                          tp.Optional[np.ndarray],
+                          tp.Optional[metrics.Record]]]:
+    """The decoding stage: for every page, either its result if it's in the
+    cache, or the decoded page. Also yields the metrics of the work done, so
+    they can be counted towards the page in the thread that recognizes it.
+
+    Consecutive pages of a file that aren't in the cache are decoded together,
+    so PDF pages that have to be rasterized take one call to poppler per batch
+    rather than one per page. The time to decode a batch is counted towards its
+    first page."""
+    misses: tp.List[image_utils.PageRef] = []
+
+    def decode_misses() -> tp.Iterator[tp.Tuple[image_utils.PageRef, None,
+                                                 np.ndarray,
+                                                 tp.Optional[metrics.Record]]]:
+        images = image_utils.load_page_refs(misses)
+        for page_ref, image in zip(misses, images):
+            yield page_ref, None, image, metrics.take_record()
+        misses.clear()
+
+    for page_ref in page_refs:
+        if misses and (page_ref.path != misses[0].path
+                       or len(misses) >= image_utils.get_pdf_batch_size(
+                           misses[0].options)):
+            yield from decode_misses()
+        result = find_cached_result(page_ref, form_variant, options, cache,
+                                    known_page_hashes)
+        if result is None:
+            misses.append(page_ref)
+            # Only PDF pages are cheaper to decode together.
+            if page_ref.type.lower() != "pdf":
+                yield from decode_misses()
+            continue
+        lookup_record = metrics.take_record()
+        if misses:
+            yield from decode_misses()
+        yield page_ref, result, None, lookup_record
+    if misses:
+        yield from decode_misses()
+
+
+def _recognize_image(image_name: str,
+                     image: np.ndarray,
+                     form_variant: grid_i.FormVariant,
+                     debug_dir: tp.Optional[pathlib.PurePath] = None,
+                     options: tp.Optional[RecognitionOptions] = None,
+                     buffers: tp.Optional[image_utils.BufferPool] = None,
+                     cache: tp.Optional[result_cache.ResultCache] = None,
+                     known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None
+                     ) -> SheetResult:
+    """Recognize a named page that is already in memory."""
+    return recognize_sheet(image, image_name, "", form_variant,
+                           _get_save_path(debug_dir, image_name), options,
+                           buffers, cache, known_page_hashes)
+
+
+def _take_metrics(result: SheetResult) -> SheetResult:
+    """Attach the metrics collected since the last page to `result`."""
+    result.metrics_record = metrics.take_record()
+    return result
+
+
+# Settings shared by every page recognized in a worker process. Set once per
+# process by `init_worker` so they aren't pickled along with every page.
+_worker_settings: tp.Optional[tp.Tuple[grid_i.FormVariant,
+                                       tp.Optional[pathlib.PurePath],
+                                       tp.Optional[RecognitionOptions],
+                                       image_utils.BufferPool,
+                                       tp.Optional[result_cache.ResultCache],
+                                       tp.Optional[tp.AbstractSet[str]]]] = None
+
+
+def init_worker(form_variant: grid_i.FormVariant,
+                debug_dir: tp.Optional[pathlib.PurePath] = None,
+                options: tp.Optional[RecognitionOptions] = None,
+                cache: tp.Optional[result_cache.ResultCache] = None,
+                known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None,
+                collect_metrics: bool = False):
+    """Initializer for worker processes. Compile the form variant before
+    passing it here so the compiled layout is shared rather than rebuilt."""
+    global _worker_settings
+    if collect_metrics:
+        metrics.enable()
+    _worker_settings = (form_variant, debug_dir, options,
+                        image_utils.BufferPool(), cache, known_page_hashes)
+
+
+def recognize_page_ref_in_worker(page_ref: image_utils.PageRef) -> SheetResult:
+    """Recognize a page using the settings given to `init_worker`."""
+    if _worker_settings is None:
+        raise RuntimeError("Worker process was not initialized.")
+    (form_variant, debug_dir, options, buffers, cache,
+     known_page_hashes) = _worker_settings
+    return _take_metrics(recognize_page_ref(page_ref, form_variant, debug_dir,
+                                            options, buffers, cache,
+                                            known_page_hashes))
+
+
+def recognize_image_in_worker(page: tp.Tuple[str, np.ndarray]) -> SheetResult:
+    """Recognize a named in-memory page using the settings given to
+    `init_worker`."""
+    if _worker_settings is None:
+        raise RuntimeError("Worker process was not initialized.")
+    (form_variant, debug_dir, options, buffers, cache,
+     known_page_hashes) = _worker_settings
+    image_name, image = page
+    return _take_metrics(_recognize_image(image_name, image, form_variant,
+                                          debug_dir, options, buffers, cache,
+                                          known_page_hashes))
+
+
+def create_worker_pool(
+        workers: int,
+        form_variant: grid_i.FormVariant,
+        debug_dir: tp.Optional[pathlib.PurePath] = None,
+        options: tp.Optional[RecognitionOptions] = None,
+        cache: tp.Optional[result_cache.ResultCache] = None,
+        known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None
+) -> concurrent.futures.ProcessPoolExecutor:
+    """A pool of worker processes that recognize pages with these settings.
+    It can be given to any number of `SheetRecognizer`s with the same
+    settings, so the workers are only started once."""
+    # Compiling first means the workers receive the compiled layout instead of
+    # each building their own.
+    form_variant.compile()
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(form_variant, debug_dir, options, cache, known_page_hashes,
+                  metrics.is_enabled()))
+
+
+def _name_pages(images: tp.Iterable[np.ndarray],
+                names: tp.Optional[tp.Iterable[str]]
+                ) -> tp.Iterator[tp.Tuple[str, np.ndarray]]:
+    if names is None:
+        names = (f"page_{i}" for i in itertools.count(1))
+    return zip(names, images)
+
+
+class SheetRecognizer():
+    """Recognizes batches of pages that share one setup: the form variant is
+    compiled and the image buffers and worker processes are created once, then
+    reused by every batch.
+
+    Pages already in memory are recognized with `recognize`, and pages of
+    image files with `recognize_files`. Close the recognizer (or use it as a
+    context manager) to stop its worker processes.
+
+    Members:
+        form_variant: Layout of the sheets to recognize.
+        options: Settings that control how sheets are recognized.
+        workers: Number of worker processes to recognize pages in. With at most
+            1, pages are recognized in the calling thread.
+        debug_dir: If given, debugging data for every page is saved to a
+            folder in it named after the page.
+        cache: If given, measurements of pages that were measured before are
+            reused from it, and new measurements are added to it.
+        known_page_hashes: Hashes of pages processed in earlier runs. These
+            pages aren't recognized; skipped results are yielded for them.
+    """
+    form_variant: grid_i.FormVariant
+    options: RecognitionOptions
+    workers: int
+    debug_dir: tp.Optional[pathlib.PurePath]
+    cache: tp.Optional[result_cache.ResultCache]
+    known_page_hashes: tp.Optional[tp.AbstractSet[str]]
+    _buffers: image_utils.BufferPool
+    _executor: tp.Optional[concurrent.futures.Executor]
+    _owns_executor: bool
+
+    def __init__(self,
+                 form_variant: grid_i.FormVariant,
+                 options: tp.Optional[RecognitionOptions] = None,
+                 workers: int = 1,
+                 debug_dir: tp.Optional[pathlib.PurePath] = None,
+                 cache: tp.Optional[result_cache.ResultCache] = None,
+                 known_page_hashes: tp.Optional[tp.AbstractSet[str]] = None,
+                 executor: tp.Optional[concurrent.futures.Executor] = None):
+        """If an `executor` from `create_worker_pool` is given, pages are
+        recognized in it rather than in a new pool, and it is left running on
+        close. It must have been created with the same settings."""
+        self.form_variant = form_variant
+        self.options = options or RecognitionOptions()
+        self.workers = workers
+        self.debug_dir = debug_dir
+        self.cache = cache
+        self.known_page_hashes = known_page_hashes
+        self._buffers = image_utils.BufferPool()
+        self._executor = executor
+        self._owns_executor = executor is None
+        form_variant.compile()
+
+    def __enter__(self) -> "SheetRecognizer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            self._executor = create_worker_pool(self.workers, self.form_variant,
+                                                self.debug_dir, self.options,
+                                                self.cache,
+                                                self.known_page_hashes)
+        return self._executor
+
+    def recognize(self,
+                  images: tp.Iterable[np.ndarray],
+                  names: tp.Optional[tp.Iterable[str]] = None
+                  ) -> tp.Iterator[SheetResult]:
+        """Recognize a batch of pages, yielding their results in order.
+
+        `images` are decoded pages, as `cv2.imread` returns them, and can be
+        produced lazily: the next pages are taken from it while the current
+        one is recognized. Results are named after `names` if given, and
+        `page_1`, `page_2`, ... otherwise. Pages that can't be read as a
+        bubble sheet are yielded as rejected results, not raised.
+        """
+        pages = _name_pages(images, names)
+        if self.workers > 1:
+            yield from pipelining.map_ordered(self._get_executor(),
+                                              recognize_image_in_worker,
+                                              pages, 2 * self.workers)
+            return
+        for image_name, image in pipelining.prefetch(pages):
+            yield _take_metrics(_recognize_image(image_name, image,
+                                                 self.form_variant,
+                                                 self.debug_dir, self.options,
+                                                 self._buffers, self.cache,
+                                                 self.known_page_hashes))
+
+    def recognize_files(self,
+                        image_paths: tp.List[pathlib.PurePath],
+                        decode_options: tp.Optional[image_utils.DecodeOptions] = None,
+                        page_profiler: tp.Optional[profiling.PageProfiler] = None
+                        ) -> tp.Iterator[SheetResult]:
+        """Recognize every page of the given multi-page images, yielding
+        results in page order.
+
+        Decoding and recognition run as a pipeline with the caller's handling
+        of the results. In this process, pages are decoded in a background
+        thread that stays at most `pipelining.DEFAULT_QUEUE_DEPTH` pages ahead
+        of recognition. In worker processes, only page references are sent to
+        the workers, which decode the pages themselves, and only the small
+        `SheetResult` objects are sent back; at most two pages per worker are
+        in flight at once. With a cache, pages from unchanged files are found
+        in it without being decoded.
+
+        With a `page_profiler`, every page is decoded and recognized under it
+        in this process, one after the other, regardless of `workers`.
+        """
+        page_refs = image_utils.iter_page_refs(image_paths, decode_options)
+        if page_profiler is not None:
+            for page_ref in page_refs:
+                with page_profiler.profile(page_ref.name):
+                    result = recognize_page_ref(page_ref, self.form_variant,
+                                                self.debug_dir, self.options,
+                                                self._buffers, self.cache,
+                                                self.known_page_hashes)
+                yield _take_metrics(result)
+            return
+        if self.workers > 1:
+            yield from pipelining.map_ordered(self._get_executor(),
+                                              recognize_page_ref_in_worker,
+                                              page_refs, 2 * self.workers)
+            return
+        # Debug output is always recomputed, so the cache isn't looked at.
+        for page_ref, result, image, decode_record in pipelining.prefetch(
+                _decode_page_refs(page_refs, self.form_variant, self.options,
+                                  self.cache if self.debug_dir is None else None,
+                                  self.known_page_hashes)):
+            metrics.merge(decode_record)
+            if result is None:
+                result = recognize_page_ref(page_ref, self.form_variant,
+                                            self.debug_dir, self.options,
+                                            self._buffers, self.cache,
+                                            self.known_page_hashes, image)
+            yield _take_metrics(result)
+
+    def close(self):
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown()
+        self._executor = None
+
+
+def recognize_pages(images: tp.Iterable[np.ndarray],
+                    form_variant: grid_i.FormVariant,
+                    options: tp.Optional[RecognitionOptions] = None,
+                    names: tp.Optional[tp.Iterable[str]] = None,
+                    workers: int = 1) -> tp.Iterator[SheetResult]:
+    """Recognize pages that are already in memory, yielding their results in
+    order. See `SheetRecognizer.recognize`, which this runs for a single
+    batch."""
+    with SheetRecognizer(form_variant, options, workers) as recognizer:
+        yield from recognizer.recognize(images, names)
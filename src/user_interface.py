@@ -1,20 +1,30 @@
 import abc
+import os
+import queue
 import string
 from pathlib import Path
 import subprocess
 import sys
+import threading
+import time
 import tkinter as tk
+import traceback
 from tkinter import filedialog, ttk
 import typing as tp
 import platform
 
 import file_handling
+import grid_info as grid_i
+import image_utils
 import scoring
 import str_utils
 
 YPADDING = 4
 XPADDING = 7
 APP_NAME = "Kei Open-MCR"
+# The first option is the default. 150 DPI is faster, but rejects some pages
+# (see `grid_info.MIN_RELIABLE_DPI`), so choosing it shows a warning.
+PDF_DPI_OPTIONS = [image_utils.DEFAULT_PDF_DPI, 300, 150]
 
 PackTarget = tp.Union[tk.Tk, tk.Frame]
 
@@ -38,6 +48,17 @@ def prompt_file(message: str = "Select File",
         return Path(filepath)
 
 
+def prompt_files(message: str = "Select Files",
+                 default: str = "./",
+                 filetypes: tp.Optional[tp.List[tp.Tuple[str, str]]] = None
+                 ) -> tp.List[Path]:
+    """Prompt the user to select one or more files."""
+    filepaths = filedialog.askopenfilenames(initialdir=default,
+                                            title=message,
+                                            filetypes=filetypes)
+    return [Path(filepath) for filepath in filepaths or []]
+
+
 T = tp.TypeVar("T", bound=tk.Widget)
 
 
@@ -249,35 +270,87 @@ class SelectWidget():
 
 
 class InputFilePickerWidget():
-    file: tp.Optional[Path]
-    all_files: bool
+    """Picker for the input: any number of image files, chosen directly or
+    by choosing the folder they're in."""
+    files: tp.List[Path]
 
     def __init__(self,
                  parent: PackTarget,
                  on_change: tp.Optional[tp.Callable] = None):
         self.__on_change = on_change
+        internal_padding = int(XPADDING * 0.66)
+        pack_opts = {"side": tk.LEFT, "pady": XPADDING}
 
         container = tk.Frame(parent)
 
-        create_and_pack_label(container, "Multi-Page Image File", heading=True)
+        create_and_pack_label(container, "Multi-Page Image Files", heading=True)
         create_and_pack_label(
             container,
-            "Select the pdf or tiff file containing the multi-page image. Sheets with\na Student ID of '9999999999' will be treated as answer keys."
+            "Select the pdf or tiff files containing the multi-page images, or a folder\nof them. Sheets with a Student ID of '9999999999' will be treated as\nanswer keys."
         )
-        self.__image_file_picker = FilePickerWidget(
-            container, [("Image File", ".tif"), ("Image File", ".tiff"), ("Image File", ".pdf")], self.__on_update)
+
+        picker = tk.Frame(container)
+        self.__browse_files_button = pack(ttk.Button(picker,
+                                                     text="Browse Files",
+                                                     command=self.__prompt_files,
+                                                     padding=internal_padding),
+                                          **pack_opts,
+                                          padx=(XPADDING, 0))
+        self.__browse_folder_button = pack(ttk.Button(picker,
+                                                      text="Browse Folder",
+                                                      command=self.__prompt_folder,
+                                                      padding=internal_padding),
+                                           **pack_opts,
+                                           padx=(XPADDING, 0))
+        self.__display_text = tk.StringVar()
+        pack(ttk.Label(picker,
+                       textvariable=self.__display_text,
+                       width=29,
+                       justify=tk.LEFT,
+                       anchor="w",
+                       borderwidth=2,
+                       relief="groove",
+                       padding=internal_padding),
+             **pack_opts,
+             padx=XPADDING)
+        self.__display_text.set("No Files Selected")
+        pack(picker)
 
         pack(container, fill=tk.X)
 
-        self.file = None
+        self.files = []
+
+    def __prompt_files(self):
+        self.__on_select(prompt_files(
+            filetypes=[("Image File", ".tif"), ("Image File", ".tiff"), ("Image File", ".pdf")]))
+
+    def __prompt_folder(self):
+        folder = prompt_folder()
+        if folder is None or str(folder).strip() == ".":
+            return
+        try:
+            files = file_handling.expand_input_paths([folder])
+        except ValueError as e:
+            self.__display_text.set(str_utils.trim_middle_to_len(str(e), 32, 3))
+            files = []
+        self.__on_select(files, folder)
+
+    def __on_select(self, files: tp.List[Path], folder: tp.Optional[Path] = None):
+        self.files = files
+        if len(files) == 1:
+            self.__display_text.set(str_utils.trim_middle_to_len(str(files[0]), 32, 3))
+        elif files:
+            location = f" in {folder.name}" if folder is not None else ""
+            self.__display_text.set(f"{len(files)} files{location}")
+        elif folder is None:
+            self.__display_text.set("No Files Selected")
 
-    def __on_update(self, *args: tp.Any):
-        self.file = self.__image_file_picker.value
         if self.__on_change is not None:
             self.__on_change()
 
     def disable(self):
-        self.__image_file_picker.disable()
+        self.__browse_files_button.configure(state=tk.DISABLED)
+        self.__browse_folder_button.configure(state=tk.DISABLED)
 
 class OutputFolderPickerWidget():
     folder: tp.Optional[Path]
@@ -320,11 +393,39 @@ class OutputFolderPickerWidget():
         self.__sort_results_checkbox.disable()
 
 
+"""Milliseconds between the times the progress window applies the events
+posted by the background thread."""
+PROGRESS_POLL_INTERVAL_MS = 100
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
 class ProgressTrackerWidget:
+    """Progress of a batch that is processed in a background thread.
+
+    `step_progress`, `set_status` and `set_maximum` can be called from any
+    thread. They only post events to a queue, which the Tk main loop polls
+    with `after()`, so the window keeps responding however long a page takes.
+    Besides the current status, the window shows the throughput, the estimated
+    time left and the number of rejected pages, and has a Cancel button that
+    sets `cancel_event`.
+    """
+    cancel_event: threading.Event
+
     def __init__(self, parent: tk.Tk, maximum: int):
         self.maximum = maximum
         self.value = 0
+        self.rejected = 0
         self.parent = parent
+        self.cancel_event = threading.Event()
+        self.__events: "queue.Queue[tp.Tuple[str, tp.Any, tp.Any]]" = queue.Queue()
+        self.__start_time: tp.Optional[float] = None
         pack_opts = {
             "fill": tk.X,
             "expand": 1,
@@ -335,24 +436,100 @@ class ProgressTrackerWidget:
         pack(ttk.Label(parent, textvariable=self.status_text, width=45),
              **pack_opts)
         self.progress_bar = pack(
-            ttk.Progressbar(parent, maximum=maximum, mode="determinate"),
+            ttk.Progressbar(parent, maximum=max(maximum, 1), mode="determinate"),
             **pack_opts)
+        self.statistics_text = tk.StringVar(parent)
+        pack(ttk.Label(parent, textvariable=self.statistics_text, width=45),
+             **pack_opts)
+        self.cancel_button = pack(ttk.Button(parent,
+                                             text="Cancel",
+                                             command=self.cancel),
+                                  padx=XPADDING,
+                                  pady=YPADDING)
         self.close_when_changes = tk.IntVar(parent, name="Ready to Close")
+        self.__finished = tk.IntVar(parent, name="Processing Finished")
 
-    def step_progress(self, step: int = 1):
-        self.value += step
-        self.progress_bar.step(step)
-        self.parent.update()
-        self.parent.update_idletasks()
+    def step_progress(self, step: int = 1, rejected: bool = False):
+        self.__events.put(("step", step, rejected))
 
     def set_status(self, status: str, show_count: bool = True):
-        new_status = f"{status} ({self.value + 1}/{self.maximum})" if show_count else status
-        self.status_text.set(new_status)
+        self.__events.put(("status", status, show_count))
+
+    def set_maximum(self, maximum: int):
+        self.__events.put(("maximum", maximum, None))
+
+    def cancel(self):
+        """Ask the batch to stop after the page it's on."""
+        self.cancel_event.set()
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.status_text.set("Cancelling...")
+
+    def __apply(self, kind: str, value: tp.Any, option: tp.Any):
+        if kind == "step":
+            if self.__start_time is None:
+                self.__start_time = time.perf_counter()
+            self.value += value
+            self.rejected += int(option)
+            # Stepping the bar would wrap it around once it's full.
+            self.progress_bar.configure(value=self.value)
+            self.__update_statistics()
+        elif kind == "status":
+            if not self.cancel_event.is_set() or not option:
+                new_status = f"{value} ({self.value + 1}/{self.maximum})" if option else value
+                self.status_text.set(new_status)
+        elif kind == "maximum":
+            self.maximum = value
+            self.progress_bar.configure(maximum=max(value, 1))
+
+    def __update_statistics(self):
+        statistics = []
+        elapsed = time.perf_counter() - self.__start_time
+        # The clock starts at the first page, so it counts the pages after it.
+        if self.value > 1 and elapsed > 0:
+            pages_per_second = (self.value - 1) / elapsed
+            statistics.append(f"{pages_per_second:.1f} pages/s")
+            remaining = self.maximum - self.value
+            if remaining > 0:
+                statistics.append(f"about {format_duration(remaining / pages_per_second)} left")
+        if self.rejected:
+            statistics.append(f"{self.rejected} rejected")
+        self.statistics_text.set("  •  ".join(statistics))
+
+    def __poll(self, worker: threading.Thread):
+        # Checked first, so that nothing the worker posted before it finished
+        # is left in the queue.
+        alive = worker.is_alive()
+        while True:
+            try:
+                self.__apply(*self.__events.get_nowait())
+            except queue.Empty:
+                break
+        if alive:
+            self.parent.after(PROGRESS_POLL_INTERVAL_MS, self.__poll, worker)
+        else:
+            self.__finished.set(1)
+
+    def run_in_background(self, work: tp.Callable[[], None]):
+        """Run `work` in a background thread and keep the window updated and
+        responsive until it returns. Closing the window cancels the work."""
+        def run():
+            try:
+                work()
+            except Exception as e:
+                traceback.print_exc()
+                self.set_status(f"Error: {e}", False)
+
+        worker = threading.Thread(target=run, daemon=True)
+        self.parent.protocol("WM_DELETE_WINDOW", self.cancel)
+        worker.start()
+        self.__poll(worker)
+        self.parent.wait_variable("Processing Finished")
 
     def set_ready_to_close(self):
         self.close_when_changes.set(1)
 
     def show_exit_button_and_wait(self):
+        self.cancel_button.pack_forget()
         self.parent.protocol("WM_DELETE_WINDOW", self.set_ready_to_close)        
         close_button = ttk.Button(self.parent,
                                   text="Close",
@@ -364,9 +541,14 @@ class ProgressTrackerWidget:
 class MainWindow:
     root: tk.Tk
     test_identifier: str
-    multi_page_image_file: Path
+    input_files: tp.List[Path]
     output_folder: Path
     sort_results: bool
+    workers: int = 1
+    pdf_dpi: int = image_utils.DEFAULT_PDF_DPI
+    pdf_threads: int = 1
+    use_pdftocairo: bool = False
+    use_cache: bool = False
     debug_mode: bool = False
     cancelled: bool = False
 
@@ -387,12 +569,34 @@ class MainWindow:
 
         self.__test_identifier_widget = TestIdentifierWidget(app)       
 
-        self.__multi_page_image_file_picker = InputFilePickerWidget(
+        self.__input_files_picker = InputFilePickerWidget(
             app, self.__on_update)
 
         self.__output_folder_picker = OutputFolderPickerWidget(
             app, self.__on_update)
 
+        self.__workers_select = SelectWidget(
+            app, "Worker Processes",
+            [str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+            self.__on_update)
+
+        self.__pdf_dpi_select = SelectWidget(
+            app, "PDF Resolution (DPI)",
+            [str(dpi) for dpi in PDF_DPI_OPTIONS],
+            self.__on_update)
+
+        self.__pdf_threads_select = SelectWidget(
+            app, "PDF Rasterizing Threads",
+            [str(n) for n in range(1, (os.cpu_count() or 1) + 1)],
+            self.__on_update)
+
+        self.__use_pdftocairo_checkbox = CheckboxWidget(
+            app, "Rasterize PDFs with pdftocairo", self.__on_update)
+
+        self.__use_cache_checkbox = CheckboxWidget(
+            app, "Cache page measurements to re-run the same scans faster",
+            self.__on_update)
+
         self.__status_text = tk.StringVar()
         status = tk.Label(app, textvariable=self.__status_text)
         status.pack(fill=tk.X, expand=1, pady=(YPADDING * 2, 0))
@@ -437,14 +641,17 @@ class MainWindow:
 
         self.test_identifier = self.__test_identifier_widget.get()
 
-        multi_page_image_file = self.__multi_page_image_file_picker.file
+        input_files = self.__input_files_picker.files
 
-        if multi_page_image_file is None:
-            new_status += "❌ Input file is required.\n"
+        if not input_files:
+            new_status += "❌ Input files are required.\n"
             ok_to_submit = False
         else:
-            self.multi_page_image_file = multi_page_image_file
-            new_status += f"✔ Image file selected.\n"
+            self.input_files = input_files
+            if len(input_files) == 1:
+                new_status += f"✔ Image file selected.\n"
+            else:
+                new_status += f"✔ {len(input_files)} image files selected.\n"
             ok_to_submit = True
 
         new_status += "Using 75-question form.\n"
@@ -463,6 +670,27 @@ class MainWindow:
         else:
             new_status += f"Input sort order will be maintained.\n"
 
+        try:
+            self.workers = max(1, int(self.__workers_select.value))
+        except ValueError:
+            self.workers = 1
+        if self.workers > 1:
+            new_status += f"Pages will be processed by {self.workers} workers.\n"
+
+        try:
+            self.pdf_dpi = max(1, int(self.__pdf_dpi_select.value))
+        except ValueError:
+            self.pdf_dpi = image_utils.DEFAULT_PDF_DPI
+        if self.pdf_dpi < grid_i.MIN_RELIABLE_DPI:
+            new_status += (f"⚠️ Some pages may be rejected below {grid_i.MIN_RELIABLE_DPI} DPI, "
+                           "since their corner marks can't be found.\n")
+        try:
+            self.pdf_threads = max(1, int(self.__pdf_threads_select.value))
+        except ValueError:
+            self.pdf_threads = 1
+        self.use_pdftocairo = self.__use_pdftocairo_checkbox.value
+        self.use_cache = self.__use_cache_checkbox.value
+
         self.__status_text.set(new_status)
         if ok_to_submit:
             self.__confirm_button.configure(state=tk.NORMAL)
@@ -471,8 +699,13 @@ class MainWindow:
     def __disable_all(self):
         self.__test_identifier_widget.disable()
         self.__confirm_button.configure(state=tk.DISABLED)
-        self.__multi_page_image_file_picker.disable()
+        self.__input_files_picker.disable()
         self.__output_folder_picker.disable()
+        self.__workers_select.disable()
+        self.__pdf_dpi_select.disable()
+        self.__pdf_threads_select.disable()
+        self.__use_pdftocairo_checkbox.disable()
+        self.__use_cache_checkbox.disable()
 
     def __confirm(self):
         if self.__on_update():
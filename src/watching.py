@@ -0,0 +1,174 @@
+"""Watching a folder for new scans and processing each one as it arrives.
+
+The folder is polled, which works the same on every platform and on network
+shares, without any service or extra dependency. A file is only taken once
+its size and modification time haven't changed between two polls, so a scan
+that is still being copied in is left alone until it's complete.
+
+Every file is processed as a batch of its own, into an output folder named
+after it, and then moved to the archive folder, or to the failed folder if it
+couldn't be processed. The watching process and its worker pool stay up
+between files, so imports, the compiled form and the workers are only set up
+once rather than for every scan. A pool whose workers crashed is replaced.
+"""
+
+import concurrent.futures
+import pathlib
+import shutil
+import threading
+import traceback
+import typing as tp
+
+from file_handling import is_image, list_file_paths
+
+"""Seconds between two polls of the watched folder. A new file is processed
+one to two intervals after it stops changing."""
+DEFAULT_POLL_INTERVAL = 2.0
+
+"""Name of the folder in the watched folder that processed files are moved to,
+unless another one is given. Only the files directly in the watched folder are
+watched, so this folder isn't."""
+ARCHIVE_FOLDER_NAME = "archive"
+
+"""Name of the folder in the watched folder that files which couldn't be
+processed are moved to, unless another one is given. Moving them out of the way
+keeps a bad file from failing again every time the folder is watched."""
+FAILED_FOLDER_NAME = "failed"
+
+
+class StableFileFinder():
+    """Finds the images in a folder that stopped changing since the previous
+    poll. Each file is only found once, unless it changes again.
+
+    Members:
+        folder: The folder to look for images in, not including its
+            subfolders.
+    """
+    folder: pathlib.Path
+    # Size and modification time of every file seen at the previous poll.
+    _last_seen: tp.Dict[pathlib.Path, tp.Tuple[int, int]]
+    # Size and modification time of every file found so far.
+    _found: tp.Dict[pathlib.Path, tp.Tuple[int, int]]
+
+    def __init__(self, folder: pathlib.Path):
+        self.folder = folder
+        self._last_seen = {}
+        self._found = {}
+
+    def poll(self) -> tp.List[pathlib.Path]:
+        """Get the images that haven't changed since the previous poll and
+        weren't found before, sorted by name."""
+        seen: tp.Dict[pathlib.Path, tp.Tuple[int, int]] = {}
+        for path in list_file_paths(self.folder):
+            if not is_image(path):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                # Removed since the folder was listed.
+                continue
+            seen[path] = (stat.st_size, stat.st_mtime_ns)
+
+        stable = sorted(
+            path for path, signature in seen.items()
+            if signature[0] > 0 and self._last_seen.get(path) == signature
+            and self._found.get(path) != signature)
+        for path in stable:
+            self._found[path] = seen[path]
+        self._found = {
+            path: signature
+            for path, signature in self._found.items() if path in seen
+        }
+        self._last_seen = seen
+        return stable
+
+
+def get_unused_path(path: pathlib.Path) -> pathlib.Path:
+    """The path itself if nothing exists there, or else the path with the
+    first free number appended to its name, before the extension."""
+    number = 1
+    unused_path = path
+    while unused_path.exists():
+        number += 1
+        unused_path = path.with_name(f"{path.stem}_{number}{path.suffix}")
+    return unused_path
+
+
+def _move_file(path: pathlib.Path, folder: pathlib.Path) -> tp.Optional[pathlib.Path]:
+    """Move the file into the folder, under an unused name. Returns where it
+    was moved to, or `None` if it couldn't be moved."""
+    destination = get_unused_path(folder / path.name)
+    try:
+        shutil.move(str(path), str(destination))
+    except OSError as e:
+        print(f"Error: {path.name} could not be moved to {folder}: {e}")
+        return None
+    return destination
+
+
+def watch_folder(
+        watched_folder: pathlib.Path,
+        output_folder: pathlib.Path,
+        archive_folder: pathlib.Path,
+        failed_folder: pathlib.Path,
+        process_file: tp.Callable[
+            [pathlib.Path, pathlib.Path, tp.Optional[concurrent.futures.Executor]],
+            bool],
+        create_pool: tp.Optional[tp.Callable[[], concurrent.futures.Executor]] = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        stop_event: tp.Optional[threading.Event] = None):
+    """Process every image that is complete in `watched_folder`, and every one
+    that arrives later, until `stop_event` is set.
+
+    Every image is passed to `process_file` along with its own output folder
+    in `output_folder`, named after it, and the pool made by `create_pool`, if
+    given. `process_file` returns whether the image was processed. Images are
+    then moved to `archive_folder`, or to `failed_folder` if they weren't
+    processed or `process_file` raised an error. If the pool breaks, because a
+    worker process crashed, the image fails and a new pool is created for the
+    next one.
+
+    Numbers are appended to the names of output folders and moved files that
+    already exist, so a scan dropped twice doesn't overwrite anything.
+    """
+    stop_event = stop_event or threading.Event()
+    archive_folder.mkdir(parents=True, exist_ok=True)
+    failed_folder.mkdir(parents=True, exist_ok=True)
+    finder = StableFileFinder(watched_folder)
+    pool = create_pool() if create_pool is not None else None
+    print(f"Watching {watched_folder} for new scans...")
+    try:
+        while True:
+            for path in finder.poll():
+                if stop_event.is_set():
+                    return
+                file_output_folder = get_unused_path(output_folder / path.stem)
+                file_output_folder.mkdir(parents=True)
+                print(f"Processing {path.name} into {file_output_folder}")
+                try:
+                    succeeded = process_file(path, file_output_folder, pool)
+                except concurrent.futures.BrokenExecutor:
+                    print(f"Error: A worker process stopped while processing {path.name}. "
+                          "Starting new worker processes.")
+                    succeeded = False
+                    if pool is not None:
+                        pool.shutdown(wait=False)
+                    pool = create_pool() if create_pool is not None else None
+                except Exception:
+                    # One bad scan must not stop the watcher.
+                    traceback.print_exc()
+                    print(f"Error: {path.name} could not be processed.")
+                    succeeded = False
+                if succeeded:
+                    moved_path = _move_file(path, archive_folder)
+                    if moved_path is not None:
+                        print(f"Archived {path.name} to {moved_path}")
+                else:
+                    moved_path = _move_file(path, failed_folder)
+                    if moved_path is not None:
+                        print(f"Moved {path.name} to {moved_path}, since it could not be processed")
+            if stop_event.wait(poll_interval):
+                return
+    finally:
+        if pool is not None:
+            pool.shutdown()
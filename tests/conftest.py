@@ -0,0 +1,20 @@
+import pathlib
+import sys
+
+import pytest
+
+# The modules in src import each other as top-level modules, and the
+# benchmarks' synthetic sheets are used as test pages.
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import grid_info as grid_i  # noqa: E402
+import synthetic_sheets  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def synthetic_pages():
+    """An answer key and two students' sheets, as `(image, sheet)` pairs."""
+    return list(synthetic_sheets.iter_corpus(3, seed=7,
+                                             form_variant=grid_i.form_75q))
@@ -0,0 +1,192 @@
+"""Builds small PDFs for the tests, covering the ways scanners and other
+writers lay out files: cross-reference tables or streams, objects in object
+streams, and pages that are one Flate, DCT or CCITT image."""
+
+import io
+import typing as tp
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+
+class PdfBuilder():
+    """Collects numbered objects and writes them out as a PDF.
+
+    Objects are given as their PDF syntax, without the `obj`/`endobj`
+    wrapper. Objects listed as compressed are written into an object stream,
+    which needs a cross-reference stream.
+    """
+    objects: tp.Dict[int, tp.Tuple[bytes, tp.Optional[bytes]]]
+
+    def __init__(self):
+        self.objects = {}
+
+    def add(self, body: bytes, stream: tp.Optional[bytes] = None) -> int:
+        num = len(self.objects) + 1
+        self.objects[num] = (body, stream)
+        return num
+
+    def build(self, root: int, xref_stream: bool = False,
+              compressed: tp.Collection[int] = ()) -> bytes:
+        out = bytearray(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+        offsets: tp.Dict[int, int] = {}
+        for num, (body, stream) in self.objects.items():
+            if num in compressed:
+                continue
+            offsets[num] = len(out)
+            out += _write_object(num, body, stream)
+
+        size = len(self.objects) + 1
+        packed: tp.Dict[int, tp.Tuple[int, int]] = {}
+        if compressed:
+            assert xref_stream, "Object streams need a cross-reference stream."
+            stream_num = size
+            size += 1
+            header = b""
+            contents = b""
+            for index, num in enumerate(sorted(compressed)):
+                header += b"%d %d " % (num, len(contents))
+                contents += self.objects[num][0] + b"\n"
+                packed[num] = (stream_num, index)
+            data = zlib.compress(header + contents)
+            offsets[stream_num] = len(out)
+            out += _write_object(
+                stream_num,
+                b"<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode >>" %
+                (len(compressed), len(header)), data)
+
+        if not xref_stream:
+            xref_offset = len(out)
+            out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+            for num in range(1, size):
+                out += b"%010d 00000 n \n" % offsets[num]
+            out += b"trailer\n<< /Size %d /Root %d 0 R >>\n" % (size, root)
+        else:
+            xref_num = size
+            size += 1
+            xref_offset = len(out)
+            offsets[xref_num] = xref_offset
+            rows = b"\x00\x00\x00\x00\xff\xff"
+            for num in range(1, size):
+                if num in packed:
+                    rows += bytes([2]) + packed[num][0].to_bytes(4, "big") + \
+                        packed[num][1].to_bytes(1, "big")
+                else:
+                    rows += bytes([1]) + offsets[num].to_bytes(4, "big") + b"\x00"
+            out += _write_object(
+                xref_num,
+                b"<< /Type /XRef /Size %d /W [1 4 1] /Root %d 0 R "
+                b"/Filter /FlateDecode /DecodeParms << /Predictor 12 /Columns 6 >> >>" %
+                (size, root), _png_up_filter(rows, 6))
+        out += b"startxref\n%d\n%%%%EOF\n" % xref_offset
+        return bytes(out)
+
+
+def _write_object(num: int, body: bytes, stream: tp.Optional[bytes]) -> bytes:
+    if stream is None:
+        return b"%d 0 obj\n%s\nendobj\n" % (num, body)
+    assert body.endswith(b">>")
+    body = body[:-2] + b" /Length %d >>" % len(stream)
+    return b"%d 0 obj\n%s\nstream\n%s\nendstream\nendobj\n" % (num, body, stream)
+
+
+def _png_up_filter(data: bytes, columns: int) -> bytes:
+    """Compress rows with the PNG "up" predictor, as most writers do for
+    cross-reference streams."""
+    filtered = bytearray()
+    previous = bytes(columns)
+    for start in range(0, len(data), columns):
+        row = data[start:start + columns]
+        filtered += b"\x02" + bytes((a - b) & 0xFF for a, b in zip(row, previous))
+        previous = row
+    return zlib.compress(bytes(filtered))
+
+
+def make_pixels(width: int = 48, height: int = 64, seed: int = 0) -> np.ndarray:
+    """A grayscale test image that is different along both axes, so any
+    flip or transposition changes it."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    pixels[:height // 4, :width // 3] = 0
+    return pixels
+
+
+def make_bilevel_pixels(width: int = 64, height: int = 48) -> np.ndarray:
+    pixels = np.full((height, width), 255, np.uint8)
+    pixels[4:20, 8:40] = 0
+    pixels[30:, 50:] = 0
+    return pixels
+
+
+def flate_image(pixels: np.ndarray) -> tp.Tuple[bytes, bytes]:
+    height, width = pixels.shape
+    return (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode >>" %
+            (width, height), zlib.compress(pixels.tobytes()))
+
+
+def dct_image(pixels: np.ndarray) -> tp.Tuple[bytes, bytes]:
+    height, width = pixels.shape
+    _, jpeg = cv2.imencode(".jpg", pixels)
+    return (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode >>" %
+            (width, height), jpeg.tobytes())
+
+
+def ccitt_image(pixels: np.ndarray) -> tp.Tuple[bytes, bytes]:
+    """Group 4 encode a black and white image, as most scanners do for
+    bilevel pages."""
+    height, width = pixels.shape
+    # In the coded data, runs of 0 bits are white.
+    bitmap = Image.fromarray(pixels < 128)
+    buffer = io.BytesIO()
+    bitmap.save(buffer, "TIFF", compression="group4")
+    tiff = Image.open(io.BytesIO(buffer.getvalue()))
+    assert len(tiff.tag_v2[273]) == 1, "Expected a single strip."
+    offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+    data = buffer.getvalue()[offset:offset + length]
+    return (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode "
+            b"/DecodeParms << /K -1 /Columns %d /Rows %d >> >>" %
+            (width, height, width, height), data)
+
+
+def image_pages_pdf(images: tp.Sequence[tp.Tuple[bytes, bytes]],
+                    xref_stream: bool = False,
+                    compress_objects: bool = False,
+                    rotate: int = 0) -> bytes:
+    """A PDF with one page per image, each image filling its page."""
+    builder = PdfBuilder()
+    catalog = builder.add(b"")
+    pages = builder.add(b"")
+    page_nums = []
+    for image_dict, data in images:
+        image = builder.add(image_dict, data)
+        contents = builder.add(
+            b"<< >>", b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (PAGE_WIDTH, PAGE_HEIGHT))
+        page_nums.append(builder.add(
+            b"<< /Type /Page /Parent %d 0 R /Contents %d 0 R "
+            b"/Resources << /XObject << /Im0 %d 0 R >> >> >>" %
+            (pages, contents, image)))
+    builder.objects[catalog] = (b"<< /Type /Catalog /Pages %d 0 R >>" % pages, None)
+    kids = b" ".join(b"%d 0 R" % num for num in page_nums)
+    builder.objects[pages] = (
+        b"<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 %d %d] /Rotate %d >>" %
+        (kids, len(page_nums), PAGE_WIDTH, PAGE_HEIGHT, rotate), None)
+    compressed = [catalog, pages, *page_nums] if compress_objects else []
+    return builder.build(catalog, xref_stream, compressed)
+
+
+def vector_page_pdf() -> bytes:
+    """A PDF whose only page is drawn with vector graphics."""
+    builder = PdfBuilder()
+    catalog = builder.add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    builder.add(b"<< /Type /Pages /Kids [4 0 R] /Count 1 /MediaBox [0 0 612 792] >>")
+    contents = builder.add(b"<< >>", b"0 0 m 100 100 l S")
+    builder.add(b"<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>" % contents)
+    return builder.build(catalog)
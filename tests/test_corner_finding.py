@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import corner_finding
+import grid_info as grid_i
+import grid_reading as grid_r
+import image_utils
+
+# Searched at a fixed scale rather than the one `find_corner_marks` picks, so
+# a page whose downscaled search fails can't fall back to the full resolution
+# search and compare it with itself.
+COARSE_SCALE = 0.5
+
+
+@pytest.mark.parametrize("page", [0, 1, 2])
+def test_refined_corners_match_full_resolution_search(synthetic_pages, page):
+    image, sheet = synthetic_pages[page]
+    prepared = image_utils.prepare_scan_for_processing(image)
+
+    coarse = corner_finding._search_corner_marks(
+        image_utils.downscale(prepared, COARSE_SCALE), external_only=True)
+    refined = corner_finding._refine_corners(prepared, coarse, COARSE_SCALE)
+    reference = corner_finding._search_corner_marks(prepared)
+
+    # Marks are found as polygons of whole pixels, so even the full resolution
+    # corners are only accurate to a pixel or two.
+    distances = [np.hypot(a.x - b.x, a.y - b.y) for a, b in zip(refined, reference)]
+    assert max(distances) < 3
+
+    grid = grid_r.Grid(refined, grid_i.GRID_HORIZONTAL_CELLS,
+                       grid_i.GRID_VERTICAL_CELLS, image_utils.dilate(prepared))
+    compiled = grid_i.form_75q.compile()
+    fill_percents = grid.get_fill_percents(compiled.cells)
+    fields, answers = grid_r.read_fill_percents(
+        compiled, fill_percents, grid_r.calculate_fill_threshold(fill_percents))
+    assert answers == sheet.answers
+    assert fields == sheet.fields
@@ -0,0 +1,86 @@
+import numpy as np
+import numpy.ma as ma
+import cv2
+import pytest
+
+import corner_finding
+import grid_info as grid_i
+import grid_reading as grid_r
+import image_utils
+import sheet_recognition
+
+
+def _find_grid_image(image):
+    """The dilated page and its grid corners, as `measure_sheet` reads them."""
+    prepared = image_utils.prepare_scan_for_processing(image)
+    corners = corner_finding.find_corner_marks(prepared)
+    region = image_utils.get_region_around(
+        corners, sheet_recognition.GRID_REGION_MARGIN, prepared)
+    return image_utils.dilate(prepared, region=region), corners
+
+
+def _reference_fill_percents(grid, cells):
+    """Fill percents read as they were before reading was vectorized: a
+    masked array for every cell."""
+    fill_percents = []
+    for across, down in cells:
+        ((min_x, max_x), (min_y, max_y)) = grid.get_cell_range(across, down)
+        unmasked = grid.image[int(round(min_y)):int(round(max_y + 1)),
+                              int(round(min_x)):int(round(max_x + 1))]
+        mask = np.ones(unmasked.shape)
+        unit_dimension = sum(mask.shape) / 2
+        center = (round(mask.shape[0] / 2), round(mask.shape[1] / 2))
+        radius = (unit_dimension / 2) * (1 - (grid_r.GRID_CELL_CROP_FRACTION / 2))
+        cv2.circle(mask, center, int(radius), (0, 0, 0), -1)
+        fill_percents.append(
+            image_utils.get_fill_percent(ma.masked_array(unmasked, mask)))
+    return np.array(fill_percents)
+
+
+def _read(fill_percents):
+    compiled = grid_i.form_75q.compile()
+    return grid_r.read_fill_percents(
+        compiled, fill_percents, grid_r.calculate_fill_threshold(fill_percents))
+
+
+@pytest.mark.parametrize("page", [0, 1, 2])
+def test_fill_percents_match_masked_arrays(synthetic_pages, page):
+    image, sheet = synthetic_pages[page]
+    grid_image, corners = _find_grid_image(image)
+    grid = grid_r.Grid(corners, grid_i.GRID_HORIZONTAL_CELLS,
+                       grid_i.GRID_VERTICAL_CELLS, grid_image)
+    cells = grid_i.form_75q.compile().cells
+
+    fill_percents = grid.get_fill_percents(cells)
+    reference = _reference_fill_percents(grid, cells)
+    # The stencil is centered on the cell rather than on its bounding box and
+    # sampled slightly differently, so single cells can differ by a few
+    # percent at low resolutions, but what is read must be the same.
+    difference = np.abs(fill_percents - reference)
+    assert difference.mean() < 0.01 and difference.max() < 0.1
+    fields, answers = _read(fill_percents)
+    assert (fields, answers) == _read(reference)
+    assert answers == sheet.answers
+    assert fields == sheet.fields
+
+
+@pytest.mark.parametrize("page", [0, 1, 2])
+def test_rectified_grid_reads_like_masked_arrays(synthetic_pages, page):
+    image, sheet = synthetic_pages[page]
+    grid_image, corners = _find_grid_image(image)
+    grid = grid_r.Grid(corners, grid_i.GRID_HORIZONTAL_CELLS,
+                       grid_i.GRID_VERTICAL_CELLS, grid_image)
+    rectified = grid_r.RectifiedGrid(corners, grid_i.GRID_HORIZONTAL_CELLS,
+                                     grid_i.GRID_VERTICAL_CELLS, grid_image)
+    cells = grid_i.form_75q.compile().cells
+
+    fill_percents = rectified.get_fill_percents(cells)
+    reference = _reference_fill_percents(grid, cells)
+    # The warped raster is resampled, so cells differ more than when reading
+    # the scan directly.
+    difference = np.abs(fill_percents - reference)
+    assert difference.mean() < 0.02 and difference.max() < 0.1
+    fields, answers = _read(fill_percents)
+    assert (fields, answers) == _read(reference)
+    assert answers == sheet.answers
+    assert fields == sheet.fields
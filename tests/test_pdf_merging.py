@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from reportlab.pdfgen import canvas
+
+import pdf_merging
+from pdf_parsing import Name, PdfDocument, Ref, _Lexer
+from pdf_samples import (ccitt_image, dct_image, flate_image, image_pages_pdf,
+                         make_bilevel_pixels, make_pixels)
+
+
+def test_serialized_objects_read_back_the_same():
+    value = {
+        "Type": Name("Test"),
+        "Odd Name/#": Name("a b(c)"),
+        "Values": [1, -2, 2.5, 0.125, 3.0, True, False, None],
+        "String": b"\x00(unbalanced\\",
+        "Ref": Ref(7, 0),
+        "Nested": {"Empty": []}
+    }
+    serialized = pdf_merging._serialize(value, lambda ref: Ref(ref.num + 1, 0))
+    assert _Lexer(serialized).read_object() == {
+        **value, "Values": [1, -2, 2.5, 0.125, 3, True, False, None],
+        "Ref": Ref(8, 0)
+    }
+
+
+def test_merges_pages_in_order(tmp_path):
+    first, second = make_pixels(seed=1), make_pixels(seed=2)
+    bilevel = make_bilevel_pixels()
+    (tmp_path / "a.pdf").write_bytes(
+        image_pages_pdf([flate_image(first), ccitt_image(bilevel)]))
+    (tmp_path / "b.pdf").write_bytes(
+        image_pages_pdf([flate_image(second)], xref_stream=True,
+                        compress_objects=True))
+    pdf_merging.merge_pdfs([tmp_path / "a.pdf", tmp_path / "b.pdf"],
+                           tmp_path / "merged.pdf")
+
+    with PdfDocument.from_file(tmp_path / "merged.pdf") as merged:
+        assert len(merged.pages) == 3
+        np.testing.assert_array_equal(merged.extract_page_image(0), first)
+        np.testing.assert_array_equal(merged.extract_page_image(1), bilevel)
+        np.testing.assert_array_equal(merged.extract_page_image(2), second)
+
+
+def test_merged_file_has_valid_xref_table(tmp_path):
+    image_dict, jpeg = dct_image(make_pixels())
+    (tmp_path / "a.pdf").write_bytes(image_pages_pdf([(image_dict, jpeg)]))
+    pdf_merging.merge_pdfs([tmp_path / "a.pdf"] * 2, tmp_path / "merged.pdf")
+    data = (tmp_path / "merged.pdf").read_bytes()
+
+    document = PdfDocument(data)
+    # Every object must be where the table says, or the reader would have had
+    # to fall back to scanning the file.
+    offsets = {num: offset for num, offset in document._locations.items()
+               if offset is not None}
+    assert sorted(offsets) == list(range(1, 9))
+    for num, offset in offsets.items():
+        assert data.startswith(b"%d 0 obj" % num, offset)
+    assert len(document.pages) == 2
+    image = document.extract_page_image(1)
+    assert image is not None and image.shape == (64, 48)
+
+
+def test_merges_reportlab_documents(tmp_path):
+    paths = []
+    for name, page_count in (("one", 1), ("two", 2)):
+        path = tmp_path / f"{name}.pdf"
+        pdf = canvas.Canvas(str(path))
+        for page in range(page_count):
+            pdf.setFont("Helvetica", 12)
+            pdf.drawString(72, 720, f"{name} page {page + 1}")
+            pdf.showPage()
+        pdf.save()
+        paths.append(path)
+    pdf_merging.merge_pdfs(paths, tmp_path / "merged.pdf")
+
+    originals = []
+    for path in paths:
+        with PdfDocument.from_file(path) as document:
+            originals += [document.get_page_contents(page)
+                          for page in document.pages]
+    with PdfDocument.from_file(tmp_path / "merged.pdf") as merged:
+        assert [merged.get_page_contents(page)
+                for page in merged.pages] == originals
+        font = merged.resolve(
+            merged.resolve(merged.pages[0]["Resources"])["Font"])
+        assert merged.resolve(next(iter(font.values())))["BaseFont"] == "Helvetica"
+
+
+class _BrokenDocument():
+    """A document whose pages reference an object that can't be read."""
+    pages = [{"Type": Name("Page"), "Contents": Ref(4, 0)}]
+
+    def get_object(self, num):
+        raise ValueError(f"Object {num} is broken.")
+
+
+def test_failed_merge_leaves_no_file(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(image_pages_pdf([flate_image(make_pixels())]))
+    with pytest.raises(ValueError, match="Object 4 is broken"):
+        with pdf_merging.PdfMerger(tmp_path / "merged.pdf") as merger:
+            merger.add_file(tmp_path / "a.pdf")
+            merger.add_document(_BrokenDocument())
+    assert merger._file.closed
+    assert not (tmp_path / "merged.pdf").exists()
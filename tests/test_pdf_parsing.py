@@ -0,0 +1,159 @@
+import mmap
+import re
+
+import cv2
+import numpy as np
+import pytest
+
+import pdf_parsing
+from pdf_parsing import Keyword, Name, PdfDocument, Ref, Stream
+from pdf_samples import (PdfBuilder, ccitt_image, dct_image, flate_image,
+                         image_pages_pdf, make_bilevel_pixels, make_pixels,
+                         vector_page_pdf)
+
+
+def test_lexer_reads_all_object_types():
+    lexer = pdf_parsing._Lexer(
+        b"<< /Name#20A (a\\(b\\)\\101\\\n) /Hex <41 42 4> "
+        b"/Array [1 -2.5 .5 true false null 12 0 R /N] %comment\n/Nested << >> >>")
+    assert lexer.read_object() == {
+        "Name A": b"a(b)A",
+        "Hex": b"AB@",
+        "Array": [1, -2.5, 0.5, True, False, None, Ref(12, 0), Name("N")],
+        "Nested": {}
+    }
+    assert lexer.at_end()
+
+
+def test_lexer_does_not_read_plain_integers_as_references():
+    lexer = pdf_parsing._Lexer(b"[1 2 3 R 4 5]")
+    assert lexer.read_object() == [1, Ref(2, 3), 4, 5]
+
+
+def test_lexer_reads_operators_as_keywords():
+    lexer = pdf_parsing._Lexer(b"q 1 0 0 1 0 0 cm /Im0 Do Q")
+    tokens = []
+    while not lexer.at_end():
+        tokens.append(lexer.read_object())
+    assert tokens == ["q", 1, 0, 0, 1, 0, 0, "cm", "Im0", "Do", "Q"]
+    assert isinstance(tokens[0], Keyword) and isinstance(tokens[8], Name)
+
+
+def test_reads_xref_table():
+    pixels = make_pixels()
+    document = PdfDocument(image_pages_pdf([flate_image(pixels)]))
+    assert len(document.pages) == 1
+    np.testing.assert_array_equal(document.extract_page_image(0), pixels)
+
+
+def test_reads_xref_stream_and_object_streams():
+    first, second = make_pixels(seed=1), make_pixels(seed=2)
+    document = PdfDocument(image_pages_pdf(
+        [flate_image(first), flate_image(second)],
+        xref_stream=True, compress_objects=True))
+    assert len(document.pages) == 2
+    np.testing.assert_array_equal(document.extract_page_image(0), first)
+    np.testing.assert_array_equal(document.extract_page_image(1), second)
+
+
+def test_recovers_from_broken_xref():
+    data = image_pages_pdf([flate_image(make_pixels())])
+    broken = re.sub(rb"startxref\n\d+", b"startxref\n999999", data)
+    document = PdfDocument(broken)
+    np.testing.assert_array_equal(document.extract_page_image(0), make_pixels())
+
+
+def test_recovers_from_broken_xref_with_object_streams():
+    data = image_pages_pdf([flate_image(make_pixels())], xref_stream=True,
+                           compress_objects=True)
+    broken = re.sub(rb"startxref\n\d+", b"startxref\n12", data)
+    document = PdfDocument(broken)
+    np.testing.assert_array_equal(document.extract_page_image(0), make_pixels())
+
+
+def test_rejects_files_without_document():
+    with pytest.raises(pdf_parsing.PdfParseError):
+        PdfDocument(b"%PDF-1.4\nnothing here\n")
+
+
+def test_decodes_dct_page():
+    pixels = make_pixels(seed=3)
+    image_dict, jpeg = dct_image(pixels)
+    document = PdfDocument(image_pages_pdf([(image_dict, jpeg)]))
+    expected = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_GRAYSCALE)
+    np.testing.assert_array_equal(document.extract_page_image(0), expected)
+
+
+def test_decodes_ccitt_page():
+    pixels = make_bilevel_pixels()
+    document = PdfDocument(image_pages_pdf([ccitt_image(pixels)]))
+    np.testing.assert_array_equal(document.extract_page_image(0), pixels)
+
+
+def test_decodes_pages_in_color():
+    pixels = make_pixels()
+    document = PdfDocument(image_pages_pdf([flate_image(pixels)]))
+    image = document.extract_page_image(0, grayscale=False)
+    assert image.shape == pixels.shape + (3,)
+    np.testing.assert_array_equal(image[:, :, 1], pixels)
+
+
+@pytest.mark.parametrize("rotate, rotation", [
+    (90, cv2.ROTATE_90_CLOCKWISE),
+    (180, cv2.ROTATE_180),
+    (270, cv2.ROTATE_90_COUNTERCLOCKWISE),
+])
+def test_applies_page_rotation(rotate, rotation):
+    pixels = make_pixels()
+    document = PdfDocument(image_pages_pdf([flate_image(pixels)], rotate=rotate))
+    np.testing.assert_array_equal(document.extract_page_image(0),
+                                  cv2.rotate(pixels, rotation))
+
+
+def test_does_not_extract_vector_pages():
+    document = PdfDocument(vector_page_pdf())
+    assert len(document.pages) == 1
+    assert document.extract_page_image(0) is None
+
+
+def test_does_not_keep_streams():
+    first, second = make_pixels(seed=1), make_pixels(seed=2)
+    document = PdfDocument(image_pages_pdf(
+        [flate_image(first), flate_image(second)], xref_stream=True,
+        compress_objects=True))
+    document.extract_page_image(0)
+    document.extract_page_image(1)
+    assert not any(isinstance(value, Stream)
+                   for value in document._objects.values())
+
+
+def test_maps_files_and_maps_them_again_after_closing(tmp_path):
+    path = tmp_path / "scan.pdf"
+    pixels = make_pixels()
+    path.write_bytes(image_pages_pdf([flate_image(pixels)]))
+    with PdfDocument.from_file(path) as document:
+        assert isinstance(document.data, mmap.mmap)
+    # Closed files can be replaced, even on Windows.
+    path.replace(tmp_path / "moved.pdf")
+    (tmp_path / "moved.pdf").replace(path)
+    np.testing.assert_array_equal(document.extract_page_image(0), pixels)
+    document.close()
+
+
+def test_empty_file_is_a_parse_error(tmp_path):
+    path = tmp_path / "empty.pdf"
+    path.write_bytes(b"")
+    with pytest.raises(pdf_parsing.PdfParseError):
+        PdfDocument.from_file(path)
+
+
+def test_inherits_page_attributes():
+    builder = PdfBuilder()
+    catalog = builder.add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    builder.add(b"<< /Type /Pages /Kids [3 0 R] /Count 1 /Rotate 90 "
+                b"/MediaBox [0 0 612 792] >>")
+    builder.add(b"<< /Type /Pages /Parent 2 0 R /Kids [4 0 R] /Count 1 >>")
+    builder.add(b"<< /Type /Page /Parent 3 0 R >>")
+    document = PdfDocument(builder.build(catalog))
+    assert document.pages[0]["Rotate"] == 90
+    assert document.pages[0]["MediaBox"] == [0, 0, 612, 792]
@@ -0,0 +1,65 @@
+from PIL import Image
+
+import grid_info as grid_i
+import image_utils
+import result_cache
+import sheet_recognition
+
+
+def _count_measurements(monkeypatch):
+    calls = []
+    measure_sheet = sheet_recognition.measure_sheet
+
+    def counting_measure_sheet(*args, **kwargs):
+        calls.append(args)
+        return measure_sheet(*args, **kwargs)
+
+    monkeypatch.setattr(sheet_recognition, "measure_sheet",
+                        counting_measure_sheet)
+    return calls
+
+
+def test_reuses_measurements(tmp_path, monkeypatch, synthetic_pages):
+    image, sheet = synthetic_pages[1]
+    cache = result_cache.ResultCache(tmp_path)
+    calls = _count_measurements(monkeypatch)
+    first = sheet_recognition.recognize_sheet(image, "page", "tif",
+                                              grid_i.form_75q, cache=cache)
+    second = sheet_recognition.recognize_sheet(image, "page", "tif",
+                                               grid_i.form_75q, cache=cache)
+    assert len(calls) == 1
+    assert second.answers == first.answers == sheet.answers
+    assert second.fields == first.fields
+
+
+def test_changing_algorithm_version_misses_cache(tmp_path, monkeypatch,
+                                                 synthetic_pages):
+    image, _ = synthetic_pages[1]
+    cache = result_cache.ResultCache(tmp_path)
+    calls = _count_measurements(monkeypatch)
+    sheet_recognition.recognize_sheet(image, "page", "tif", grid_i.form_75q,
+                                      cache=cache)
+    monkeypatch.setattr(sheet_recognition, "ALGORITHM_VERSION",
+                        sheet_recognition.ALGORITHM_VERSION + 1)
+    sheet_recognition.recognize_sheet(image, "page", "tif", grid_i.form_75q,
+                                      cache=cache)
+    assert len(calls) == 2
+
+
+def test_changing_algorithm_version_misses_file_alias(tmp_path, monkeypatch,
+                                                      synthetic_pages):
+    """Pages of unchanged files are found without decoding them, which must
+    miss after an upgrade too."""
+    image, _ = synthetic_pages[1]
+    path = tmp_path / "scan.tif"
+    Image.fromarray(image).save(path)
+    page_ref = image_utils.PageRef(path, 0)
+    cache = result_cache.ResultCache(tmp_path / "cache")
+    sheet_recognition.recognize_page_ref(page_ref, grid_i.form_75q,
+                                         cache=cache)
+    assert sheet_recognition.find_cached_result(
+        page_ref, grid_i.form_75q, cache=cache) is not None
+    monkeypatch.setattr(sheet_recognition, "ALGORITHM_VERSION",
+                        sheet_recognition.ALGORITHM_VERSION + 1)
+    assert sheet_recognition.find_cached_result(
+        page_ref, grid_i.form_75q, cache=cache) is None
@@ -0,0 +1,120 @@
+import random
+
+import data_exporting
+import grid_info as grid_i
+import list_utils
+import math_utils
+import scoring
+import synthetic_sheets
+
+NUM_QUESTIONS = grid_i.form_75q.num_questions
+
+
+def _reference_score_results(results: data_exporting.OutputSheet,
+                             answer_keys: data_exporting.OutputSheet,
+                             num_questions: int) -> data_exporting.OutputSheet:
+    """Scoring as it was done before answers were encoded as matrices: one
+    string comparison per answer."""
+    answers = results.data
+    keys = scoring.establish_key_dict(answer_keys)
+    form_code_column_name = data_exporting.COLUMN_NAMES[
+        grid_i.Field.TEST_FORM_CODE]
+    form_code_index = list_utils.find_index(answers[0], form_code_column_name)
+    answers_start_index = list_utils.find_index(
+        answers[0][form_code_index + 1:], "Q1") + form_code_index + 1
+    columns = results.field_columns + [grid_i.VirtualField.SCORE,
+                                       grid_i.VirtualField.POINTS]
+    scored_results = data_exporting.OutputSheet(columns, num_questions)
+    for exam in answers[1:]:
+        fields = dict(zip(results.field_columns, exam[:answers_start_index]))
+        key = keys.get("*", keys.get(exam[form_code_index]))
+        if key is None:
+            fields[grid_i.VirtualField.SCORE] = data_exporting.KEY_NOT_FOUND_MESSAGE
+            fields[grid_i.VirtualField.POINTS] = data_exporting.KEY_NOT_FOUND_MESSAGE
+            scored_answers = []
+        else:
+            scored_answers = [
+                int(actual == correct)
+                for actual, correct in zip(exam[answers_start_index:], key)
+            ]
+            fields[grid_i.VirtualField.SCORE] = str(
+                round(math_utils.mean(scored_answers) * 100, 2))
+            fields[grid_i.VirtualField.POINTS] = str(sum(scored_answers))
+        scored_results.add(fields, [str(s) for s in scored_answers])
+    return scored_results
+
+
+def _make_sheets(keys, exams):
+    results = data_exporting.OutputSheet([x for x in grid_i.Field],
+                                         NUM_QUESTIONS)
+    answer_keys = data_exporting.OutputSheet(
+        [grid_i.Field.TEST_FORM_CODE, grid_i.Field.IMAGE_FILE], NUM_QUESTIONS)
+    for form_code, answers in keys:
+        answer_keys.add({grid_i.Field.TEST_FORM_CODE: form_code}, answers)
+    for i, (fields, answers) in enumerate(exams):
+        results.add({**fields, grid_i.Field.IMAGE_FILE: f"page_{i + 1}"},
+                    answers)
+    return results, answer_keys
+
+
+def _random_exams(rng, form_codes, count):
+    exams = []
+    for _ in range(count):
+        sheet = synthetic_sheets.make_random_sheet(
+            rng, grid_i.form_75q, form_code=rng.choice(form_codes))
+        exams.append((sheet.fields, list(sheet.answers)))
+    return exams
+
+
+def _random_key(rng, form_code):
+    sheet = synthetic_sheets.make_random_sheet(
+        rng, grid_i.form_75q, grid_i.KEY_STUDENT_ID, form_code)
+    return form_code, list(sheet.answers)
+
+
+def test_scores_match_reference():
+    rng = random.Random(3)
+    keys = [_random_key(rng, "A"), _random_key(rng, "B")]
+    # Some keys leave the last questions blank, as short tests do.
+    keys[1] = ("B", keys[1][1][:60] + [""] * 15)
+    # Form C has no key.
+    exams = _random_exams(rng, ["A", "B", "C"], 60)
+    # Answers edited by hand, multi-marks written out of order and short rows
+    # only match the same text.
+    keys[0][1][:4] = ["A", "[A|B]", "[A|B]", "B"]
+    exams[0][0][grid_i.Field.TEST_FORM_CODE] = "A"
+    exams[0][1][:4] = ["a", "[B|A]", "[A|B]", "Maybe"]
+    exams[1] = (exams[1][0], exams[1][1][:30])
+    results, answer_keys = _make_sheets(keys, exams)
+
+    scores, _ = scoring.score_and_analyze(results, answer_keys, NUM_QUESTIONS)
+    assert scores.data == _reference_score_results(results, answer_keys,
+                                                   NUM_QUESTIONS).data
+
+
+def test_wildcard_key_scores_every_exam():
+    rng = random.Random(4)
+    keys = [_random_key(rng, "*")]
+    exams = _random_exams(rng, ["A", "B"], 20)
+    results, answer_keys = _make_sheets(keys, exams)
+
+    scores, _ = scoring.score_and_analyze(results, answer_keys, NUM_QUESTIONS)
+    assert scores.data == _reference_score_results(results, answer_keys,
+                                                   NUM_QUESTIONS).data
+
+
+def test_item_analysis_p_values():
+    keys = [("A", ["A", "B", "C"] + [""] * (NUM_QUESTIONS - 3))]
+    exams = [({grid_i.Field.TEST_FORM_CODE: "A"}, answers)
+             for answers in (["A", "B", "C"], ["A", "B", "D"],
+                             ["A", "C", "D"], ["B", "C", "D"])]
+    results, answer_keys = _make_sheets(keys, exams)
+
+    _, item_analysis = scoring.score_and_analyze(results, answer_keys,
+                                                 NUM_QUESTIONS)
+    assert item_analysis[0] == scoring.ITEM_ANALYSIS_COLUMNS
+    assert [row[:5] for row in item_analysis[1:]] == [
+        ["A", "Q1", "A", "4", "0.75"],
+        ["A", "Q2", "B", "4", "0.5"],
+        ["A", "Q3", "C", "4", "0.25"],
+    ]